@@ -0,0 +1,117 @@
+"""Batch extraction and cleanup of PDFs across a process pool, without the GUI"""
+import argparse
+import glob
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from book_export import EXPORT_FORMATS, add_cleanup_arguments, export_book, rules_from_args
+from cleanup_pipeline import STAGES
+from marker_rules import DEFAULT_RULES
+from page_cache import PageCache
+
+
+def process_book(file_path, output_dir, start=None, end=None, contents_start=None, contents_end=None,
+                 rules=DEFAULT_RULES, stages=STAGES, page_workers=1, cache_dir=None, cache_size_mb=None,
+                 fmt="txt", layout=False, pages=None, contents_pages=None):
+    """Extract and clean one PDF and write the result to output_dir, returns the output path
+
+    Pages go through the cleanup pipeline as they are extracted and are
+    written out right away, so the whole book is never held in memory.
+    """
+    cache = None
+    if cache_dir is not None:
+        max_bytes = int(cache_size_mb * 1024 * 1024) if cache_size_mb is not None else None
+        cache = PageCache(cache_dir, max_bytes)
+
+    output_dir = Path(output_dir)
+    output_path = output_dir / f"{Path(file_path).stem}.{fmt}"
+    try:
+        contents = export_book(file_path, output_path, fmt, start, end, contents_start, contents_end,
+                               rules, stages, page_workers, cache, layout, pages, contents_pages)
+    finally:
+        if cache is not None:
+            cache.close()
+
+    # Write the analyzed contents next to the book text
+    if contents.contents_lines is not None:
+        contents_path = output_dir / f"{Path(file_path).stem}.contents.txt"
+        contents_path.write_text('\n'.join(contents.contents_lines) + "\n", encoding="utf-8")
+
+    return str(output_path)
+
+
+def collect_pdfs(inputs):
+    """Expand directories and glob patterns into a sorted, de-duplicated list of PDF paths"""
+    pdfs = []
+    seen = set()
+    for item in inputs:
+        if os.path.isdir(item):
+            matches = sorted(str(p) for p in Path(item).glob("*.pdf"))
+        else:
+            matches = sorted(glob.glob(item, recursive=True))
+        for path in matches:
+            if path.lower().endswith(".pdf") and path not in seen:
+                seen.add(path)
+                pdfs.append(path)
+    return pdfs
+
+
+def run_batch(pdfs, output_dir, workers=None, **options):
+    """Process PDFs across a process pool, returns a list of (path, output_path, error)"""
+    results = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(process_book, path, output_dir, **options): path for path in pdfs}
+        for future in as_completed(futures):
+            path = futures[future]
+            try:
+                output_path = future.result()
+                results.append((path, output_path, None))
+                print(f"Processed {path} -> {output_path}")
+            except Exception as e:
+                results.append((path, None, str(e)))
+                print(f"Error processing {path}: {str(e)}", file=sys.stderr)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Extract and clean PDFs without the GUI")
+    parser.add_argument("inputs", nargs="+", help="PDF files, directories or glob patterns")
+    parser.add_argument("-o", "--output-dir", default="book_summary_output", help="Directory for the cleaned text")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="Number of worker processes")
+    parser.add_argument("-f", "--format", choices=EXPORT_FORMATS, default="txt", help="Output format")
+    add_cleanup_arguments(parser)
+    args = parser.parse_args(argv)
+
+    rules, stages = rules_from_args(parser, args)
+
+    pdfs = collect_pdfs(args.inputs)
+    if not pdfs:
+        print("No PDF files found", file=sys.stderr)
+        return 1
+
+    results = run_batch(
+        pdfs,
+        args.output_dir,
+        workers=args.workers,
+        start=args.start,
+        end=args.end,
+        contents_start=args.contents_start,
+        contents_end=args.contents_end,
+        rules=rules,
+        stages=stages,
+        page_workers=args.page_workers,
+        cache_dir=args.cache_dir,
+        cache_size_mb=args.cache_size_mb,
+        fmt=args.format,
+        layout=args.layout,
+        pages=args.pages,
+        contents_pages=args.contents_pages,
+    )
+    failed = [r for r in results if r[2] is not None]
+    print(f"Processed {len(results) - len(failed)} of {len(results)} PDFs")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,391 @@
+"""Benchmarks of extraction and cleanup on synthetic books generated with PyMuPDF"""
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+import fitz  # PyMuPDF
+import book_engine
+from book_document import BookDocument, Page
+from book_export import write_export
+from cleanup_pipeline import CleanupPipeline
+from marker_rules import DEFAULT_RULES, DEFAULT_SPECIAL_CHARS
+
+DEFAULT_SIZES = (10, 100, 1000, 5000)
+DEFAULT_OUTPUT = "benchmark_results.json"
+
+# Synthetic PDFs are kept here between runs unless --pdf-dir says otherwise
+DEFAULT_PDF_DIR = Path(tempfile.gettempdir()) / "book_summary_benchmark"
+
+# A stage counts as a regression when its throughput drops by more than this fraction
+DEFAULT_TOLERANCE = 0.2
+
+BOOK_TITLE = "The Synthetic Book"
+WORDS = ("lorem", "ipsum", "dolor", "sit", "amet", "consectetur", "adipiscing", "elit", "sed", "do",
+         "eiusmod", "tempor", "incididunt", "labore", "magna", "aliqua", "enim", "minim", "veniam")
+CONTENTS_ENTRIES_PER_PAGE = 40
+
+
+class BookLayout:
+    """Shape of a synthetic book, also the cache key of its generated PDF"""
+
+    def __init__(self, pages, endnotes_per_page=2, lines_per_page=30, chapter_pages=20,
+                 special_chars=DEFAULT_SPECIAL_CHARS, seed=0):
+        self.pages = pages  # Main text pages, the contents pages come in front of them
+        self.endnotes_per_page = endnotes_per_page
+        self.lines_per_page = lines_per_page
+        self.chapter_pages = chapter_pages
+        self.special_chars = special_chars.split()
+        self.seed = seed
+
+    @property
+    def chapters(self):
+        return -(-self.pages // self.chapter_pages)
+
+    @property
+    def contents_pages(self):
+        return max(1, -(-self.chapters // CONTENTS_ENTRIES_PER_PAGE))
+
+    def file_name(self):
+        return (f"book_{self.pages}p_{self.endnotes_per_page}n_{self.lines_per_page}l_"
+                f"{self.chapter_pages}c_{len(self.special_chars)}s_{self.seed}.pdf")
+
+
+def generate_book(path, layout):
+    """Write a synthetic book: contents pages, then chapters with running headers, endnotes and page numbers"""
+    rng = random.Random(layout.seed)
+    doc = fitz.open()
+    # Helvetica has no glyphs for most endnote symbols
+    symbol_font = fitz.Font("cjk")
+
+    def sentence(words=10):
+        return " ".join(rng.choice(WORDS) for _ in range(words))
+
+    # Table of contents with dotted leaders, the printed page numbers start at 1 after it
+    chapter = 1
+    for _ in range(layout.contents_pages):
+        page = doc.new_page()
+        y = 72
+        if chapter == 1:
+            page.insert_text((72, y), "Contents", fontsize=14)
+            y += 24
+        for _ in range(CONTENTS_ENTRIES_PER_PAGE):
+            if chapter > layout.chapters:
+                break
+            printed = (chapter - 1) * layout.chapter_pages + 1
+            page.insert_text((72, y), f"Chapter {chapter} {sentence(3).title()} ....... {printed}", fontsize=10)
+            y += 16
+            chapter += 1
+
+    for i in range(layout.pages):
+        page = doc.new_page()
+        y = 50
+        if i % layout.chapter_pages == 0:
+            # Chapter openings have no running header
+            page.insert_text((72, y + 40), f"Chapter {i // layout.chapter_pages + 1}", fontsize=16)
+            page.insert_text((300, 780), str(i + 1), fontsize=9)
+            y += 80
+        else:
+            header = BOOK_TITLE if i % 2 else f"Chapter {i // layout.chapter_pages + 1}"
+            page.insert_text((72, y), header, fontsize=9)
+            # Page number in the header line, it comes out as a line of its own
+            page.insert_text((520, y), str(i + 1), fontsize=9)
+            y += 30
+
+        # One call per block of lines, inserting line by line is several times slower
+        body = "\n".join(sentence() for _ in range(layout.lines_per_page))
+        page.insert_text((72, y), body, fontsize=10, lineheight=1.4)
+        y += 14 * layout.lines_per_page + 10
+
+        writer = fitz.TextWriter(page.rect)
+        for n in range(layout.endnotes_per_page):
+            symbol = layout.special_chars[n % len(layout.special_chars)]
+            writer.append((72, y), f"{symbol} {sentence(8)}", font=symbol_font, fontsize=8)
+            y += 11
+            if n % 2 == 0:
+                # Every other endnote continues on a second line
+                writer.append((80, y), sentence(6), font=symbol_font, fontsize=8)
+                y += 11
+        writer.write_text(page)
+
+    doc.subset_fonts()
+    doc.save(str(path), garbage=1, deflate=True)
+    doc.close()
+
+
+def book_path(layout, pdf_dir=None):
+    """Path of the synthetic book for layout, generated on first use"""
+    pdf_dir = Path(pdf_dir) if pdf_dir is not None else DEFAULT_PDF_DIR
+    pdf_dir.mkdir(parents=True, exist_ok=True)
+    path = pdf_dir / layout.file_name()
+    if not path.is_file():
+        generate_book(path, layout)
+    return path
+
+
+class BookRun:
+    """The state the stages of one benchmark run hand to each other"""
+
+    def __init__(self, path, contents_pages, workers, output_dir):
+        self.path = str(path)
+        self.contents_pages = contents_pages
+        self.workers = workers
+        self.output_dir = output_dir
+        self.page_texts = None
+        self.contents_text = None
+        self.document = None
+
+
+def stage_process_pdf(run):
+    # What the app does on upload without Tk: open, contents, extract every page into the document
+    doc = book_engine.open_pdf(run.path)
+    try:
+        document = BookDocument()
+        document.set_contents(book_engine.extract_contents(doc, range(1, run.contents_pages + 1), run.workers))
+        pages = book_engine.iter_page_texts(doc, range(run.contents_pages, doc.page_count), run.workers)
+        for page_num, page_text, error in pages:
+            document.add_page(Page.from_extraction(page_num, page_text, error))
+    finally:
+        doc.close()
+
+
+def stage_extract(run):
+    doc = book_engine.open_pdf(run.path)
+    try:
+        run.page_texts = book_engine.extract_page_texts(doc, range(run.contents_pages, doc.page_count), run.workers)
+        run.contents_text = book_engine.extract_contents_text(doc, range(1, run.contents_pages + 1))
+    finally:
+        doc.close()
+
+
+def stage_analyze_contents(run):
+    book_engine.analyze_contents(run.contents_text)
+
+
+def stage_process_page_endnotes(run):
+    rules = DEFAULT_RULES.compile()
+    for _, page_text, _ in run.page_texts:
+        book_engine.process_page_endnotes(book_engine.clean_page_lines(page_text) or [""], rules)
+
+
+def stage_process_page_headers(run):
+    rules = DEFAULT_RULES.compile()
+    previous_page_empty = True
+    for _, page_text, _ in run.page_texts:
+        page_lines = book_engine.clean_page_lines(page_text) or [""]
+        book_engine.process_page_headers(page_lines, previous_page_empty, rules)
+        previous_page_empty = sum(1 for line in page_lines if line.strip()) <= 2
+
+
+def stage_build_document(run):
+    run.document = BookDocument()
+    for page_num, page_text, error in run.page_texts:
+        run.document.add_page(Page.from_extraction(page_num, page_text, error))
+
+
+def stage_mark_endnotes(run):
+    run.document.mark_endnotes()
+
+
+def stage_mark_headers(run):
+    run.document.mark_headers()
+
+
+def stage_mark_page_numbers(run):
+    run.document.mark_page_numbers()
+
+
+def stage_cleanup_pipeline(run):
+    # Fresh pages, the mark stages above already flagged the document's
+    document = BookDocument()
+    for page_num, page_text, error in run.page_texts:
+        document.add_page(Page.from_extraction(page_num, page_text, error))
+    CleanupPipeline().run(document)
+
+
+def stage_layout_document(run):
+    # Single-pass alternative to extract, build_document and the mark stages
+    doc = book_engine.open_pdf(run.path)
+    try:
+        rules = DEFAULT_RULES.compile()
+        document = BookDocument()
+        pages = book_engine.iter_page_texts(doc, range(run.contents_pages, doc.page_count), run.workers, layout=True)
+        for page_num, layout_text, error in pages:
+            document.add_page(Page.from_layout(page_num, layout_text, error, rules))
+    finally:
+        doc.close()
+
+
+def stage_export(run):
+    write_export(Path(run.output_dir) / "export.txt", book_engine.BookExtraction(""), run.document.pages)
+
+
+# Stages in run order, later stages use what the earlier ones left in BookRun
+STAGES = (
+    ("process_pdf", stage_process_pdf),
+    ("extract", stage_extract),
+    ("analyze_contents", stage_analyze_contents),
+    ("process_page_endnotes", stage_process_page_endnotes),
+    ("process_page_headers", stage_process_page_headers),
+    ("build_document", stage_build_document),
+    ("mark_endnotes", stage_mark_endnotes),
+    ("mark_headers", stage_mark_headers),
+    ("mark_page_numbers", stage_mark_page_numbers),
+    ("cleanup_pipeline", stage_cleanup_pipeline),
+    ("layout_document", stage_layout_document),
+    ("export", stage_export),
+)
+
+
+def run_stages(path, layout, workers, trace_memory):
+    """Run every stage once, returns {stage: (seconds, peak bytes allocated by the stage or None)}"""
+    measurements = {}
+    with tempfile.TemporaryDirectory() as output_dir:
+        run = BookRun(path, layout.contents_pages, workers, output_dir)
+        for name, stage in STAGES:
+            if trace_memory:
+                tracemalloc.reset_peak()
+                before = tracemalloc.get_traced_memory()[0]
+            started = time.perf_counter()
+            stage(run)
+            seconds = time.perf_counter() - started
+            # Peak on top of what earlier stages left allocated
+            peak = tracemalloc.get_traced_memory()[1] - before if trace_memory else None
+            measurements[name] = (seconds, peak)
+    return measurements
+
+
+def benchmark_book(layout, workers=1, repeat=3, trace_memory=True, pdf_dir=None):
+    """Benchmark every stage on one synthetic book, returns a list of result records
+
+    Times are the best of repeat runs without tracing; peak Python memory
+    comes from one extra run under tracemalloc, since tracing slows the
+    code down.
+    """
+    path = book_path(layout, pdf_dir)
+    best = {}
+    for _ in range(repeat):
+        for name, (seconds, _) in run_stages(path, layout, workers, False).items():
+            best[name] = min(seconds, best.get(name, seconds))
+
+    peaks = {}
+    if trace_memory:
+        tracemalloc.start()
+        try:
+            peaks = {name: peak for name, (_, peak) in run_stages(path, layout, workers, True).items()}
+        finally:
+            tracemalloc.stop()
+
+    results = []
+    for name, _ in STAGES:
+        seconds = best[name]
+        # Contents analysis works on the contents pages, every other stage on the main text
+        pages = layout.contents_pages if name == "analyze_contents" else layout.pages
+        results.append({
+            "pages": layout.pages,
+            "stage": name,
+            "seconds": round(seconds, 6),
+            "pages_per_sec": round(pages / seconds, 2) if seconds > 0 else None,
+            "peak_mb": round(peaks[name] / (1024 * 1024), 3) if name in peaks else None,
+        })
+    return results
+
+
+def max_rss_mb():
+    """Peak resident memory of this process, in MB"""
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, kilobytes elsewhere
+    return round(rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024, 1)
+
+
+def environment():
+    return {
+        "python": platform.python_version(),
+        "pymupdf": fitz.VersionBind,
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+def compare_results(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """Stages whose throughput dropped by more than tolerance against baseline, as readable lines"""
+    previous = {(r["pages"], r["stage"]): r for r in baseline["results"]}
+    regressions = []
+    for result in results:
+        old = previous.get((result["pages"], result["stage"]))
+        if old is None or not old["pages_per_sec"] or not result["pages_per_sec"]:
+            continue
+        change = result["pages_per_sec"] / old["pages_per_sec"] - 1
+        if change < -tolerance:
+            regressions.append(
+                f"{result['stage']} at {result['pages']} pages: {old['pages_per_sec']:.1f} -> "
+                f"{result['pages_per_sec']:.1f} pages/sec ({change:+.0%})")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark extraction and cleanup on synthetic PDFs")
+    parser.add_argument("--sizes", default=",".join(str(size) for size in DEFAULT_SIZES),
+                        help="Comma separated main text page counts")
+    parser.add_argument("--endnotes", type=int, default=2, help="Endnotes per page")
+    parser.add_argument("--lines", type=int, default=30, help="Body lines per page")
+    parser.add_argument("--chapter-pages", type=int, default=20, help="Pages per chapter")
+    parser.add_argument("--special-chars", default=DEFAULT_SPECIAL_CHARS, help="Endnote starting characters")
+    parser.add_argument("-j", "--workers", type=int, default=1, help="Extraction worker processes")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per book, the best time is kept")
+    parser.add_argument("--no-memory", action="store_true", help="Skip the tracemalloc run")
+    parser.add_argument("--pdf-dir", help="Where the synthetic PDFs are kept")
+    parser.add_argument("-o", "--output", default=DEFAULT_OUTPUT, help="JSON file for the results")
+    parser.add_argument("--baseline", help="Results of an earlier run to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="Allowed throughput drop against the baseline, as a fraction")
+    args = parser.parse_args(argv)
+
+    try:
+        sizes = [int(size) for size in args.sizes.split(",") if size.strip()]
+    except ValueError:
+        parser.error("--sizes takes comma separated page counts")
+
+    results = []
+    for size in sizes:
+        layout = BookLayout(size, args.endnotes, args.lines, args.chapter_pages, args.special_chars)
+        print(f"Benchmarking {size} pages...")
+        for result in benchmark_book(layout, args.workers, max(1, args.repeat), not args.no_memory, args.pdf_dir):
+            results.append(result)
+            peak = f", peak {result['peak_mb']:.1f} MB" if result["peak_mb"] is not None else ""
+            print(f"  {result['stage']:<22} {result['seconds']:9.4f}s {result['pages_per_sec'] or 0:12.1f} pages/sec{peak}")
+
+    report = {
+        "environment": environment(),
+        "settings": {
+            "endnotes_per_page": args.endnotes,
+            "lines_per_page": args.lines,
+            "chapter_pages": args.chapter_pages,
+            "special_chars": args.special_chars,
+            "workers": args.workers,
+            "repeat": args.repeat,
+        },
+        "max_rss_mb": max_rss_mb(),
+        "results": results,
+    }
+    Path(args.output).write_text(json.dumps(report, indent=2), encoding="utf-8")
+    print(f"Wrote {args.output}")
+
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text(encoding="utf-8"))
+        regressions = compare_results(results, baseline, args.tolerance)
+        for line in regressions:
+            print(f"Regression: {line}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,399 @@
+"""Page-indexed document model behind the main text area"""
+import bisect
+import json
+
+from book_engine import (
+    clean_page_lines,
+    find_layout_markers,
+    find_page_endnotes,
+    find_page_header,
+    format_header,
+)
+from book_search import SearchIndex
+from marker_rules import DEFAULT_RULES
+
+# Per-line tag flags
+ENDNOTE = 1
+ENDNOTE_START = 2  # First line of an endnote, the following ENDNOTE lines continue it
+HEADER = 4
+PAGE_NUMBER = 8
+CONTENTS = 16
+
+MARKER_FLAGS = ENDNOTE | HEADER | PAGE_NUMBER
+
+
+class Line:
+    """One extracted line and the markers found on it"""
+    __slots__ = ("text", "flags")
+
+    def __init__(self, text, flags=0):
+        self.text = text
+        self.flags = flags
+
+    def render(self, markup=True):
+        """Render the line on its own, with header or page number markup unless markup is off"""
+        if not markup:
+            return self.text
+        if self.flags & HEADER:
+            return format_header(self.text)
+        if self.flags & PAGE_NUMBER:
+            return f"<N>{self.text.strip()}</N>"
+        return self.text
+
+
+class Page:
+    """A page of the book as a list of Line records"""
+    __slots__ = ("number", "lines", "leading")
+
+    def __init__(self, number, lines, leading="\n"):
+        self.number = number  # 1-based page number in the PDF
+        self.lines = lines
+        self.leading = leading  # Text in front of the page sentinel
+
+    @classmethod
+    def from_extraction(cls, page_num, page_text, error):
+        """Build a page from one (page_num, text, error) extraction result"""
+        if error is not None:
+            return cls(page_num + 1, [Line(f"[Error: {str(error)}]")])
+        lines = clean_page_lines(page_text)
+        if lines is None:
+            # Empty pages keep their single empty line
+            return cls(page_num + 1, [Line("")], leading="")
+        return cls(page_num + 1, [Line(text) for text in lines])
+
+    @classmethod
+    def from_layout(cls, page_num, layout_text, error, rules):
+        """Build a page from one layout extraction result with its markers already flagged
+
+        rules are CompiledRules. Pages without footnotes in smaller type get
+        their endnotes from the text rules, like mark_endnotes.
+        """
+        if error is not None:
+            return cls.from_extraction(page_num, None, error)
+        lines, headers, page_numbers, footnotes = find_layout_markers(json.loads(layout_text), rules)
+        if lines is None:
+            return cls(page_num + 1, [Line("")], leading="")
+        page = cls(page_num + 1, [Line(text) for text in lines])
+        for i in headers:
+            page.lines[i].flags |= HEADER
+        for i in page_numbers:
+            page.lines[i].flags |= PAGE_NUMBER
+        if footnotes is None:
+            # Header, footer and page number lines close an endnote like empty lines do
+            texts = ["" if line.flags else line.text for line in page.lines]
+            footnotes = find_page_endnotes(texts, rules)
+        for first, last in footnotes:
+            page.lines[first].flags |= ENDNOTE | ENDNOTE_START
+            for line in page.lines[first + 1:last + 1]:
+                line.flags |= ENDNOTE
+        return page
+
+    def display_lines(self, markup=True):
+        """Yield (text, marker flags) per displayed line, joining each endnote into one line
+
+        The flags of an endnote line are those of all the lines joined into it.
+        """
+        endnote = None
+        endnote_flags = 0
+        for line in self.lines:
+            if line.flags & ENDNOTE:
+                if line.flags & ENDNOTE_START or endnote is None:
+                    if endnote is not None:
+                        yield (f"<E>{endnote}</E>" if markup else endnote), endnote_flags
+                    endnote = line.text
+                    endnote_flags = line.flags & MARKER_FLAGS
+                else:
+                    endnote += f" {line.render(markup).lstrip()}"
+                    endnote_flags |= line.flags & MARKER_FLAGS
+                continue
+            if endnote is not None:
+                yield (f"<E>{endnote}</E>" if markup else endnote), endnote_flags
+                endnote = None
+            yield line.render(markup), line.flags & MARKER_FLAGS
+        if endnote is not None:
+            yield (f"<E>{endnote}</E>" if markup else endnote), endnote_flags
+
+    def render_lines(self, markup=True):
+        """Yield the displayed lines, joining each endnote into one <E> line"""
+        for text, _ in self.display_lines(markup):
+            yield text
+
+    def render(self, markup=True):
+        """Render the page block, with <E>, <H> and <N> markup unless markup is off"""
+        text = f"{self.leading}=== Page {self.number} ===\n\n"
+        if self.lines:
+            text += '\n'.join(self.render_lines(markup)) + "\n"
+        return text
+
+    def header_lines(self):
+        """Number of lines rendered in front of the first displayed line"""
+        return self.leading.count("\n") + 2
+
+    def spans(self):
+        """(displayed line, marker flags) of every displayed line carrying a marker"""
+        return [(i, flags) for i, (_, flags) in enumerate(self.display_lines(markup=False)) if flags]
+
+    def non_empty_count(self):
+        """Number of non-empty displayed lines, an endnote counts once"""
+        return sum(
+            1 for line in self.lines
+            if line.text.strip() and (not line.flags & ENDNOTE or line.flags & ENDNOTE_START)
+        )
+
+    def mark_endnotes(self, rules):
+        """Flag the endnote lines using CompiledRules, returns True if the page changed"""
+        before = [line.flags for line in self.lines]
+        for line in self.lines:
+            line.flags &= ~(ENDNOTE | ENDNOTE_START)
+
+        # Lines marked as something else can't start an endnote
+        texts = [line.render() if line.flags & MARKER_FLAGS else line.text for line in self.lines]
+        for first, last in find_page_endnotes(texts, rules):
+            self.lines[first].flags |= ENDNOTE | ENDNOTE_START
+            for line in self.lines[first + 1:last + 1]:
+                line.flags |= ENDNOTE
+
+        return [line.flags for line in self.lines] != before
+
+    def mark_header(self, previous_page_empty, rules):
+        """Flag the running header line using CompiledRules, returns True if the page changed"""
+        header_index = find_page_header([line.text for line in self.lines], previous_page_empty, rules)
+        # Lines already marked as something else are not headers
+        if header_index is not None and self.lines[header_index].flags & MARKER_FLAGS & ~HEADER:
+            header_index = None
+
+        changed = False
+        for i, line in enumerate(self.lines):
+            if (i == header_index) != bool(line.flags & HEADER):
+                line.flags ^= HEADER
+                changed = True
+        return changed
+
+    def counts_as_empty(self):
+        """A page with at most 2 non-empty lines counts as empty when looking for the next page's header"""
+        return self.non_empty_count() <= 2
+
+    def mark_page_numbers(self, rules):
+        """Flag page number lines using CompiledRules, returns True if the page changed"""
+        changed = False
+        for line in self.lines:
+            if not line.flags & MARKER_FLAGS and rules.is_page_number(line.text):
+                line.flags |= PAGE_NUMBER
+                changed = True
+        return changed
+
+    def state(self):
+        """The page's lines and a copy of their flags, which operations change in place; flags fit in a byte"""
+        return list(self.lines), bytes(line.flags for line in self.lines)
+
+    def restore(self, state):
+        """Put back the lines and flags of a state()"""
+        lines, flags = state
+        self.lines = list(lines)
+        for line, line_flags in zip(self.lines, flags):
+            line.flags = line_flags
+
+    def remove_flagged(self, flag):
+        """Drop the lines carrying flag, returns True if any were removed"""
+        kept = [line for line in self.lines if not line.flags & flag]
+        if len(kept) == len(self.lines):
+            return False
+        self.lines = kept
+        return True
+
+
+class SpanIndex:
+    """Sorted (page number, displayed line) spans of each marker kind
+
+    Lets the remove operations visit only the pages holding a marker, and
+    the viewer find the spans of a range of pages without looking at the
+    other pages of the book.
+    """
+
+    def __init__(self):
+        self.spans = {ENDNOTE: [], HEADER: [], PAGE_NUMBER: []}
+        self.marked_pages = set()
+
+    def update(self, pages):
+        """Replace the spans of the given pages with their current markers"""
+        pages = list(pages)
+        self._replace({page.number for page in pages},
+                      [(page.number, line, flags) for page in pages for line, flags in page.spans()])
+
+    def remove(self, numbers):
+        """Drop the spans of the given page numbers"""
+        self._replace(set(numbers), [])
+
+    def _replace(self, numbers, new):
+        stale = numbers & self.marked_pages
+        if not stale and not new:
+            return
+        for flag, spans in self.spans.items():
+            if stale:
+                spans = [span for span in spans if span[0] not in stale]
+            added = [(number, line) for number, line, flags in new if flags & flag]
+            if added:
+                # Mostly sorted already, so this sort stays close to linear
+                spans += added
+                spans.sort()
+            self.spans[flag] = spans
+        self.marked_pages = (self.marked_pages - numbers) | {number for number, _, _ in new}
+
+    def pages_with(self, flag):
+        """Sorted numbers of the pages holding a marker of the given kind"""
+        numbers = []
+        for number, _ in self.spans[flag]:
+            if not numbers or numbers[-1] != number:
+                numbers.append(number)
+        return numbers
+
+    def in_pages(self, flag, first, last):
+        """Spans of the given kind on pages first to last, inclusive"""
+        spans = self.spans[flag]
+        return spans[bisect.bisect_left(spans, (first,)):bisect.bisect_left(spans, (last + 1,))]
+
+    def count(self, flag):
+        return len(self.spans[flag])
+
+
+class BookDocument:
+    """The extracted book: analyzed contents plus pages indexed by page number"""
+
+    def __init__(self):
+        self.pages = []
+        self.page_index = {}  # Page number -> position in self.pages
+        self.preamble = ""  # Raw contents pages kept when their analysis failed
+        self.contents_lines = []
+        self.contents_table = []
+        self.markers = SpanIndex()  # Marker spans of all pages, kept current by the methods below
+        self.search = SearchIndex()  # Words of all pages, kept current the same way
+        self.recorder = None  # Called with (page number, page state) right before the methods below change a page
+
+    def set_contents(self, extraction):
+        """Take the contents part of a BookExtraction"""
+        self.preamble = extraction.text
+        self.contents_table = extraction.contents_table
+        self.contents_lines = []
+        if extraction.contents_lines is not None:
+            entries = {f"{entry['text']} {entry['page']}" for entry in extraction.contents_table}
+            self.contents_lines = [
+                Line(text, CONTENTS if text.strip() in entries else 0) for text in extraction.contents_lines
+            ]
+
+    def add_page(self, page):
+        self.page_index[page.number] = len(self.pages)
+        self.pages.append(page)
+        self.markers.update([page])
+        self.search.update([page])
+
+    def insert_page(self, page):
+        """Insert a page keeping the pages in page number order"""
+        if not self.pages or page.number > self.pages[-1].number:
+            self.add_page(page)
+            return
+        position = bisect.bisect_left([p.number for p in self.pages], page.number)
+        self.pages.insert(position, page)
+        self.reindex()
+        self.markers.update([page])
+        self.search.update([page])
+
+    def remove_pages(self, numbers):
+        """Drop the pages with the given numbers"""
+        numbers = set(numbers)
+        if not numbers:
+            return
+        self.pages = [page for page in self.pages if page.number not in numbers]
+        self.reindex()
+        self.markers.remove(numbers)
+        self.search.remove(numbers)
+
+    def reindex(self):
+        self.page_index = {page.number: position for position, page in enumerate(self.pages)}
+
+    def get_page(self, number):
+        return self.pages[self.page_index[number]]
+
+    def next_page(self, number):
+        """The page after the given page number, or None for the last page"""
+        position = self.page_index[number] + 1
+        return self.pages[position] if position < len(self.pages) else None
+
+    def render(self, markup=True):
+        return self.preamble + ''.join(page.render(markup) for page in self.pages)
+
+    def pages_changed(self, numbers, lines_changed=True):
+        """Bring the marker spans and search index of pages changed outside the methods below up to date
+
+        Set lines_changed to False when only header or page number flags
+        changed: the displayed lines stay the same, so the pages are not
+        indexed for search again.
+        """
+        pages = [self.get_page(number) for number in numbers]
+        self.markers.update(pages)
+        if lines_changed:
+            self.search.update(pages)
+        return numbers
+
+    def state_before(self, page):
+        """State of a page about to be changed for the recorder, None without one"""
+        return page.state() if self.recorder is not None else None
+
+    def record(self, page, before):
+        """Hand the state_before of a page that did change to the recorder"""
+        if self.recorder is not None:
+            self.recorder(page.number, before)
+
+    def change_pages(self, pages, change, lines_changed=True):
+        """Run change(page) on the pages, returns the numbers of the ones it returned True for, see pages_changed"""
+        changed = []
+        for page in pages:
+            before = self.state_before(page)
+            if change(page):
+                changed.append(page.number)
+                self.record(page, before)
+        return self.pages_changed(changed, lines_changed)
+
+    def mark_endnotes(self, rules=DEFAULT_RULES):
+        """Flag endnote lines on every page, returns the numbers of changed pages"""
+        compiled = rules.compile()
+        return self.change_pages(self.pages, lambda page: page.mark_endnotes(compiled))
+
+    def mark_headers(self, rules=DEFAULT_RULES):
+        """Flag the running header of every page, returns the numbers of changed pages"""
+        compiled = rules.compile()
+        changed = []
+        previous_page_empty = True
+        previous_number = None
+        for page in self.pages:
+            if previous_number is not None and page.number != previous_number + 1:
+                previous_page_empty = True  # Gap in the page selection, see CleanupPipeline.process
+            previous_number = page.number
+            before = self.state_before(page)
+            if page.mark_header(previous_page_empty, compiled):
+                changed.append(page.number)
+                self.record(page, before)
+            if page.lines:
+                previous_page_empty = page.counts_as_empty()
+        return self.pages_changed(changed, lines_changed=False)
+
+    def mark_page_numbers(self, rules=DEFAULT_RULES):
+        """Flag lines holding only digits or special characters, returns the numbers of changed pages"""
+        compiled = rules.compile()
+        return self.change_pages(self.pages, lambda page: page.mark_page_numbers(compiled), lines_changed=False)
+
+    def remove_flagged(self, flag):
+        """Drop every line carrying flag, returns the numbers of changed pages
+
+        Only the pages holding a span of that marker are visited.
+        """
+        pages = [self.get_page(number) for number in self.markers.pages_with(flag)]
+        return self.change_pages(pages, lambda page: page.remove_flagged(flag))
+
+    def remove_endnotes(self):
+        return self.remove_flagged(ENDNOTE)
+
+    def remove_headers(self):
+        return self.remove_flagged(HEADER)
+
+    def remove_page_numbers(self):
+        return self.remove_flagged(PAGE_NUMBER)
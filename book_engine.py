@@ -0,0 +1,936 @@
+"""GUI-free extraction and marker detection shared by the Book Summary app and batch runs"""
+import bisect
+import hashlib
+import json
+import os
+import re
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from marker_rules import DEFAULT_RULES
+
+# PyMuPDF, imported by load_fitz() when the first PDF is opened so the app starts without it
+fitz = None
+
+# Flags used for every page extraction: fitz.TEXT_DEHYPHENATE | fitz.TEXT_PRESERVE_WHITESPACE
+TEXT_FLAGS = 16 | 2
+
+# fitz.TEXT_FONT_SUPERSCRIPT, the span flag of superscript text
+FONT_SUPERSCRIPT = 1
+
+# Cache key of pages extracted with their layout, kept apart from the plain text of TEXT_FLAGS
+LAYOUT_CACHE_FLAGS = TEXT_FLAGS | 1 << 30
+
+# Running headers, footers and page numbers sit in the top or bottom tenth of the page
+MARGIN_ZONE = 0.1
+
+# Footnotes are set in a smaller font than the body text
+FOOTNOTE_SIZE_RATIO = 0.95
+
+# Lines whose tops are this close (points) share a row, and a margin row is set off by this much more space
+ROW_TOLERANCE = 2.0
+
+# Below this many pages starting worker processes costs more than it saves
+PARALLEL_MIN_PAGES = 32
+
+# Each worker gets about this many page ranges so slow pages even out
+CHUNKS_PER_WORKER = 4
+
+# Upper bound of pages per range, and of ranges in flight per worker, keeps memory flat for huge books
+MAX_CHUNK_PAGES = 64
+CHUNKS_IN_FLIGHT_PER_WORKER = 2
+
+# Cached pages are read in batches of this many pages
+CACHE_BATCH_PAGES = 256
+
+# An indirect object reference like "12 0 R" in a PDF dictionary or array
+PDF_REFERENCE = re.compile(r'(\d+) \d+ R\b')
+
+# Entries of a font dictionary that decide which text its character codes stand for
+FONT_TEXT_KEYS = ("ToUnicode", "Encoding")
+
+# Missed pages fingerprinted up front to tell whether a PDF is a new edition of a cached one,
+# it is when more than this share of them match pages of one and the same cached PDF
+EDITION_SAMPLE_PAGES = 16
+EDITION_SAMPLE_SHARE = 0.5
+
+# A contents line ends in a page number, split into title and number after the dot leaders
+ENTRY_NUMBER = re.compile(r'\d+$')
+ENTRY_PARTS = re.compile(r'(.*?)[.…\s]+(\d+)\s*$')
+
+# One part of a page selection: a page, or a range whose ends default to the first and last page
+SELECTION_PART = re.compile(r'(\d+)|(\d*)\s*-\s*(\d*)')
+
+# Pages sampled when working out the printed page number offset
+PAGE_OFFSET_SAMPLES = 12
+
+
+class PageRangeError(ValueError):
+    """Raised when a page range entered by the user is not usable"""
+
+
+class BookExtraction:
+    """Result of extracting the contents pages: the analyzed contents plus text shown in front of the pages"""
+
+    def __init__(self, text, contents_lines=None, contents_table=None, from_outline=False):
+        self.text = text  # Raw contents pages when their analysis failed, else empty
+        self.contents_lines = contents_lines  # None when no contents pages were analyzed
+        self.contents_table = contents_table if contents_table is not None else []
+        # Entries read from the PDF outline point at PDF pages, not at printed page numbers
+        self.from_outline = from_outline
+        # Added to a printed page number gives the PDF page number, None when not worked out
+        self.page_offset = 0 if from_outline else None
+
+
+def load_fitz():
+    """The PyMuPDF module, imported on first use"""
+    global fitz
+    if fitz is None:
+        import fitz as pymupdf
+        fitz = pymupdf
+    return fitz
+
+
+def open_pdf(file_path):
+    """Open a PDF and make sure it has pages"""
+    doc = load_fitz().open(file_path)
+    if doc.needs_pass:
+        doc.close()
+        raise Exception("PDF is password protected")
+    if doc.page_count == 0:
+        doc.close()
+        raise Exception("No pages found in PDF")
+    return doc
+
+
+def resolve_page_range(start_text, end_text, total_pages):
+    """Turn the Start/End entries into a 1-based page range"""
+    try:
+        start = int(start_text or '1')
+        end = int(end_text or str(total_pages))
+    except ValueError:
+        raise PageRangeError("Please enter valid page numbers")
+
+    # Adjust for 1-based index
+    start = max(1, min(start, total_pages))
+    end = max(1, min(end, total_pages))
+
+    if start >= end:
+        raise PageRangeError("Start page must be less than end page")
+
+    return start, end
+
+
+def resolve_contents_range(start_text, end_text, total_pages):
+    """Turn the Contents Pages entries into a 1-based page range, or (None, None) if empty"""
+    # If both fields are empty, there are no contents pages
+    if not start_text and not end_text:
+        return None, None
+
+    # If only one field is filled, the range is incomplete
+    if bool(start_text) != bool(end_text):
+        raise PageRangeError("Please fill both contents page fields or leave both empty")
+
+    try:
+        start = int(start_text)
+        end = int(end_text)
+    except ValueError:
+        raise PageRangeError("Please enter valid contents page numbers")
+
+    # Validate against the document
+    if start < 1 or end > total_pages or start > end:
+        raise PageRangeError(
+            f"Please enter valid contents page numbers between 1 and {total_pages}")
+
+    return start, end
+
+
+def is_page_selection(text):
+    """Whether an entry holds a page selection like "1-3, 45-60, 210" rather than a single page"""
+    return "," in text or "-" in text
+
+
+def parse_page_selection(text, total_pages):
+    """Sorted 1-based pages of a selection like "1-3, 45-60, 210"
+
+    "-5" runs from the first page and "200-" to the last one.
+    """
+    pages = set()
+    for part in text.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        match = SELECTION_PART.fullmatch(part)
+        if match is None or part == "-":
+            raise PageRangeError(f"Please enter pages like 1-3, 45-60, 210 ('{part}' is not a page or range)")
+        if match.group(1) is not None:
+            first = last = int(match.group(1))
+        else:
+            first = int(match.group(2) or 1)
+            last = int(match.group(3) or total_pages)
+        if first > last:
+            raise PageRangeError(f"Range {part} ends before it starts")
+        if first < 1 or last > total_pages:
+            raise PageRangeError(f"Pages {part} are outside the document's pages 1-{total_pages}")
+        pages.update(range(first, last + 1))
+    if not pages:
+        raise PageRangeError("Please enter pages like 1-3, 45-60, 210")
+    return sorted(pages)
+
+
+def format_page_numbers(numbers):
+    """1-based page numbers as a selection like "1-3, 45-60, 210", the reverse of parse_page_selection"""
+    parts = []
+    for number in sorted(set(numbers)):
+        if parts and number == parts[-1][1] + 1:
+            parts[-1][1] = number
+        else:
+            parts.append([number, number])
+    return ", ".join(str(first) if first == last else f"{first}-{last}" for first, last in parts)
+
+
+def resolve_page_selection(start_text, end_text, total_pages):
+    """Sorted 1-based pages of the Page Range entries
+
+    A selection in Start with End left empty picks just those pages,
+    otherwise Start and End give one range like resolve_page_range.
+    """
+    if not end_text and is_page_selection(start_text):
+        return parse_page_selection(start_text, total_pages)
+    start, end = resolve_page_range(start_text, end_text, total_pages)
+    return list(range(start, end + 1))
+
+
+def resolve_contents_pages(start_text, end_text, total_pages):
+    """Sorted 1-based pages of the Contents Pages entries, empty when there are none
+
+    Takes a selection in Start with End left empty like resolve_page_selection.
+    """
+    if not end_text and is_page_selection(start_text):
+        return parse_page_selection(start_text, total_pages)
+    start, end = resolve_contents_range(start_text, end_text, total_pages)
+    return list(range(start, end + 1)) if start is not None else []
+
+
+def select_pages(total_pages, start=None, end=None, pages=None):
+    """Main text pages of the command line and service options, a selection in pages wins over start and end"""
+    if pages:
+        return parse_page_selection(str(pages), total_pages)
+    return resolve_page_selection(str(start or ''), str(end or ''), total_pages)
+
+
+def select_contents_pages(total_pages, start=None, end=None, pages=None):
+    """Contents pages of the command line and service options, see select_pages"""
+    if pages:
+        return parse_page_selection(str(pages), total_pages)
+    return resolve_contents_pages(str(start or ''), str(end or ''), total_pages)
+
+
+def extract_page_text(doc, page_num):
+    """Extract the raw text of a 0-based page"""
+    return doc[page_num].get_text("text", flags=TEXT_FLAGS)
+
+
+def extract_page_layout(doc, page_num):
+    """Extract the lines of a 0-based page with their geometry, as a JSON string
+
+    Keeps what find_layout_markers needs: the page height and, per line,
+    its text, main font size, top and bottom, and whether it starts with
+    a superscript. The text of the lines matches extract_page_text.
+    """
+    page = doc[page_num]
+    lines = []
+    for block in page.get_text("dict", flags=TEXT_FLAGS)["blocks"]:
+        if block["type"] != 0:
+            continue
+        for line in block["lines"]:
+            spans = line["spans"]
+            if not spans:
+                continue
+            size = max(spans, key=lambda span: len(span["text"].strip()))["size"]
+            lines.append([
+                ''.join(span["text"] for span in spans),
+                round(size, 1),
+                round(line["bbox"][1], 1),
+                round(line["bbox"][3], 1),
+                bool(spans[0]["flags"] & FONT_SUPERSCRIPT),
+            ])
+    return json.dumps({"height": round(page.rect.height, 1), "lines": lines}, ensure_ascii=False)
+
+
+def read_stream(doc, xref):
+    """Decompressed data of a stream object, ValueError when the object is no stream or can't be read"""
+    data = doc.xref_stream(xref)
+    if data is None:
+        raise ValueError(f"PDF object {xref} is not a readable stream")
+    return data
+
+
+def page_content_streams(doc, page_num):
+    """xrefs of a 0-based page's content streams, following a Contents that refers to an array of them"""
+    kind, value = doc.xref_get_key(doc.page_xref(page_num), "Contents")
+    xrefs = [int(xref) for xref in PDF_REFERENCE.findall(value)]
+    if kind == "xref" and not doc.xref_is_stream(xrefs[0]):
+        xrefs = [int(xref) for xref in PDF_REFERENCE.findall(doc.xref_object(xrefs[0], compressed=True))]
+    return xrefs
+
+
+def font_fingerprint(doc, font, fonts):
+    """SHA-256 of a get_page_fonts entry: its type, name and encoding, and its ToUnicode map and encoding objects
+
+    fonts holds the fingerprints of the fonts seen before by xref, fonts
+    are mostly shared by many pages.
+    """
+    xref, _, font_type, base_font, _, encoding = font[:6]
+    if xref not in fonts:
+        digest = hashlib.sha256(repr((font_type, base_font, encoding)).encode())
+        for key in FONT_TEXT_KEYS:
+            kind, value = doc.xref_get_key(xref, key)
+            if kind != "xref":
+                digest.update(value.encode())
+            elif doc.xref_is_stream(int(value.split()[0])):
+                digest.update(read_stream(doc, int(value.split()[0])))
+            else:
+                digest.update(doc.xref_object(int(value.split()[0]), compressed=True).encode())
+        fonts[xref] = digest.hexdigest()
+    return fonts[xref]
+
+
+def page_fingerprint(doc, page_num, fonts=None):
+    """SHA-256 of what a 0-based page's text is drawn from: its content streams, forms and fonts, and its size
+
+    Unlike the file hash it stays the same when other pages of the book
+    change, so the unchanged pages of a new edition match the old ones.
+    The streams are hashed decompressed, so writing the same pages with
+    other compression settings keeps them, and they are not interpreted,
+    which keeps this a fraction of the extraction. The boxes and rotation
+    include the ones the page inherits, the forms and fonts the ones the
+    page's forms use. A stream that can't be read
+    raises ValueError, the page gets no fingerprint rather than a partial
+    one. fonts is passed on to font_fingerprint.
+    """
+    fonts = {} if fonts is None else fonts
+    page = doc[page_num]
+    digest = hashlib.sha256(repr((tuple(page.mediabox), tuple(page.cropbox), page.rotation)).encode())
+    for xref in page_content_streams(doc, page_num):
+        digest.update(read_stream(doc, xref))
+    # Sorted by name and content, the order and numbers of the objects differ between files
+    resources = sorted(
+        [("font", font[4], font_fingerprint(doc, font, fonts)) for font in doc.get_page_fonts(page_num, full=True)]
+        + [("form", xobject[1], hashlib.sha256(read_stream(doc, xobject[0])).hexdigest())
+           for xobject in doc.get_page_xobjects(page_num)]
+    )
+    digest.update(repr(resources).encode())
+    return digest.hexdigest()
+
+
+def page_fingerprints(doc, page_nums, fonts=None):
+    """Fingerprints of 0-based pages as a dict of page_num -> fingerprint, pages that can't be read are left out
+
+    Pass the same fonts dict to calls on the same document to fingerprint its fonts once.
+    """
+    fingerprints = {}
+    fonts = {} if fonts is None else fonts
+    for page_num in page_nums:
+        try:
+            fingerprints[page_num] = page_fingerprint(doc, page_num, fonts)
+        except Exception:
+            pass  # Extracting the page reports the error
+    return fingerprints
+
+
+class EditionChanges:
+    """How the pages of a new edition relate to the pages of the old one"""
+
+    def __init__(self, matched, changed, dropped):
+        self.matched = matched  # New page number -> old page number with the same content
+        self.changed = changed  # New page numbers no old page matched
+        self.dropped = dropped  # Old page numbers no new page matched
+
+    def describe(self):
+        total = len(self.matched) + len(self.changed)
+        report = f"{len(self.changed)} of {total} pages changed"
+        if self.changed:
+            report += f" ({format_page_numbers(self.changed)})"
+        if self.dropped:
+            report += f", {len(self.dropped)} old pages gone ({format_page_numbers(self.dropped)})"
+        return report
+
+
+def compare_editions(old_fingerprints, new_fingerprints):
+    """Match the pages of two editions by fingerprint, both dicts of page number -> fingerprint
+
+    A page whose content several old pages share, like a blank page, is
+    matched to the one nearest to where the pages before it moved.
+    """
+    old_pages = {}
+    for number in sorted(old_fingerprints):
+        old_pages.setdefault(old_fingerprints[number], []).append(number)
+    matched = {}
+    shift = 0  # New minus old page number of the last match
+    for number in sorted(new_fingerprints):
+        candidates = old_pages.get(new_fingerprints[number])
+        if candidates:
+            old_number = min(candidates, key=lambda candidate: abs(number - shift - candidate))
+            if len(candidates) > 1:
+                candidates.remove(old_number)
+            matched[number] = old_number
+            shift = number - old_number
+    changed = [number for number in sorted(new_fingerprints) if number not in matched]
+    dropped = sorted(set(old_fingerprints) - set(matched.values()))
+    return EditionChanges(matched, changed, dropped)
+
+
+def page_extractor(layout=False):
+    """extract_page_layout or extract_page_text"""
+    return extract_page_layout if layout else extract_page_text
+
+
+def _extract_page_chunk(file_path, page_nums, layout=False, fingerprint_pages=None):
+    """Worker: open the PDF itself and extract a run of 0-based pages
+
+    With a list of fingerprint_pages returns (results, page_fingerprints of those pages).
+    """
+    results = []
+    extract = page_extractor(layout)
+    doc = load_fitz().open(file_path)
+    try:
+        for page_num in page_nums:
+            try:
+                results.append((page_num, extract(doc, page_num), None))
+            except Exception as e:
+                results.append((page_num, None, str(e)))
+        if fingerprint_pages is not None:
+            return results, page_fingerprints(doc, fingerprint_pages)
+    finally:
+        doc.close()
+    return results
+
+
+def iter_page_texts(doc, page_nums, workers=1, cancel_event=None, cache=None, layout=False, pool=None):
+    """Extract 0-based pages in order, yielding (page_num, text, error) as pages finish
+
+    With more than one worker and enough pages, contiguous page ranges are
+    extracted by worker processes that each open the file, and the results
+    are merged back in page order. Small ranges, in-memory and encrypted
+    documents use the serial path. Setting cancel_event stops the
+    iteration and drops the chunks that have not started yet. With a
+    PageCache, cached pages are served from it and only the misses are
+    extracted and stored. When most of a sample of the missed pages match
+    pages of one other cached PDF, this is a new edition of it, and the
+    missed pages whose fingerprint matches a page of that PDF take that
+    page's text. With layout set the text is the JSON of
+    extract_page_layout. A ProcessPoolExecutor passed as pool is used
+    instead of starting one and is left running afterwards.
+    """
+    page_nums = list(page_nums)
+    if cache is None or not doc.name or not os.path.isfile(doc.name):
+        yield from _iter_extracted_pages(doc, page_nums, workers, cancel_event, layout, pool)
+        return
+
+    flags = LAYOUT_CACHE_FLAGS if layout else TEXT_FLAGS
+    extract = page_extractor(layout)
+    file_hash = cache.file_hash(doc.name)
+    in_cache = cache.cached_pages(file_hash, page_nums, flags)
+    missing = [page_num for page_num in page_nums if page_num not in in_cache]
+    fingerprints = {}
+    if missing:
+        # Only a new edition of a cached book is worth fingerprinting every page before extracting
+        fonts = {}
+        fingerprints = page_fingerprints(doc, missing[::max(1, len(missing) // EDITION_SAMPLE_PAGES)], fonts)
+        matches = cache.edition_matches(file_hash, fingerprints, flags)
+        source = max(matches, key=matches.get) if matches else None
+        reused = set()
+        if source is not None and matches[source] > len(fingerprints) * EDITION_SAMPLE_SHARE:
+            fingerprints.update(
+                page_fingerprints(doc, [page_num for page_num in missing if page_num not in fingerprints], fonts))
+            reused = cache.reuse_pages(file_hash, fingerprints, flags, source)
+            cache.put_fingerprints(file_hash, {page_num: fingerprints[page_num] for page_num in reused})
+        in_cache |= reused
+        missing = [page_num for page_num in missing if page_num not in reused]
+    extracted = _iter_extracted_pages(doc, missing, workers, cancel_event, layout, pool, fingerprints)
+    cached = {}
+    stored = []  # Pages extracted and cached, their fingerprints are kept for the next edition of the book
+    try:
+        for i, page_num in enumerate(page_nums):
+            if cancel_event is not None and cancel_event.is_set():
+                return
+            # Read the cached text a batch at a time so it never holds the whole book
+            if i % CACHE_BATCH_PAGES == 0:
+                cached = cache.get_many(file_hash, page_nums[i:i + CACHE_BATCH_PAGES], flags)
+            if page_num in cached:
+                yield page_num, cached[page_num], None
+                continue
+            if page_num in in_cache:
+                # Evicted since the misses were listed, it is not among the extracted pages
+                try:
+                    yield page_num, extract(doc, page_num), None
+                except Exception as e:
+                    yield page_num, None, str(e)
+                continue
+            result = next(extracted, None)
+            if result is None:
+                return  # Cancelled while extracting
+            if result[2] is None:
+                cache.put(file_hash, result[0], flags, result[1])
+                stored.append(result[0])
+            yield result
+    finally:
+        extracted.close()
+        cache.put_fingerprints(
+            file_hash, {page_num: fingerprints[page_num] for page_num in stored if page_num in fingerprints})
+        cache.flush()
+
+
+def _iter_extracted_pages(doc, page_nums, workers=1, cancel_event=None, layout=False, pool=None, fingerprints=None):
+    """Extract 0-based pages from the PDF itself, see iter_page_texts
+
+    A dict passed as fingerprints gets the page_fingerprints of the pages
+    it lacks as they are extracted, by the workers when there are any.
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    extract = page_extractor(layout)
+
+    file_path = doc.name
+    if (workers <= 1 or len(page_nums) < PARALLEL_MIN_PAGES or doc.is_encrypted
+            or not file_path or not os.path.isfile(file_path)):
+        fonts = {}
+        for page_num in page_nums:
+            if cancel_event is not None and cancel_event.is_set():
+                return
+            if fingerprints is not None and page_num not in fingerprints:
+                fingerprints.update(page_fingerprints(doc, [page_num], fonts))
+            try:
+                yield page_num, extract(doc, page_num), None
+            except Exception as e:
+                yield page_num, None, str(e)
+        return
+
+    # Split into contiguous chunks and collect them in submission (page) order
+    chunk_size = min(MAX_CHUNK_PAGES, max(1, -(-len(page_nums) // (workers * CHUNKS_PER_WORKER))))
+    max_workers = min(workers, -(-len(page_nums) // chunk_size))
+    shared = pool is not None
+    if not shared:
+        pool = ProcessPoolExecutor(max_workers=max_workers)
+    # Only a few chunks are in flight, so finished text never piles up ahead of the consumer
+    pending = deque()
+    try:
+        next_start = 0
+        while pending or next_start < len(page_nums):
+            while next_start < len(page_nums) and len(pending) < max_workers * CHUNKS_IN_FLIGHT_PER_WORKER:
+                chunk = page_nums[next_start:next_start + chunk_size]
+                pending.append(pool.submit(
+                    _extract_page_chunk, file_path, chunk, layout,
+                    None if fingerprints is None else [page_num for page_num in chunk if page_num not in fingerprints]))
+                next_start += chunk_size
+            results = pending.popleft().result()
+            if fingerprints is not None:
+                results, chunk_fingerprints = results
+                fingerprints.update(chunk_fingerprints)
+            for result in results:
+                if cancel_event is not None and cancel_event.is_set():
+                    return
+                yield result
+    finally:
+        if shared:
+            # Other books extract through the same pool, only drop this one's chunks
+            for future in pending:
+                future.cancel()
+        else:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+
+def extract_page_texts(doc, page_nums, workers=1, cache=None):
+    """Extract 0-based pages in order, returns a list of (page_num, text, error)"""
+    return list(iter_page_texts(doc, page_nums, workers, cache=cache))
+
+
+def clean_page_lines(page_text):
+    """Normalize extracted page text into lines, or None when the page is empty"""
+    if not page_text.strip():
+        return None
+
+    return [clean_line(line) for line in page_text.splitlines()]
+
+
+def clean_line(line):
+    """Trim a line, turning its indentation into plain spaces"""
+    leading_space = len(line) - len(line.lstrip())
+    indent = " " * leading_space
+    line = line.strip()  # This line trims leading and trailing whitespace
+    if not line:
+        return ""
+    return f"{indent}{line}"
+
+
+def format_contents_page(page_num, page_text):
+    """Render a contents page block (0-based page_num) the way it appears in the text area"""
+    lines = clean_page_lines(page_text)
+    if lines is None:
+        return f"=== Page {page_num + 1} ===\n\n"
+    return f"=== Page {page_num + 1} ===\n\n" + '\n'.join(lines) + "\n"
+
+
+def format_error_page(page_num, error):
+    """Render a contents page block for a page that could not be extracted"""
+    return f"=== Page {page_num + 1} ===\n\n[Error: {str(error)}]\n"
+
+
+def extract_contents_text(doc, contents_pages, workers=1, cache=None):
+    """Extract the contents pages (1-based) as text"""
+    parts = []
+    pages = extract_page_texts(doc, [number - 1 for number in contents_pages], workers, cache)
+    for page_num, page_text, error in pages:
+        if error is not None:
+            parts.append(format_error_page(page_num, error))
+        else:
+            parts.append(format_contents_page(page_num, page_text))
+    return ''.join(parts)
+
+
+def extract_contents(doc, contents_pages, workers=1, cache=None):
+    """Extract and analyze the contents pages (1-based), returns a BookExtraction
+
+    When the analysis fails the raw contents pages are kept as text, so they
+    end up in front of the main text like before.
+    """
+    if not contents_pages:
+        return BookExtraction("")
+
+    outline = outline_contents(doc)
+    if outline is not None:
+        return outline
+    return analyze_contents_text(extract_contents_text(doc, contents_pages, workers, cache))
+
+
+def outline_contents(doc):
+    """The contents from the PDF's embedded outline, or None when it has none
+
+    Reading the outline is much cheaper than extracting and parsing the
+    contents pages, and its page numbers need no printed page offset.
+    """
+    try:
+        toc = doc.get_toc(simple=True)
+    except Exception as e:
+        print(f"Error reading outline: {str(e)}")
+        return None
+
+    contents_lines = []
+    contents_table = []
+    for level, title, page in toc:
+        title = " ".join(title.split())
+        if not title or page < 1:
+            continue
+        contents_lines.append(f"{'  ' * (level - 1)}{title} {page}")
+        contents_table.append({'text': title, 'page': page})
+    if not contents_table:
+        return None
+    return BookExtraction("", contents_lines, contents_table, from_outline=True)
+
+
+def analyze_contents_text(contents_text):
+    """Analyze extracted contents pages into a BookExtraction, see extract_contents"""
+    contents_lines, contents_table = analyze_contents(contents_text)
+    if contents_lines is None:
+        return BookExtraction(contents_text, None, contents_table)
+    return BookExtraction("", contents_lines, contents_table)
+
+
+def find_page_offset(doc, first_page=1, samples=PAGE_OFFSET_SAMPLES, cache=None):
+    """Offset from printed page numbers to 1-based PDF page numbers, or None when it can't be told
+
+    Numeric page labels are used when the PDF has them. Otherwise a few
+    pages from first_page on are extracted and the lines holding only a
+    number at their top or bottom vote for an offset. The offset needs
+    at least two agreeing pages.
+    """
+    page_count = doc.page_count
+    first_page = max(1, min(first_page, page_count))
+    step = max(1, (page_count - first_page + 1) // samples)
+    sample = list(range(first_page - 1, page_count, step))[:samples]
+
+    votes = Counter()
+    if doc.get_page_labels():
+        for page_num in sample:
+            label = doc[page_num].get_label()
+            if label.isdigit():
+                votes[page_num + 1 - int(label)] += 1
+
+    if not votes:
+        for page_num, page_text, error in iter_page_texts(doc, sample, cache=cache):
+            if error is not None:
+                continue
+            lines = [line.strip() for line in page_text.splitlines() if line.strip()]
+            for line in set(lines[:2] + lines[-2:]):
+                if line.isdigit() and 0 < int(line) <= page_count:
+                    votes[page_num + 1 - int(line)] += 1
+
+    if not votes:
+        return None
+    offset, count = votes.most_common(1)[0]
+    return offset if count >= min(2, len(sample)) else None
+
+
+def chapter_page_ranges(contents_table, page_offset, total_pages):
+    """(first, last) 1-based PDF pages of every contents entry, None for entries outside the PDF
+
+    An entry runs up to the page before the next entry that starts on a
+    later page, the last one to the end of the PDF.
+    """
+    starts = [entry['page'] + page_offset for entry in contents_table]
+    ordered = sorted(set(starts))
+    ranges = []
+    for start in starts:
+        if not 1 <= start <= total_pages:
+            ranges.append(None)
+            continue
+        following = bisect.bisect_right(ordered, start)
+        end = ordered[following] - 1 if following < len(ordered) else total_pages
+        ranges.append((start, min(end, total_pages)))
+    return ranges
+
+
+def find_layout_markers(layout, rules=None):
+    """Classify the lines of an extract_page_layout record in one pass
+
+    Returns (lines, headers, page_numbers, footnotes): the cleaned line
+    texts, or None for an empty page, the indexes of running header or
+    footer lines and of page number lines, and (first_line, last_line)
+    pairs of footnotes. footnotes is None when no block of smaller type
+    closes the page, the text rules then have to find the endnotes.
+
+    Header and footer rows are the top and bottom rows inside the page
+    margins, set off from the body by extra space or a different font
+    size, and not in a larger font than the body (chapter titles).
+    """
+    rules = rules if rules is not None else DEFAULT_RULES.compile()
+    records = layout["lines"]
+    lines = [clean_line(record[0]) for record in records]
+    if not any(lines):
+        return None, [], [], []
+
+    # Body size: the font size most of the characters are set in
+    sizes = Counter()
+    for text, size, _, _, _ in records:
+        sizes[size] += len(text.strip())
+    body_size = sizes.most_common(1)[0][0]
+
+    filled = [i for i, text in enumerate(lines) if text]
+    margin = layout["height"] * MARGIN_ZONE
+    usual_gap = sorted(
+        records[b][2] - records[a][3] for a, b in zip(filled, filled[1:])
+    )[(len(filled) - 1) // 2] if len(filled) > 1 else 0.0
+
+    def margin_row(row, neighbour_gap):
+        """The row is set off from the body, and is not a heading"""
+        sizes = [records[i][1] for i in row]
+        set_off = neighbour_gap > usual_gap + ROW_TOLERANCE or any(size != body_size for size in sizes)
+        return set_off and max(sizes) <= body_size
+
+    margin_lines = []
+    top = [i for i in filled if abs(records[i][2] - records[filled[0]][2]) <= ROW_TOLERANCE]
+    rest = [i for i in filled if i not in top]
+    if records[top[0]][3] <= margin and rest:
+        gap = min(records[i][2] for i in rest) - max(records[i][3] for i in top)
+        if margin_row(top, gap):
+            margin_lines += top
+            filled = rest
+
+    bottom_line = max(filled, key=lambda i: records[i][3])
+    bottom = [i for i in filled if abs(records[i][3] - records[bottom_line][3]) <= ROW_TOLERANCE]
+    rest = [i for i in filled if i not in bottom]
+    if records[bottom_line][2] >= layout["height"] - margin and rest:
+        gap = min(records[i][2] for i in bottom) - max(records[i][3] for i in rest)
+        if margin_row(bottom, gap):
+            margin_lines += bottom
+            filled = rest
+
+    headers = []
+    page_numbers = []
+    for i in margin_lines:
+        if rules.is_page_number(lines[i]):
+            page_numbers.append(i)
+        elif rules.header_exclude is None or rules.header_exclude.match(lines[i].strip()) is None:
+            headers.append(i)
+
+    # Footnotes: the run of smaller type closing the body, in the lower half of the page
+    note_lines = []
+    for i in reversed(filled):
+        if records[i][1] >= body_size * FOOTNOTE_SIZE_RATIO:
+            break
+        note_lines.insert(0, i)
+    note_lines = [i for i in note_lines if records[i][2] >= layout["height"] / 2]
+    if not note_lines:
+        return lines, sorted(headers), sorted(page_numbers), None
+
+    footnotes = []
+    note_start = note_lines[0]
+    for previous, i in zip(note_lines, note_lines[1:]):
+        if records[i][4] or rules.is_endnote_start(lines[i]):
+            footnotes.append((note_start, previous))
+            note_start = i
+    footnotes.append((note_start, note_lines[-1]))
+    return lines, sorted(headers), sorted(page_numbers), footnotes
+
+
+def find_page_endnotes(page_lines, rules=None):
+    """Find the endnotes of a page with CompiledRules, returns (first_line, last_line) index pairs"""
+    rules = rules if rules is not None else DEFAULT_RULES.compile()
+
+    # Endnotes only start in the second half of the page
+    mid_point = len(page_lines) // 2
+    endnotes = []
+    note_start = None
+
+    for i, line in enumerate(page_lines):
+        # An empty line closes the current endnote
+        if not line.strip():
+            if note_start is not None:
+                endnotes.append((note_start, i - 1))
+                note_start = None
+            continue
+
+        if i >= mid_point:
+            # A line starting with a special character starts a new endnote
+            if rules.is_endnote_start(line):
+                if note_start is not None:
+                    endnotes.append((note_start, i - 1))
+                note_start = i
+
+    # Handle any remaining endnote at end of page
+    if note_start is not None:
+        endnotes.append((note_start, len(page_lines) - 1))
+
+    return endnotes
+
+
+def process_page_endnotes(page_lines, rules=None):
+    """Process a single page's lines for endnotes"""
+    processed_lines = []
+    previous_end = -1
+
+    for first, last in find_page_endnotes(page_lines, rules):
+        processed_lines.extend(page_lines[previous_end + 1:first])
+        # Join the continuation lines onto the first line of the endnote
+        endnote = page_lines[first] + ''.join(f" {line.lstrip()}" for line in page_lines[first + 1:last + 1])
+        processed_lines.append(f"<E>{endnote}</E>")
+        previous_end = last
+
+    processed_lines.extend(page_lines[previous_end + 1:])
+    return processed_lines
+
+
+def find_page_header(page_lines, previous_page_empty, rules=None):
+    """Return the index of the page's header line with CompiledRules, or None if the page has none"""
+    rules = rules if rules is not None else DEFAULT_RULES.compile()
+    for i, line in enumerate(page_lines):
+        stripped_line = line.strip()
+        if not stripped_line:
+            continue
+
+        # Only the first non-empty line can be a header. Conditions:
+        # 1. Not the first page (previous page has content)
+        # 2. Not already marked as endnote
+        # 3. Shorter than the max header length, not just a page number and not excluded by the rules
+        if (not previous_page_empty and
+            not stripped_line.startswith("<E>") and
+            rules.is_header_candidate(stripped_line)
+            ):
+            return i
+        return None
+
+    return None
+
+
+def format_header(line):
+    """Wrap a line in header markup, preserving its indentation"""
+    leading_space = len(line) - len(line.lstrip())
+    indent = " " * leading_space
+    return f"{indent}<H>{line.strip()}</H>"
+
+
+def process_page_headers(page_lines, previous_page_empty, rules=None):
+    """Process a single page's lines for headers"""
+    processed_lines = list(page_lines)
+    header_index = find_page_header(page_lines, previous_page_empty, rules)
+    if header_index is not None:
+        processed_lines[header_index] = format_header(page_lines[header_index])
+    return processed_lines
+
+
+def is_page_number_line(line, rules=None):
+    """Check if the line contains only digits or special characters"""
+    rules = rules if rules is not None else DEFAULT_RULES.compile()
+    return rules.is_page_number(line)
+
+
+def analyze_contents(text_content):
+    """Analyze the text content for table of contents, returns (lines, contents_table)
+
+    A line ending in a number closes an entry. Once the first entry is
+    found, the untagged lines since the previous entry are merged into the
+    entry they lead up to, so titles running over several lines stay whole.
+    Every line is looked at once.
+    """
+    contents_table = []
+    try:
+        processed_lines = []
+        pending = []  # Untagged lines since the last line holding <C>, merged into the next entry
+        tagged_line_counter = 0
+
+        for line in text_content.splitlines():
+            # Skip page marker lines and empty lines
+            if line.startswith("=== Page") or not line.strip():
+                continue
+
+            stripped_line = line.strip()
+            if ENTRY_NUMBER.search(stripped_line):
+                merged_line = line
+                # Before the first entry the untagged lines stay as they are
+                if tagged_line_counter > 0 and pending:
+                    merged_line = " ".join(pending + [stripped_line])
+                else:
+                    processed_lines.extend(pending)
+                pending = []
+
+                processed_lines.append(f"<C>{merged_line.strip()}")
+                tagged_line_counter += 1
+            elif "<C>" in line:
+                # Merging never reaches past a line holding <C>
+                processed_lines.extend(pending)
+                processed_lines.append(line)
+                pending = []
+            else:
+                pending.append(line)
+        processed_lines.extend(pending)
+
+        # Clean up consecutive dots/spaces before numbers in processed lines
+        cleaned_lines = []
+        for line in processed_lines:
+            if "<C>" in line:
+                # Extract the number at the end and remove <C> tags for processing
+                line_without_tags = line.replace("<C>", "").replace("</C>", "")
+                match = ENTRY_PARTS.search(line_without_tags)
+                if match:
+                    text_part = match.group(1).strip()
+                    number_part = match.group(2)
+                    cleaned_lines.append(f"<C>{text_part} {number_part}")
+
+                    # Add to contents table
+                    contents_table.append({
+                        'text': text_part,
+                        'page': int(number_part)
+                    })
+                else:
+                    cleaned_lines.append(line)
+            else:
+                cleaned_lines.append(line)
+
+        # Remove <C> tags from the beginning of lines
+        final_lines = [line.replace("<C>", "") if line.startswith("<C>") else line for line in cleaned_lines]
+
+        return final_lines, contents_table
+
+    except Exception as e:
+        print(f"Error analyzing contents: {str(e)}")
+        return None, contents_table
@@ -0,0 +1,282 @@
+"""Streaming export of cleaned book text to plain text, Markdown or JSONL"""
+import argparse
+import json
+import os
+import re
+import sys
+from pathlib import Path
+from book_document import ENDNOTE, HEADER, PAGE_NUMBER, Page
+from book_engine import (
+    BookExtraction,
+    extract_contents,
+    iter_page_texts,
+    open_pdf,
+    select_contents_pages,
+    select_pages,
+)
+from cleanup_pipeline import STAGES, CleanupPipeline, layout_stages, parse_stages
+from marker_rules import DEFAULT_RULES, MarkerRules, load_publisher_rules
+from page_cache import PageCache
+
+EXPORT_FORMATS = ("txt", "md", "jsonl")
+
+# Line starts Markdown would read as a heading, list item or quote
+MARKDOWN_SPECIAL = re.compile(r'^(\s*)([#*+\->]|\d+[.)])')
+
+
+class TextWriter:
+    """Plain text with <E>, <H> and <N> markup, the same text the batch run writes"""
+
+    def __init__(self, output):
+        self.output = output
+
+    def write_contents(self, contents):
+        self.output.write(contents.text)
+
+    def write_page(self, page):
+        self.output.write(page.render())
+
+
+class MarkdownWriter(TextWriter):
+    """A heading per page, running headers as subheadings and endnotes as quotes"""
+
+    def write_contents(self, contents):
+        if contents.contents_table:
+            self.output.write("# Contents\n\n")
+            for entry in contents.contents_table:
+                self.output.write(f"- {escape_markdown(entry['text'])} ({entry['page']})\n")
+            self.output.write("\n")
+        elif contents.text:
+            self.output.write(contents.text + "\n")
+
+    def write_page(self, page):
+        blocks = []
+        paragraph = []
+        for text, flags in page.display_lines(markup=False):
+            if not flags:
+                paragraph.append(escape_markdown(text))
+                continue
+            if paragraph:
+                blocks.append('\n'.join(paragraph))
+                paragraph = []
+            if flags & ENDNOTE:
+                blocks.append(f"> {escape_markdown(text.strip())}")
+            elif flags & HEADER:
+                blocks.append(f"### {text.strip()}")
+            else:
+                blocks.append(f"<!-- page {text.strip()} -->")
+        if paragraph:
+            blocks.append('\n'.join(paragraph))
+
+        self.output.write(f"## Page {page.number}\n\n")
+        for block in blocks:
+            if block.strip():
+                self.output.write(block.rstrip() + "\n\n")
+
+
+class JsonlWriter(TextWriter):
+    """One JSON record per page with the markers as separate fields"""
+
+    def write_record(self, record):
+        self.output.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def write_contents(self, contents):
+        if contents.contents_table or contents.text:
+            self.write_record({"type": "contents", "entries": contents.contents_table, "text": contents.text})
+
+    def write_page(self, page):
+        lines = []
+        markers = {ENDNOTE: [], HEADER: [], PAGE_NUMBER: []}
+        for text, flags in page.display_lines(markup=False):
+            if flags & ENDNOTE:
+                markers[ENDNOTE].append(text.strip())
+            elif flags & HEADER:
+                markers[HEADER].append(text.strip())
+            elif flags & PAGE_NUMBER:
+                markers[PAGE_NUMBER].append(text.strip())
+            else:
+                lines.append(text)
+        self.write_record({
+            "type": "page",
+            "page": page.number,
+            "text": '\n'.join(lines),
+            "endnotes": markers[ENDNOTE],
+            "headers": markers[HEADER],
+            "page_numbers": markers[PAGE_NUMBER],
+        })
+
+
+WRITERS = {"txt": TextWriter, "md": MarkdownWriter, "jsonl": JsonlWriter}
+
+
+def escape_markdown(text):
+    """Keep a line from being read as a heading, list item or quote"""
+    return MARKDOWN_SPECIAL.sub(r'\1\\\2', text)
+
+
+def format_for_path(output_path, fmt=None):
+    """The export format given, or the one matching the file extension"""
+    fmt = fmt or Path(output_path).suffix.lstrip(".").lower() or "txt"
+    if fmt == "markdown":
+        fmt = "md"
+    if fmt not in WRITERS:
+        raise ValueError(f"Unknown export format '{fmt}', use one of: {', '.join(EXPORT_FORMATS)}")
+    return fmt
+
+
+def write_export(output_path, contents, pages, fmt=None):
+    """Write contents and pages to output_path one page at a time, returns the number of pages
+
+    The text goes to a temporary file that replaces output_path once
+    complete, so a failed export never leaves a truncated file behind.
+    """
+    fmt = format_for_path(output_path, fmt)
+    output_path = Path(output_path)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    partial_path = output_path.with_name(output_path.name + ".part")
+    count = 0
+    try:
+        with open(partial_path, "w", encoding="utf-8") as output:
+            writer = WRITERS[fmt](output)
+            writer.write_contents(contents)
+            for page in pages:
+                writer.write_page(page)
+                count += 1
+        os.replace(partial_path, output_path)
+    finally:
+        if partial_path.exists():
+            partial_path.unlink()
+    return count
+
+
+def export_document(document, output_path, fmt=None):
+    """Export a BookDocument as it currently is, returns the number of pages written"""
+    contents = BookExtraction(
+        document.preamble,
+        [line.text for line in document.contents_lines] if document.contents_lines else None,
+        document.contents_table,
+    )
+    return write_export(output_path, contents, document.pages, fmt)
+
+
+def export_book(file_path, output_path, fmt=None, start=None, end=None, contents_start=None, contents_end=None,
+                rules=DEFAULT_RULES, stages=STAGES, page_workers=1, cache=None, layout=False, pages=None,
+                contents_pages=None):
+    """Extract, clean and export one PDF, returns the contents BookExtraction
+
+    Pages go through the cleanup pipeline as they are extracted and are
+    written out right away, so only a few pages are in memory at a time.
+    With layout set the markers are classified from the page layout while
+    extracting, and only the remove stages run afterwards. A selection like
+    "1-3, 45-60, 210" in pages or contents_pages takes the place of the
+    start and end pages, only the selected pages are extracted.
+    """
+    fmt = format_for_path(output_path, fmt)
+    pipeline = CleanupPipeline(layout_stages(stages) if layout else stages, rules)
+    doc = open_pdf(file_path)
+    try:
+        total_pages = doc.page_count
+        contents_pages = select_contents_pages(total_pages, contents_start, contents_end, contents_pages)
+        page_numbers = select_pages(total_pages, start, end, pages)
+
+        contents = extract_contents(doc, contents_pages, page_workers, cache)
+        results = iter_page_texts(doc, [number - 1 for number in page_numbers], page_workers, cache=cache,
+                                  layout=layout)
+        if layout:
+            pages = (Page.from_layout(page_num, text, error, pipeline.rules) for page_num, text, error in results)
+        else:
+            pages = (Page.from_extraction(page_num, text, error) for page_num, text, error in results)
+        write_export(output_path, contents, (page for page, _ in pipeline.process(pages)), fmt)
+    finally:
+        doc.close()
+    return contents
+
+
+def add_cleanup_arguments(parser):
+    """Page range, marker rule, cleanup and cache options shared by the export and batch commands"""
+    parser.add_argument("--page-workers", type=int, default=1, help="Worker processes per book for page extraction")
+    parser.add_argument("--start", type=int, help="First page of the main text")
+    parser.add_argument("--end", type=int, help="Last page of the main text")
+    parser.add_argument("--contents-start", type=int, help="First contents page")
+    parser.add_argument("--contents-end", type=int, help="Last contents page")
+    parser.add_argument("--pages", help="Main text pages like '1-3, 45-60, 210', instead of --start and --end")
+    parser.add_argument("--contents-pages",
+                        help="Contents pages like '3-5, 9', instead of --contents-start and --contents-end")
+    parser.add_argument("--rules", help="Publisher whose saved marker rules to use")
+    parser.add_argument("--special-chars", help="Endnote starting characters, overrides the rules")
+    parser.add_argument("--max-header-length", type=int, help="Max header length, overrides the rules")
+    parser.add_argument("--stages", default="all",
+                        help=f"Comma separated cleanup stages, 'all' or any of: {', '.join(STAGES)}")
+    parser.add_argument("--layout", action="store_true",
+                        help="Classify headers, page numbers and footnotes from the page layout while extracting")
+    parser.add_argument("--cache-dir", help="Directory of the extraction cache, no caching when omitted")
+    parser.add_argument("--cache-size-mb", type=float, help="Size cap of the extraction cache")
+
+
+def cleanup_settings(publisher=None, special_chars=None, max_header_length=None, stages="all"):
+    """Marker rules and cleanup stages from the shared options, raises when they are not usable"""
+    stages = parse_stages(stages)
+    rules = load_publisher_rules(publisher) if publisher else MarkerRules()
+    rules = MarkerRules.from_entries(
+        special_chars if special_chars is not None else rules.special_chars(),
+        max_header_length if max_header_length is not None else rules.max_header_length,
+        base=rules,
+    )
+    CleanupPipeline(stages, rules)
+    return rules, stages
+
+
+def rules_from_args(parser, args):
+    """Marker rules and cleanup stages from the shared options, exits with a usage error when invalid"""
+    try:
+        return cleanup_settings(args.rules, args.special_chars, args.max_header_length, args.stages)
+    except Exception as e:
+        parser.error(str(e))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Extract, clean and export one PDF without the GUI")
+    parser.add_argument("input", help="PDF file")
+    parser.add_argument("-o", "--output", help="Output file, defaults to the PDF name with the format's extension")
+    parser.add_argument("-f", "--format", choices=EXPORT_FORMATS,
+                        help="Export format, taken from the output extension when omitted")
+    add_cleanup_arguments(parser)
+    args = parser.parse_args(argv)
+
+    rules, stages = rules_from_args(parser, args)
+    output = args.output or str(Path(args.input).with_suffix("." + (args.format or "txt")))
+
+    cache = None
+    try:
+        if args.cache_dir is not None:
+            max_bytes = int(args.cache_size_mb * 1024 * 1024) if args.cache_size_mb is not None else None
+            cache = PageCache(args.cache_dir, max_bytes)
+        export_book(
+            args.input,
+            output,
+            fmt=args.format,
+            start=args.start,
+            end=args.end,
+            contents_start=args.contents_start,
+            contents_end=args.contents_end,
+            rules=rules,
+            stages=stages,
+            page_workers=args.page_workers,
+            cache=cache,
+            layout=args.layout,
+            pages=args.pages,
+            contents_pages=args.contents_pages,
+        )
+    except Exception as e:
+        print(f"Error exporting {args.input}: {str(e)}", file=sys.stderr)
+        return 1
+    finally:
+        if cache is not None:
+            cache.close()
+
+    print(f"Exported {args.input} -> {output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,122 @@
+"""Multi-level undo and redo of document operations, kept under a memory cap"""
+import os
+import sys
+from collections import deque
+
+# Memory the undo and redo steps may hold, BOOK_SUMMARY_HISTORY_MB overrides it
+DEFAULT_HISTORY_MB = 64
+
+
+def default_history_bytes():
+    try:
+        return int(float(os.environ.get("BOOK_SUMMARY_HISTORY_MB", DEFAULT_HISTORY_MB)) * 1024 * 1024)
+    except ValueError:
+        return DEFAULT_HISTORY_MB * 1024 * 1024
+
+
+class HistoryStep:
+    """State of the pages one operation changed: page number -> Page.state()
+
+    The lines are the page's own Line objects, shared with the document
+    and the other steps; only their flags, which operations change in
+    place, are copied. A step costs a list of references per changed page
+    plus the lines no longer in the document.
+    """
+    __slots__ = ("label", "pages", "size")
+
+    def __init__(self, label, pages, size):
+        self.label = label
+        self.pages = pages
+        self.size = size
+
+
+class DocumentHistory:
+    """Undo and redo stacks of a BookDocument
+
+    Operations run through record(), which has the document hand over the
+    state of each page right before changing it, so only the pages an
+    operation changes are ever copied. Once the steps hold more than
+    max_bytes the oldest undo steps are dropped.
+    """
+
+    def __init__(self, document, max_bytes=None):
+        self.max_bytes = max_bytes if max_bytes is not None else default_history_bytes()
+        self.clear(document)
+
+    def clear(self, document=None):
+        """Forget every step, optionally switching to another document"""
+        if document is not None:
+            self.document = document
+        self.undo_steps = deque()
+        self.redo_steps = []
+        self.size = 0
+
+    def record(self, label, operation):
+        """Run an operation of the document as an undo step, returns what it returns, the changed page numbers"""
+        before = {}
+        self.document.recorder = before.setdefault
+        try:
+            changed = operation()
+        finally:
+            self.document.recorder = None
+        self.push(label, before)
+        return changed
+
+    def push(self, label, pages):
+        """Add an undo step of page number -> state from before the operation, dropping the redo steps"""
+        if not pages:
+            return
+        self.undo_steps.append(self.step(label, pages))
+        self.size += self.undo_steps[-1].size
+        for step in self.redo_steps:
+            self.size -= step.size
+        self.redo_steps = []
+        while self.size > self.max_bytes and self.undo_steps:
+            self.size -= self.undo_steps.popleft().size
+
+    def step(self, label, pages):
+        size = 0
+        for number, (lines, flags) in pages.items():
+            size += sys.getsizeof(lines) + sys.getsizeof(flags)
+            # Lines the document dropped live on only in this step
+            current = {id(line) for line in self.document.get_page(number).lines}
+            size += sum(sys.getsizeof(line) + sys.getsizeof(line.text) for line in lines if id(line) not in current)
+        return HistoryStep(label, pages, size)
+
+    def can_undo(self):
+        return bool(self.undo_steps)
+
+    def can_redo(self):
+        return bool(self.redo_steps)
+
+    def undo(self):
+        """Undo the last operation, returns (label, changed page numbers) or None"""
+        if not self.undo_steps:
+            return None
+        step = self.undo_steps.pop()
+        self.redo_steps.append(self._swap(step))
+        return step.label, list(step.pages)
+
+    def redo(self):
+        """Redo the last undone operation, returns (label, changed page numbers) or None"""
+        if not self.redo_steps:
+            return None
+        step = self.redo_steps.pop()
+        self.undo_steps.append(self._swap(step))
+        return step.label, list(step.pages)
+
+    def _swap(self, step):
+        """Put the step's pages back, returns the step that reverts this"""
+        current = {number: self.document.get_page(number).state() for number in step.pages}
+        for number, state in step.pages.items():
+            self.document.get_page(number).restore(state)
+        self.document.pages_changed(list(step.pages))
+        self.size -= step.size
+        reverse = self.step(step.label, current)
+        self.size += reverse.size
+        return reverse
+
+    def labels(self):
+        """Labels of the next undo and redo steps, None when there is none"""
+        return (self.undo_steps[-1].label if self.undo_steps else None,
+                self.redo_steps[-1].label if self.redo_steps else None)
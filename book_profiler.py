@@ -0,0 +1,206 @@
+"""Optional per-stage and per-page timing of the app, with cProfile dumps on demand"""
+import cProfile
+import os
+import pstats
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+# BOOK_SUMMARY_PROFILE=1 turns the timers on, =cprofile also runs cProfile
+PROFILE_ENV = "BOOK_SUMMARY_PROFILE"
+
+# Slowest pages listed per stage in the report
+SLOWEST_PAGES = 10
+
+_OFF = nullcontext()
+
+
+class StageTimer:
+    """Total time, calls and slowest pages of one stage"""
+    __slots__ = ("seconds", "calls", "pages")
+
+    def __init__(self):
+        self.seconds = 0.0
+        self.calls = 0
+        self.pages = []  # (seconds, page number), only the slowest SLOWEST_PAGES are kept
+
+    def add(self, seconds, page_number=None):
+        self.seconds += seconds
+        self.calls += 1
+        if page_number is None:
+            return
+        if len(self.pages) < SLOWEST_PAGES:
+            self.pages.append((seconds, page_number))
+        elif seconds > self.pages[-1][0]:
+            self.pages[-1] = (seconds, page_number)
+        else:
+            return
+        self.pages.sort(reverse=True)
+
+
+class Profiler:
+    """Stage timers and counters shared by the Tk thread and the extraction thread
+
+    While disabled, stage() hands back a shared no-op context and the
+    record methods return right away, so the instrumented code pays one
+    attribute check.
+    """
+
+    def __init__(self, enabled=False, use_cprofile=False):
+        self.lock = threading.Lock()
+        self.enabled = False
+        self.use_cprofile = False
+        self.profiles = []  # cProfile.Profile of every thread that ran while profiling
+        self.main_profile = None
+        self.reset()
+        self.set_enabled(enabled, use_cprofile)
+
+    @classmethod
+    def from_environment(cls):
+        value = os.environ.get(PROFILE_ENV, "").strip().lower()
+        return cls(enabled=value not in ("", "0", "off", "false"), use_cprofile=value == "cprofile")
+
+    def set_enabled(self, enabled, use_cprofile=None):
+        """Switch the timers on or off, cProfile of the calling thread follows"""
+        if use_cprofile is not None:
+            self.use_cprofile = use_cprofile
+        self.enabled = enabled
+        if enabled and self.use_cprofile and self.main_profile is None:
+            self.main_profile = cProfile.Profile()
+            self.profiles.append(self.main_profile)
+            self.main_profile.enable()
+        elif not enabled and self.main_profile is not None:
+            self.main_profile.disable()
+            self.main_profile = None
+
+    def reset(self):
+        with self.lock:
+            self.stages = {}
+            self.counters = {}
+            self.profiles = [self.main_profile] if self.main_profile is not None else []
+
+    def stage(self, name, page_number=None):
+        """Context manager timing one run of a stage, optionally for one page"""
+        if not self.enabled:
+            return _OFF
+        return self._timed(name, page_number)
+
+    @contextmanager
+    def _timed(self, name, page_number):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - started, page_number)
+
+    def record(self, name, seconds, page_number=None):
+        if not self.enabled:
+            return
+        with self.lock:
+            timer = self.stages.get(name)
+            if timer is None:
+                timer = self.stages[name] = StageTimer()
+            timer.add(seconds, page_number)
+
+    def count(self, name, amount=1):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def set_counter(self, name, value):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.counters[name] = value
+
+    def timed_iter(self, name, items, page_number=None):
+        """Iterate items, timing how long each one takes to produce
+
+        page_number maps an item to the page it belongs to for the slowest
+        page list. Returns items unchanged while disabled.
+        """
+        if not self.enabled:
+            return items
+        return self._timed_iter(name, iter(items), page_number)
+
+    def _timed_iter(self, name, items, page_number):
+        try:
+            while True:
+                started = time.perf_counter()
+                try:
+                    item = next(items)
+                except StopIteration:
+                    return
+                self.record(name, time.perf_counter() - started, page_number(item) if page_number else None)
+                yield item
+        finally:
+            # Let the wrapped generator clean up right away, like a plain for loop would
+            close = getattr(items, "close", None)
+            if close is not None:
+                close()
+
+    @contextmanager
+    def thread_profile(self):
+        """Run cProfile over the body when profiling with cProfile, for threads other than the Tk one"""
+        if not (self.enabled and self.use_cprofile):
+            yield
+            return
+        profile = cProfile.Profile()
+        with self.lock:
+            self.profiles.append(profile)
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+
+    def summary(self, limit=4):
+        """The most expensive stages in one line for the status bar, empty while disabled"""
+        if not self.enabled:
+            return ""
+        with self.lock:
+            stages = sorted(self.stages.items(), key=lambda item: item[1].seconds, reverse=True)[:limit]
+            counters = dict(self.counters)
+        parts = [f"{name} {timer.seconds:.2f}s" for name, timer in stages]
+        parts += [f"{counters[name]} {name}" for name in ("pages", "lines", "markers") if name in counters]
+        return ", ".join(parts)
+
+    def report(self):
+        """Readable report of every stage, the slowest pages and the counters"""
+        with self.lock:
+            stages = sorted(self.stages.items(), key=lambda item: item[1].seconds, reverse=True)
+            counters = sorted(self.counters.items())
+        lines = [f"{'Stage':<24}{'Total s':>10}{'Calls':>8}{'Mean ms':>10}"]
+        for name, timer in stages:
+            lines.append(f"{name:<24}{timer.seconds:>10.3f}{timer.calls:>8}{timer.seconds / timer.calls * 1000:>10.2f}")
+        for name, timer in stages:
+            if timer.pages:
+                slowest = ", ".join(f"{number} ({seconds * 1000:.1f} ms)" for seconds, number in timer.pages)
+                lines.append(f"Slowest pages in {name}: {slowest}")
+        if counters:
+            lines.append("")
+            lines += [f"{name}: {value}" for name, value in counters]
+        return "\n".join(lines) + "\n"
+
+    def dump_report(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(self.report())
+
+    def dump_stats(self, path):
+        """Write the merged cProfile stats of every profiled thread in pstats format"""
+        with self.lock:
+            profiles = list(self.profiles)
+        if not profiles:
+            raise ValueError(f"No cProfile data, turn on cProfile or set {PROFILE_ENV}=cprofile first")
+        if self.main_profile is not None:
+            # Stats can only be taken from a stopped profile
+            self.main_profile.disable()
+        try:
+            stats = pstats.Stats(profiles[0])
+            for profile in profiles[1:]:
+                stats.add(profile)
+            stats.dump_stats(path)
+        finally:
+            if self.main_profile is not None:
+                self.main_profile.enable()
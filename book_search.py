@@ -0,0 +1,123 @@
+"""Inverted index from words to the displayed lines holding them, for instant search of the extracted book"""
+import bisect
+import json
+import os
+import re
+from pathlib import Path
+
+# Words are runs of letters and digits, matched case-insensitively
+TOKEN = re.compile(r"\w+")
+
+# Hits listed for one search
+MAX_HITS = 500
+
+INDEX_VERSION = 1
+
+
+def tokenize(text):
+    return [token.casefold() for token in TOKEN.findall(text)]
+
+
+class SearchIndex:
+    """Postings of every word: page number -> displayed lines holding it
+
+    Lines are numbered like Page.spans(), so a hit can be shown with
+    PageViewer.jump_to(page, line). Pages are indexed and dropped one
+    page at a time, so extraction and the marker operations only pay
+    for the pages they touch.
+    """
+
+    def __init__(self):
+        self.postings = {}  # Word -> {page number: sorted displayed lines}
+        self.page_words = {}  # Page number -> words on it, to drop its postings again
+        self.vocabulary = None  # Sorted words for prefix search, rebuilt after changes
+
+    def update(self, pages):
+        """Replace the postings of the given pages with their current lines"""
+        for page in pages:
+            self._drop(page.number)
+            words = {}
+            for line, (text, _) in enumerate(page.display_lines(markup=False)):
+                for word in set(tokenize(text)):
+                    words.setdefault(word, []).append(line)
+            for word, lines in words.items():
+                self.postings.setdefault(word, {})[page.number] = lines
+            self.page_words[page.number] = list(words)
+        self.vocabulary = None
+
+    def remove(self, numbers):
+        """Drop the postings of the given page numbers"""
+        for number in numbers:
+            self._drop(number)
+        self.vocabulary = None
+
+    def _drop(self, number):
+        for word in self.page_words.pop(number, ()):
+            pages = self.postings[word]
+            del pages[number]
+            if not pages:
+                del self.postings[word]
+
+    def words_starting(self, prefix):
+        if self.vocabulary is None:
+            self.vocabulary = sorted(self.postings)
+        words = []
+        for word in self.vocabulary[bisect.bisect_left(self.vocabulary, prefix):]:
+            if not word.startswith(prefix):
+                break
+            words.append(word)
+        return words
+
+    def lines_with(self, words):
+        """(page number, line) pairs holding any of the words"""
+        hits = set()
+        for word in words:
+            for number, lines in self.postings.get(word, {}).items():
+                hits.update((number, line) for line in lines)
+        return hits
+
+    def search(self, query, limit=MAX_HITS):
+        """Sorted (page number, line) of the lines holding every word of the query
+
+        The last word also matches longer words starting with it, so hits
+        show up while the word is still being typed.
+        """
+        words = tokenize(query)
+        if not words:
+            return []
+        groups = [[word] for word in words[:-1]] + [self.words_starting(words[-1])]
+        # Start from the rarest word so the intersections stay small
+        groups.sort(key=lambda group: sum(len(self.postings.get(word, ())) for word in group))
+        hits = self.lines_with(groups[0])
+        for group in groups[1:]:
+            if not hits:
+                break
+            hits &= self.lines_with(group)
+        return sorted(hits)[:limit]
+
+    def save(self, path):
+        """Write the index as JSON, through a temporary file so a failed save keeps the old one"""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        partial_path = path.with_name(path.name + ".part")
+        try:
+            with open(partial_path, "w", encoding="utf-8") as f:
+                json.dump({"version": INDEX_VERSION, "postings": self.postings}, f, ensure_ascii=False)
+            os.replace(partial_path, path)
+        finally:
+            if partial_path.exists():
+                partial_path.unlink()
+
+    @classmethod
+    def load(cls, path):
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("version") != INDEX_VERSION:
+            raise ValueError(f"Unsupported search index version in {path}")
+        index = cls()
+        for word, pages in data["postings"].items():
+            # JSON object keys are strings
+            index.postings[word] = {int(number): lines for number, lines in pages.items()}
+            for number in index.postings[word]:
+                index.page_words.setdefault(number, []).append(word)
+        return index
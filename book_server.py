@@ -0,0 +1,442 @@
+"""Local asyncio HTTP service streaming the cleaned pages of a PDF, the GUI's pipeline without Tk
+
+POST /extract takes the PDF as the request body, or a JSON body naming
+a "path" under one of the --allow-dir folders, and the left panel's
+parameters in the query string or the JSON body. The contents and then
+each page are streamed back as they are cleaned. GET /health reports
+the load.
+"""
+import argparse
+import asyncio
+import io
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from urllib.parse import parse_qsl, urlsplit
+from book_document import Page
+from book_engine import (
+    _extract_page_chunk,
+    extract_contents,
+    open_pdf,
+    select_contents_pages,
+    select_pages,
+)
+from book_export import EXPORT_FORMATS, WRITERS, cleanup_settings
+from cleanup_pipeline import CleanupPipeline, layout_stages
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+
+# Requests served at once, more get 503 right away
+MAX_REQUESTS = 4
+
+# Seconds one request may take from its first byte to its last page
+REQUEST_TIMEOUT = 300.0
+
+# Seconds to send the request line and headers
+HEADER_TIMEOUT = 10.0
+
+MAX_HEADER_BYTES = 64 * 1024
+MAX_UPLOAD_MB = 200
+
+# Pages per extraction task, and tasks in flight per request so a slow reader holds back the workers
+CHUNK_PAGES = 16
+CHUNKS_IN_FLIGHT = 4
+
+# Parameters and their types, named like the batch command's options
+INT_PARAMETERS = ("start", "end", "contents_start", "contents_end", "max_header_length")
+TEXT_PARAMETERS = ("path", "pages", "contents_pages", "special_chars", "rules", "stages", "format")
+FLAG_PARAMETERS = ("layout",)
+
+CONTENT_TYPES = {
+    "txt": "text/plain; charset=utf-8",
+    "md": "text/markdown; charset=utf-8",
+    "jsonl": "application/x-ndjson",
+}
+
+REASONS = {
+    200: "OK", 400: "Bad Request", 403: "Forbidden", 404: "Not Found", 405: "Method Not Allowed",
+    411: "Length Required", 413: "Payload Too Large", 500: "Internal Server Error", 503: "Service Unavailable",
+    504: "Gateway Timeout",
+}
+
+
+class RequestError(Exception):
+    """Ends a request with an HTTP error status and a JSON message"""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def read_book(file_path, start, end, contents_start, contents_end, pages=None, contents_pages=None):
+    """Worker: check the page selections against the PDF and extract its contents, returns (page numbers, contents)"""
+    doc = open_pdf(file_path)
+    try:
+        total_pages = doc.page_count
+        contents_pages = select_contents_pages(total_pages, contents_start, contents_end, contents_pages)
+        page_numbers = select_pages(total_pages, start, end, pages)
+        return page_numbers, extract_contents(doc, contents_pages)
+    finally:
+        doc.close()
+
+
+def parse_parameters(query, body_fields):
+    """Typed parameters from the query string and a JSON body, the body wins"""
+    raw = dict(parse_qsl(query))
+    raw.update(body_fields)
+    unknown = sorted(set(raw) - set(INT_PARAMETERS + TEXT_PARAMETERS + FLAG_PARAMETERS))
+    if unknown:
+        raise RequestError(400, f"Unknown parameters: {', '.join(unknown)}")
+    parameters = {}
+    for name, value in raw.items():
+        if name in INT_PARAMETERS:
+            try:
+                parameters[name] = int(value) if value not in ("", None) else None
+            except (TypeError, ValueError):
+                raise RequestError(400, f"{name} must be a whole number")
+        elif name in FLAG_PARAMETERS:
+            parameters[name] = value is True or str(value).lower() in ("1", "true", "yes", "on")
+        else:
+            parameters[name] = str(value)
+    fmt = parameters.get("format", "jsonl")
+    if fmt not in EXPORT_FORMATS:
+        raise RequestError(400, f"Unknown format '{fmt}', use one of: {', '.join(EXPORT_FORMATS)}")
+    parameters["format"] = fmt
+    return parameters
+
+
+class BookServer:
+    """Serves /extract and /health, extraction runs in a process pool shared by the requests"""
+
+    def __init__(self, workers=None, max_requests=MAX_REQUESTS, timeout=REQUEST_TIMEOUT,
+                 max_upload_bytes=MAX_UPLOAD_MB * 1024 * 1024, allowed_dirs=()):
+        self.workers = workers
+        self.pool = self.new_pool()
+        self.max_requests = max_requests
+        self.timeout = timeout
+        self.max_upload_bytes = max_upload_bytes
+        self.allowed_dirs = [os.path.realpath(folder) for folder in allowed_dirs]
+        self.active = 0
+        self.served = 0
+
+    def new_pool(self):
+        # Forked workers would inherit the open client sockets and keep them from closing
+        return ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+
+    def replace_pool(self, pool):
+        """Start over with a fresh pool once a worker died, unless another request already did"""
+        if self.pool is pool:
+            # The other tasks of a broken pool fail too
+            pool.shutdown(wait=False, cancel_futures=True)
+            self.pool = self.new_pool()
+
+    async def start(self, host=DEFAULT_HOST, port=DEFAULT_PORT):
+        return await asyncio.start_server(self.handle, host, port, limit=MAX_HEADER_BYTES)
+
+    def close(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+    async def handle(self, reader, writer):
+        """One request per connection, the response ends by closing it"""
+        response = Response(writer)
+        try:
+            try:
+                method, target, headers = await asyncio.wait_for(read_head(reader), HEADER_TIMEOUT)
+            except asyncio.TimeoutError:
+                raise RequestError(400, f"No request headers within {HEADER_TIMEOUT:g}s")
+            path, _, query = target.partition("?")
+            path = urlsplit(path).path
+            if path == "/health":
+                if method != "GET":
+                    raise RequestError(405, "Use GET for /health")
+                await response.send_json(200, {
+                    "status": "ok", "active": self.active, "max_requests": self.max_requests, "served": self.served})
+            elif path == "/extract":
+                if method != "POST":
+                    raise RequestError(405, "Use POST for /extract")
+                if self.active >= self.max_requests:
+                    raise RequestError(503, f"Busy with {self.active} requests, try again shortly")
+                self.active += 1
+                try:
+                    await asyncio.wait_for(self.extract(reader, headers, query, response), self.timeout)
+                except asyncio.TimeoutError:
+                    raise RequestError(504, f"Request took longer than {self.timeout:g}s")
+                finally:
+                    self.active -= 1
+                    self.served += 1
+            else:
+                raise RequestError(404, f"No such endpoint: {path}")
+        except RequestError as e:
+            await response.fail(e.status, str(e))
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass  # The client went away
+        except Exception as e:
+            await response.fail(500, str(e))
+        finally:
+            await response.close()
+
+    async def extract(self, reader, headers, query, response):
+        try:
+            length = int(headers.get("content-length", ""))
+        except ValueError:
+            raise RequestError(411, "Send the body with a Content-Length")
+        if length > self.max_upload_bytes:
+            raise RequestError(413, f"Bodies are limited to {self.max_upload_bytes // (1024 * 1024)} MB")
+        body = await reader.readexactly(length)
+
+        body_fields = {}
+        if headers.get("content-type", "").split(";")[0].strip() == "application/json":
+            try:
+                body_fields = json.loads(body.decode("utf-8") or "{}")
+            except ValueError as e:
+                raise RequestError(400, f"Bad JSON body: {str(e)}")
+            if not isinstance(body_fields, dict):
+                raise RequestError(400, "The JSON body must be an object")
+            body = b""
+        parameters = parse_parameters(query, body_fields)
+
+        upload_path = None
+        if body:
+            # Workers open the file by path, so the upload goes to a temporary file
+            with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as upload:
+                upload.write(body)
+            upload_path = file_path = upload.name
+        elif parameters.get("path"):
+            file_path = self.allowed_path(parameters["path"])
+        else:
+            raise RequestError(400, "Send a PDF as the body or a JSON body with a path")
+        try:
+            await self.stream_book(file_path, parameters, response)
+        finally:
+            if upload_path is not None:
+                os.unlink(upload_path)
+
+    def allowed_path(self, file_path):
+        """The real path of a PDF under an allowed folder, paths are refused unless folders were allowed"""
+        real_path = os.path.realpath(file_path)
+        if not any(os.path.commonpath([real_path, folder]) == folder for folder in self.allowed_dirs):
+            raise RequestError(403, "Paths outside the allowed folders are refused, upload the PDF instead")
+        if not os.path.isfile(real_path):
+            raise RequestError(404, f"No such file: {file_path}")
+        return real_path
+
+    async def stream_book(self, file_path, parameters, response):
+        """Clean the pages in order while the workers extract the next ones, sending each as it is done"""
+        loop = asyncio.get_running_loop()
+        try:
+            rules, stages = cleanup_settings(
+                parameters.get("rules"), parameters.get("special_chars"), parameters.get("max_header_length"),
+                parameters.get("stages", "all"))
+        except Exception as e:
+            raise RequestError(400, str(e))
+        layout = parameters.get("layout", False)
+        pipeline = CleanupPipeline(layout_stages(stages) if layout else stages, rules)
+
+        pool = self.pool
+        try:
+            page_numbers, contents = await loop.run_in_executor(
+                pool, read_book, file_path, parameters.get("start"), parameters.get("end"),
+                parameters.get("contents_start"), parameters.get("contents_end"), parameters.get("pages"),
+                parameters.get("contents_pages"))
+        except BrokenProcessPool as e:
+            self.replace_pool(pool)
+            raise RequestError(503, f"Worker process died, try again: {str(e)}")
+        except Exception as e:
+            # Range errors, password protected or broken PDFs
+            raise RequestError(400, str(e))
+
+        fmt = parameters["format"]
+        buffer = io.StringIO()
+        book_writer = WRITERS[fmt](buffer)
+        await response.start(200, CONTENT_TYPES[fmt])
+        book_writer.write_contents(contents)
+        await response.send_chunk(take(buffer))
+
+        page_nums = [number - 1 for number in page_numbers]
+        chunks = [page_nums[i:i + CHUNK_PAGES] for i in range(0, len(page_nums), CHUNK_PAGES)]
+        cleaner = PageCleaner(pipeline, layout)
+        pending = deque()
+        try:
+            for chunk in chunks:
+                pending.append(loop.run_in_executor(pool, _extract_page_chunk, file_path, chunk, layout))
+                if len(pending) >= CHUNKS_IN_FLIGHT:
+                    # Clean and send the oldest chunk while the workers extract the next ones
+                    await self.send_pages(cleaner.clean(await pending.popleft()), book_writer, buffer, response)
+            while pending:
+                await self.send_pages(cleaner.clean(await pending.popleft()), book_writer, buffer, response)
+        except asyncio.CancelledError:
+            for future in pending:
+                future.cancel()
+            raise
+        except Exception as e:
+            for future in pending:
+                future.cancel()
+            if isinstance(e, BrokenProcessPool):
+                self.replace_pool(pool)
+            await response.send_error(fmt, str(e))
+            return
+        await response.finish()
+
+    async def send_pages(self, pages, book_writer, buffer, response):
+        for page in pages:
+            book_writer.write_page(page)
+            await response.send_chunk(take(buffer))
+
+
+class PageCleaner:
+    """Runs extracted chunks through one CleanupPipeline pass, so header marking sees the page before
+
+    The pipeline pulls its pages from this object, which is handed one
+    page ahead of every page taken from the pipeline.
+    """
+
+    def __init__(self, pipeline, layout):
+        self.rules = pipeline.rules
+        self.layout = layout
+        self.pages = deque()
+        self.cleaned = pipeline.process(self)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return self.pages.popleft()
+
+    def clean(self, results):
+        """Cleaned pages of a list of (page_num, text, error)"""
+        for page_num, text, error in results:
+            if self.layout:
+                self.pages.append(Page.from_layout(page_num, text, error, self.rules))
+            else:
+                self.pages.append(Page.from_extraction(page_num, text, error))
+            yield next(self.cleaned)[0]
+
+
+def take(buffer):
+    """Text written to the buffer so far, emptying it"""
+    text = buffer.getvalue()
+    buffer.seek(0)
+    buffer.truncate()
+    return text
+
+
+async def read_head(reader):
+    """Method, target and lower-cased headers of the request"""
+    try:
+        head = await reader.readuntil(b"\r\n\r\n")
+    except asyncio.LimitOverrunError:
+        raise RequestError(400, "Request headers are too large")
+    lines = head.decode("latin-1").split("\r\n")
+    try:
+        method, target, _ = lines[0].split(" ", 2)
+    except ValueError:
+        raise RequestError(400, "Bad request line")
+    headers = {}
+    for line in lines[1:]:
+        if ":" in line:
+            name, value = line.split(":", 1)
+            headers[name.strip().lower()] = value.strip()
+    if "chunked" in headers.get("transfer-encoding", "").lower():
+        raise RequestError(411, "Chunked request bodies are not supported, send a Content-Length")
+    return method, target, headers
+
+
+class Response:
+    """HTTP/1.1 response written to the connection, streamed with chunked transfer encoding"""
+
+    def __init__(self, writer):
+        self.writer = writer
+        self.started = False
+        self.finished = False
+
+    async def start(self, status, content_type, length=None):
+        self.started = True
+        framing = f"Content-Length: {length}" if length is not None else "Transfer-Encoding: chunked"
+        self.writer.write(
+            f"HTTP/1.1 {status} {REASONS[status]}\r\nContent-Type: {content_type}\r\n{framing}\r\n"
+            f"Cache-Control: no-store\r\nConnection: close\r\n\r\n".encode("latin-1"))
+        await self.writer.drain()
+
+    async def send_chunk(self, text):
+        if text:
+            data = text.encode("utf-8")
+            self.writer.write(b"%x\r\n%s\r\n" % (len(data), data))
+            await self.writer.drain()
+
+    async def finish(self):
+        self.writer.write(b"0\r\n\r\n")
+        self.finished = True
+        await self.writer.drain()
+
+    async def send_json(self, status, data):
+        body = json.dumps(data).encode("utf-8")
+        await self.start(status, "application/json", len(body))
+        self.writer.write(body)
+        self.finished = True
+        await self.writer.drain()
+
+    async def send_error(self, fmt, message):
+        """End a started stream with the error, as a record in JSONL and as a last line in text"""
+        if fmt == "jsonl":
+            await self.send_chunk(json.dumps({"type": "error", "error": message}) + "\n")
+        else:
+            await self.send_chunk(f"\nError: {message}\n")
+        await self.finish()
+
+    async def fail(self, status, message):
+        """Report an error, in the status line if nothing was sent yet"""
+        try:
+            if not self.started:
+                await self.send_json(status, {"error": message})
+            elif not self.finished:
+                # The status line is gone, the client sees the stream end without the closing chunk
+                await self.send_chunk(json.dumps({"type": "error", "error": message}) + "\n")
+        except ConnectionError:
+            pass
+
+    async def close(self):
+        try:
+            self.writer.close()
+            await self.writer.wait_closed()
+        except ConnectionError:
+            pass
+
+
+async def serve(host, port, server):
+    listener = await server.start(host, port)
+    print(f"Serving on http://{host}:{port}, {server.max_requests} requests at a time")
+    async with listener:
+        await listener.serve_forever()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the extraction and cleanup pipeline over local HTTP")
+    parser.add_argument("--host", default=DEFAULT_HOST, help="Address to listen on")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="Port to listen on")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="Extraction worker processes")
+    parser.add_argument("--max-requests", type=int, default=MAX_REQUESTS, help="Requests served at once")
+    parser.add_argument("--timeout", type=float, default=REQUEST_TIMEOUT, help="Seconds allowed per request")
+    parser.add_argument("--max-upload-mb", type=float, default=MAX_UPLOAD_MB, help="Size cap of uploaded PDFs")
+    parser.add_argument("--allow-dir", action="append", default=[],
+                        help="Folder whose PDFs may be named by path instead of uploaded, can be repeated")
+    args = parser.parse_args(argv)
+
+    server = BookServer(args.workers, args.max_requests, args.timeout, int(args.max_upload_mb * 1024 * 1024),
+                        args.allow_dir)
+    try:
+        asyncio.run(serve(args.host, args.port, server))
+    except KeyboardInterrupt:
+        print("Stopped")
+    finally:
+        server.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,161 @@
+"""Startup benchmark of the Book Summary app: import time and time to first paint, each run in a fresh interpreter"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+from book_benchmark import DEFAULT_TOLERANCE, environment
+
+DEFAULT_OUTPUT = "startup_results.json"
+
+# Seconds from starting Python to the window being drawn, and to import book_summary
+FIRST_PAINT_TARGET = 1.0
+IMPORT_TARGET = 0.5
+
+# Modules that are only loaded once a PDF is opened or summarized
+DEFERRED_MODULES = ("fitz", "numpy")
+
+# Slowdowns smaller than this many seconds are run to run noise
+NOISE_SECONDS = 0.02
+
+# Seconds one run may wait for the window to be drawn and its panels built
+RUN_TIMEOUT = 30.0
+
+# Runs in the child interpreter, prints one JSON record; argv[1] is the time.time() it was started at
+CHILD_SCRIPT = """
+import json, sys, time
+spawned = float(sys.argv[1])
+result = {"started": time.time() - spawned}
+started = time.perf_counter()
+import book_summary
+result["import"] = time.perf_counter() - started
+result["loaded"] = [name for name in sys.argv[3:] if name in sys.modules]
+try:
+    root = book_summary.tk.Tk()
+except book_summary.tk.TclError as e:
+    result["error"] = f"No display: {e}"
+else:
+    app = book_summary.BookSummaryApp(root)
+    result["window"] = time.time() - spawned
+
+    def exposed(event):
+        # Tk draws what was exposed at the next idle, right after this
+        if event.widget is root and "first_paint" not in result:
+            result["first_paint"] = time.time() - spawned
+
+    root.bind("<Expose>", exposed, add="+")
+    deadline = time.time() + float(sys.argv[2])
+    while ("first_paint" not in result or not app.panels_built) and time.time() < deadline:
+        root.update()
+    if app.panels_built:
+        root.update_idletasks()
+        result["ready"] = time.time() - spawned
+        app.close_app()
+    else:
+        root.destroy()
+print(json.dumps(result))
+"""
+
+# Measurements of a run, in seconds
+MEASUREMENTS = ("started", "import", "window", "first_paint", "ready")
+
+
+def run_once(timeout=RUN_TIMEOUT):
+    """Start the app in a fresh interpreter, returns its record"""
+    completed = subprocess.run(
+        [sys.executable, "-c", CHILD_SCRIPT, repr(time.time()), str(timeout), *DEFERRED_MODULES],
+        cwd=Path(__file__).resolve().parent, capture_output=True, text=True, timeout=timeout + 30,
+    )
+    if completed.returncode != 0:
+        raise RuntimeError(f"Startup run failed: {completed.stderr.strip()}")
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def benchmark_startup(repeat=5, timeout=RUN_TIMEOUT):
+    """Median of each measurement over repeat runs, None for the ones no run reached
+
+    The first run warms the OS file cache and is not counted, the other
+    runs measure a warm start of a cold interpreter.
+    """
+    run_once(timeout)
+    records = [run_once(timeout) for _ in range(repeat)]
+    result = {}
+    for name in MEASUREMENTS:
+        values = [record[name] for record in records if name in record]
+        result[name] = round(statistics.median(values), 4) if values else None
+    result["loaded"] = sorted({name for record in records for name in record["loaded"]})
+    result["error"] = next((record["error"] for record in records if "error" in record), None)
+    return result
+
+
+def check_targets(result, first_paint_target=FIRST_PAINT_TARGET, import_target=IMPORT_TARGET):
+    """Missed targets as readable lines"""
+    missed = []
+    if result["import"] > import_target:
+        missed.append(f"import took {result['import']:.3f}s, target {import_target:.3f}s")
+    if result["first_paint"] is not None and result["first_paint"] > first_paint_target:
+        missed.append(f"first paint after {result['first_paint']:.3f}s, target {first_paint_target:.3f}s")
+    if result["loaded"]:
+        missed.append(f"{', '.join(result['loaded'])} imported at startup")
+    return missed
+
+
+def compare_startup(result, baseline, tolerance=DEFAULT_TOLERANCE):
+    """Measurements that got slower than baseline by more than tolerance, as readable lines"""
+    regressions = []
+    for name in MEASUREMENTS:
+        old = baseline["results"].get(name)
+        new = result.get(name)
+        if not old or new is None:
+            continue
+        change = new / old - 1
+        if change > tolerance and new - old > NOISE_SECONDS:
+            regressions.append(f"{name}: {old:.3f}s -> {new:.3f}s ({change:+.0%})")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure how fast the Book Summary app starts")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs, the median is kept")
+    parser.add_argument("--target", type=float, default=FIRST_PAINT_TARGET,
+                        help="Seconds allowed from starting Python to the window being drawn")
+    parser.add_argument("--import-target", type=float, default=IMPORT_TARGET,
+                        help="Seconds allowed to import book_summary")
+    parser.add_argument("-o", "--output", default=DEFAULT_OUTPUT, help="JSON file for the results")
+    parser.add_argument("--baseline", help="Results of an earlier run to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="Allowed slowdown against the baseline, as a fraction")
+    args = parser.parse_args(argv)
+
+    try:
+        result = benchmark_startup(max(1, args.repeat))
+    except Exception as e:
+        print(str(e), file=sys.stderr)
+        return 1
+    for name in MEASUREMENTS:
+        value = f"{result[name]:.4f}s" if result[name] is not None else "not measured"
+        print(f"  {name:<12} {value}")
+    if result["error"]:
+        print(f"  {result['error']}, only the import was measured")
+
+    report = {
+        "environment": environment(),
+        "settings": {"repeat": args.repeat, "target": args.target, "import_target": args.import_target},
+        "results": result,
+    }
+    Path(args.output).write_text(json.dumps(report, indent=2), encoding="utf-8")
+    print(f"Wrote {args.output}")
+
+    failures = check_targets(result, args.target, args.import_target)
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text(encoding="utf-8"))
+        failures += compare_startup(result, baseline, args.tolerance)
+    for line in failures:
+        print(f"Regression: {line}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
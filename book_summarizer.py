@@ -0,0 +1,410 @@
+"""Extractive per-chapter summaries: TextRank over TF-IDF sentence vectors, cached by chapter text"""
+import argparse
+import hashlib
+import json
+import math
+import re
+import sqlite3
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from book_document import Page
+from book_engine import (
+    chapter_page_ranges,
+    extract_contents,
+    find_page_offset,
+    iter_page_texts,
+    open_pdf,
+    select_contents_pages,
+    select_pages,
+)
+from book_export import add_cleanup_arguments, rules_from_args
+from book_search import tokenize
+from cleanup_pipeline import STAGES, CleanupPipeline, layout_stages
+from marker_rules import DEFAULT_RULES
+from page_cache import PageCache, default_cache_dir
+
+# Sentences picked per chapter
+DEFAULT_SUMMARY_SENTENCES = 5
+
+# Bumped whenever the summaries would come out differently, so cached ones are not reused
+SUMMARIZER_VERSION = 2
+
+# TextRank damping factor and stopping point of the power iteration
+DAMPING = 0.85
+MAX_ITERATIONS = 100
+TOLERANCE = 1e-6
+
+# Sentences with fewer words are never picked
+MIN_SENTENCE_WORDS = 4
+
+# Sentences are ranked in blocks of at most this many in a row, so a chapter's cost grows linearly with its length
+RANK_BLOCK_SENTENCES = 400
+
+# Below this many uncached chapters starting worker processes costs more than it saves
+PARALLEL_MIN_CHAPTERS = 4
+
+# A sentence ends at . ! or ? followed by space and an upper case letter, digit or opening quote
+SENTENCE_END = re.compile(r'(?<=[.!?])["”’)]?\s+(?=["“‘(]?[A-Z0-9])')
+
+STOPWORDS = frozenset("""
+a about above after again against all am an and any are as at be because been before being below between both
+but by can did do does doing down during each few for from further had has have having he her here hers him
+his how i if in into is it its itself just me more most my no nor not now of off on once only or other our
+ours out over own same she should so some such than that the their theirs them then there these they this
+those through to too under until up very was we were what when where which while who whom why will with you
+your yours
+""".split())
+
+
+class Chapter:
+    """Cleaned text of one contents entry's pages"""
+    __slots__ = ("title", "first_page", "last_page", "text")
+
+    def __init__(self, title, first_page, last_page, text):
+        self.title = title
+        self.first_page = first_page  # 1-based PDF pages, inclusive
+        self.last_page = last_page
+        self.text = text
+
+    def key(self, sentences):
+        """Cache key of the chapter's summary, changes with the cleaned text"""
+        digest = hashlib.sha256(f"{SUMMARIZER_VERSION}\0{sentences}\0".encode("utf-8"))
+        digest.update(self.text.encode("utf-8"))
+        return digest.hexdigest()
+
+
+def page_summary_text(page):
+    """The body text of a cleaned page: its displayed lines without endnotes, headers and page numbers"""
+    return ' '.join(text.strip() for text, flags in page.display_lines(markup=False) if not flags and text.strip())
+
+
+def book_chapters(pages, contents_table, page_offset, total_pages):
+    """Group pages (in page order) into Chapters by the contents table
+
+    Without a usable contents table the whole book is one chapter.
+    Entries starting on the same page are merged into the first one, and
+    chapters none of whose pages were given are left out.
+    """
+    ranges = []
+    if contents_table and page_offset is not None:
+        ranges = chapter_page_ranges(contents_table, page_offset, total_pages)
+    chapters = []
+    starts = set()
+    for entry, page_range in zip(contents_table, ranges):
+        if page_range is not None and page_range[0] not in starts:
+            starts.add(page_range[0])
+            chapters.append(Chapter(entry['text'], page_range[0], page_range[1], ""))
+    if not chapters:
+        chapters = [Chapter("Book", 1, total_pages, "")]
+    chapters.sort(key=lambda chapter: chapter.first_page)
+
+    texts = [[] for _ in chapters]
+    position = 0
+    for page in pages:
+        while position < len(chapters) and page.number > chapters[position].last_page:
+            position += 1
+        if position == len(chapters):
+            break
+        if page.number >= chapters[position].first_page:
+            texts[position].append(page_summary_text(page))
+
+    for chapter, chapter_texts in zip(chapters, texts):
+        chapter.text = ' '.join(text for text in chapter_texts if text)
+    return [chapter for chapter in chapters if chapter.text]
+
+
+def split_sentences(text):
+    return [sentence.strip() for sentence in SENTENCE_END.split(text) if sentence.strip()]
+
+
+# NumPy, filled in by load_numpy() when the first summary is made: summaries need it, everything else works without it
+np = None
+
+
+def load_numpy():
+    """The NumPy module, imported on first use"""
+    global np
+    if np is None:
+        try:
+            import numpy
+        except ImportError:
+            raise RuntimeError("Summaries need NumPy, install it with 'pip install numpy'")
+        np = numpy
+    return np
+
+
+def sentence_vectors(sentence_words):
+    """Sparse L2-normalized TF-IDF vectors of tokenized sentences, as dicts of word -> weight
+
+    Words found in one sentence only add to its norm, never to a
+    similarity, so they are left out of the vectors.
+    """
+    document_frequency = {}
+    for words in sentence_words:
+        for word in set(words):
+            document_frequency[word] = document_frequency.get(word, 0) + 1
+    vectors = []
+    for words in sentence_words:
+        counts = {}
+        for word in words:
+            counts[word] = counts.get(word, 0) + 1
+        weights = {word: math.log1p(count) * (math.log(len(sentence_words) / document_frequency[word]) + 1.0)
+                   for word, count in counts.items()}
+        norm = math.sqrt(sum(weight * weight for weight in weights.values()))
+        vectors.append({word: weight / norm for word, weight in weights.items() if document_frequency[word] > 1})
+    return vectors
+
+
+def rank_sentences(vectors):
+    """TextRank scores of sentence_vectors, scaled so they average 1
+
+    The cosine similarities are summed word by word from an inverted
+    index, so only sentences sharing a word are compared, and are the
+    weighted edges of a graph scored by PageRank's power iteration.
+    """
+    np = load_numpy()
+    size = len(vectors)
+    postings = {}  # Word -> ([sentences holding it], [their weights])
+    for i, vector in enumerate(vectors):
+        for word, weight in vector.items():
+            sentences, weights = postings.setdefault(word, ([], []))
+            sentences.append(i)
+            weights.append(weight)
+    rows, columns, products = [], [], []
+    for sentences, weights in postings.values():
+        if len(sentences) < 2:
+            continue
+        first, second = np.triu_indices(len(sentences), 1)
+        sentences = np.array(sentences)
+        weights = np.array(weights)
+        rows.append(sentences[first])
+        columns.append(sentences[second])
+        products.append(weights[first] * weights[second])
+    similarity = np.zeros((size, size))
+    if rows:
+        np.add.at(similarity, (np.concatenate(rows), np.concatenate(columns)), np.concatenate(products))
+        similarity += similarity.T
+    totals = similarity.sum(axis=1, keepdims=True)
+    # Sentences sharing no words with any other link to every sentence alike
+    transition = np.divide(similarity, totals, out=np.full_like(similarity, 1.0 / size), where=totals > 0)
+
+    scores = np.full(size, 1.0 / size)
+    for _ in range(MAX_ITERATIONS):
+        updated = (1 - DAMPING) / size + DAMPING * (transition.T @ scores)
+        converged = np.abs(updated - scores).sum() < TOLERANCE
+        scores = updated
+        if converged:
+            break
+    return scores * size
+
+
+def summarize_text(text, sentences=DEFAULT_SUMMARY_SENTENCES):
+    """The most central sentences of text in their original order
+
+    Sentences become sparse TF-IDF vectors and are scored by TextRank,
+    see rank_sentences. A long text is ranked in blocks of at most
+    RANK_BLOCK_SENTENCES consecutive sentences, which bounds the memory
+    of the graph and keeps the time linear in the length of the text.
+    """
+    np = load_numpy()
+    candidates = split_sentences(text)
+    words = [[word for word in tokenize(sentence) if word not in STOPWORDS] for sentence in candidates]
+    kept = [i for i, sentence_words in enumerate(words) if len(sentence_words) >= MIN_SENTENCE_WORDS]
+    if len(kept) <= sentences:
+        return [candidates[i] for i in kept]
+
+    vectors = sentence_vectors([words[i] for i in kept])
+    blocks = -(-len(kept) // RANK_BLOCK_SENTENCES)
+    bounds = [len(kept) * block // blocks for block in range(blocks + 1)]
+    scores = np.concatenate([rank_sentences(vectors[start:end]) for start, end in zip(bounds, bounds[1:])])
+
+    best = sorted(np.argsort(-scores, kind="stable")[:sentences])
+    return [candidates[kept[i]] for i in best]
+
+
+def _summarize_chunk(texts, sentences):
+    """Worker: summarize a list of chapter texts"""
+    return [summarize_text(text, sentences) for text in texts]
+
+
+class SummaryCache:
+    """SQLite store of chapter summaries keyed by Chapter.key, next to the page cache"""
+
+    def __init__(self, cache_dir=None):
+        self.cache_dir = Path(cache_dir) if cache_dir is not None else default_cache_dir()
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.path = self.cache_dir / "summaries.sqlite"
+
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(str(self.path), timeout=30, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS summaries (
+                key TEXT PRIMARY KEY,
+                sentences TEXT NOT NULL,
+                last_used REAL NOT NULL
+            )
+        """)
+        self.connection.commit()
+
+    def get_many(self, keys):
+        """Summaries of the keys found in the cache, as a dict"""
+        found = {}
+        with self.lock:
+            for key in keys:
+                row = self.connection.execute("SELECT sentences FROM summaries WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    found[key] = json.loads(row[0])
+            if found:
+                self.connection.executemany(
+                    "UPDATE summaries SET last_used = ? WHERE key = ?", [(time.time(), key) for key in found])
+                self.connection.commit()
+        return found
+
+    def put_many(self, summaries):
+        with self.lock:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO summaries (key, sentences, last_used) VALUES (?, ?, ?)",
+                [(key, json.dumps(sentences, ensure_ascii=False), time.time()) for key, sentences in summaries.items()]
+            )
+            self.connection.commit()
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+def _summarize_in_pool(pool, texts, sentences, chunk_size):
+    futures = [pool.submit(_summarize_chunk, texts[start:start + chunk_size], sentences)
+               for start in range(0, len(texts), chunk_size)]
+    return [summary for future in futures for summary in future.result()]
+
+
+def summarize_chapters(chapters, sentences=DEFAULT_SUMMARY_SENTENCES, workers=1, cache=None, pool=None):
+    """Summaries of the chapters in order, returns (summaries, number of chapters summarized)
+
+    Cached summaries are reused, so after a cleanup step only the chapters
+    whose text changed are summarized again. With more than one worker
+    and enough chapters the rest are spread over worker processes, those
+    of pool when one is passed.
+    """
+    keys = [chapter.key(sentences) for chapter in chapters]
+    found = cache.get_many(keys) if cache is not None else {}
+    missing = [i for i, key in enumerate(keys) if key not in found]
+
+    texts = [chapters[i].text for i in missing]
+    if workers > 1 and len(missing) >= PARALLEL_MIN_CHAPTERS:
+        chunk_size = -(-len(texts) // workers)
+        if pool is not None:
+            results = _summarize_in_pool(pool, texts, sentences, chunk_size)
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as own_pool:
+                results = _summarize_in_pool(own_pool, texts, sentences, chunk_size)
+    else:
+        results = _summarize_chunk(texts, sentences)
+
+    new = {keys[i]: summary for i, summary in zip(missing, results)}
+    if cache is not None and new:
+        cache.put_many(new)
+    found.update(new)
+    return [found[key] for key in keys], len(missing)
+
+
+def format_summaries(chapters, summaries):
+    """Readable text of the chapter summaries"""
+    blocks = []
+    for chapter, summary in zip(chapters, summaries):
+        heading = f"{chapter.title} (pages {chapter.first_page}-{chapter.last_page})"
+        blocks.append(heading + "\n" + "\n".join(f"- {sentence}" for sentence in summary))
+    return "\n\n".join(blocks) + "\n"
+
+
+def summarize_book(file_path, sentences=DEFAULT_SUMMARY_SENTENCES, start=None, end=None, contents_start=None,
+                   contents_end=None, rules=DEFAULT_RULES, stages=STAGES, page_workers=1, cache=None,
+                   summary_cache=None, layout=False, pages=None, contents_pages=None):
+    """Extract, clean and summarize one PDF per chapter, returns (chapters, summaries)
+
+    Pages are cleaned as they are extracted and only their body text is
+    kept, so the book's pages are never all in memory.
+    """
+    pipeline = CleanupPipeline(layout_stages(stages) if layout else stages, rules)
+    doc = open_pdf(file_path)
+    try:
+        total_pages = doc.page_count
+        contents_pages = select_contents_pages(total_pages, contents_start, contents_end, contents_pages)
+        page_numbers = select_pages(total_pages, start, end, pages)
+        contents = extract_contents(doc, contents_pages, page_workers, cache)
+        page_offset = contents.page_offset
+        if contents.contents_table and page_offset is None:
+            page_offset = find_page_offset(doc, contents_pages[-1] + 1 if contents_pages else 1, cache=cache)
+
+        results = iter_page_texts(doc, [number - 1 for number in page_numbers], page_workers, cache=cache,
+                                  layout=layout)
+        if layout:
+            pages = (Page.from_layout(page_num, text, error, pipeline.rules) for page_num, text, error in results)
+        else:
+            pages = (Page.from_extraction(page_num, text, error) for page_num, text, error in results)
+        chapters = book_chapters(
+            (page for page, _ in pipeline.process(pages)), contents.contents_table, page_offset, total_pages)
+    finally:
+        doc.close()
+    summaries, _ = summarize_chapters(chapters, sentences, page_workers, summary_cache)
+    return chapters, summaries
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Summarize each chapter of a PDF without the GUI")
+    parser.add_argument("input", help="PDF file")
+    parser.add_argument("-o", "--output", help="Output file, printed when omitted")
+    parser.add_argument("-n", "--sentences", type=int, default=DEFAULT_SUMMARY_SENTENCES,
+                        help="Sentences per chapter")
+    add_cleanup_arguments(parser)
+    args = parser.parse_args(argv)
+    rules, stages = rules_from_args(parser, args)
+
+    cache = None
+    summary_cache = None
+    try:
+        if args.cache_dir is not None:
+            max_bytes = int(args.cache_size_mb * 1024 * 1024) if args.cache_size_mb is not None else None
+            cache = PageCache(args.cache_dir, max_bytes)
+            summary_cache = SummaryCache(args.cache_dir)
+        chapters, summaries = summarize_book(
+            args.input,
+            sentences=args.sentences,
+            start=args.start,
+            end=args.end,
+            contents_start=args.contents_start,
+            contents_end=args.contents_end,
+            rules=rules,
+            stages=stages,
+            page_workers=args.page_workers,
+            cache=cache,
+            summary_cache=summary_cache,
+            layout=args.layout,
+            pages=args.pages,
+            contents_pages=args.contents_pages,
+        )
+    except Exception as e:
+        print(f"Error summarizing {args.input}: {str(e)}", file=sys.stderr)
+        return 1
+    finally:
+        if cache is not None:
+            cache.close()
+        if summary_cache is not None:
+            summary_cache.close()
+
+    text = format_summaries(chapters, summaries)
+    if args.output:
+        Path(args.output).write_text(text, encoding="utf-8")
+        print(f"Summarized {len(chapters)} chapters of {args.input} -> {args.output}")
+    else:
+        print(text, end="")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,15 +1,89 @@
+import os
+import queue
+import threading
+import time
 import tkinter as tk
+from concurrent.futures.process import BrokenProcessPool
 from tkinter import filedialog, scrolledtext, messagebox
-import re
-from pathlib import Path
-import fitz  # PyMuPDF
 from tkinter import ttk
+import book_engine
+from book_export import export_document
+from book_history import DocumentHistory
+from book_summarizer import SummaryCache, book_chapters, format_summaries, summarize_chapters
+from book_profiler import Profiler
+from book_document import ENDNOTE, HEADER, PAGE_NUMBER, BookDocument, Line, Page
+from book_viewer import PageViewer
+from book_workspace import BookTab, Workspace
+from cleanup_pipeline import STAGE_LABELS, STAGES, CleanupPipeline
+from marker_rules import (
+    DEFAULT_MAX_HEADER_LENGTH,
+    DEFAULT_SPECIAL_CHARS,
+    MarkerRules,
+    list_publishers,
+    load_publisher_rules,
+    save_publisher_rules,
+)
+from page_cache import PageCache
+
+# How often the extraction queue is drained, in milliseconds
+EXTRACTION_POLL_MS = 50
+
+# Milliseconds after which the panels are built even if the window was never drawn, e.g. started minimized
+PANEL_FALLBACK_MS = 500
+
+# Upper bound of pages inserted into the text area per drain
+MAX_PAGES_PER_DRAIN = 100
+
+# App attributes that belong to the book shown, swapped with the tabs
+TAB_ATTRIBUTES = (
+    "current_pdf", "document", "history", "loaded_file", "loaded_contents_range", "contents_table",
+    "selected_chapters", "chapter_lines", "search_hits", "extraction_queue", "cancel_event",
+    "extraction_file", "extraction_total", "extraction_reused", "extraction_done", "extraction_started",
+    "edition_report",
+)
+
+# Under the Start entries, which also take a selection of pages
+SELECTION_HINT = "Start also takes pages like 1-3, 45-60, 210"
+
+# Entries whose text belongs to the book shown
+TAB_ENTRIES = ("start_page", "end_page", "start_page_entry", "end_page_entry", "page_offset_entry", "search_entry")
 
 class BookSummaryApp:
     def __init__(self, root):
         self.root = root
         self.root.title("Book Summary")
         
+        # Marker rules of the selected publisher, the entries override its chars and header length
+        self.rules = MarkerRules()
+        
+        # Background extraction state
+        self.extraction_queue = None
+        self.cancel_event = None
+        self.drain_after = None  # Pending drain of the shown book's extraction queue
+        
+        # Open books share the open PDFs and the extraction pool, the state of the one shown lives on the app
+        self.workspace = Workspace()
+        self.current_pdf = None
+        
+        # Extracted pages with their markers, the pages around the view are rendered into text_area
+        self.document = BookDocument()
+        self.history = DocumentHistory(self.document)  # Undo and redo of the mark and remove operations
+        self.loaded_file = None  # PDF the document was extracted from
+        self.loaded_contents_range = None
+        self.contents_table = []
+        self.selected_chapters = set()  # Indexes into contents_table
+        self.chapter_lines = {}  # Contents area line number -> contents_table index
+        self.search_hits = []  # (page number, displayed line) of the hits listed
+        self.edition_report = None  # Pages a new edition changed, shown when its extraction is done
+        
+        # Stage timers, off unless BOOK_SUMMARY_PROFILE is set or turned on from the Tools menu
+        self.profiler = Profiler.from_environment()
+        
+        # Persistent extraction and summary caches, opened with the panels
+        self.page_cache = None
+        self.summary_cache = None
+        self.summary_queue = None
+        
         # Get screen dimensions
         screen_width = root.winfo_screenwidth()
         screen_height = root.winfo_screenheight()
@@ -29,21 +103,73 @@ class BookSummaryApp:
         self.root.grid_columnconfigure(2, weight=0)  # No weight to respect fixed width
         
         # Left frame for parameters (1/4 width)
-        parameters_frame = ttk.Frame(root, padding="10", width=params_width)
-        parameters_frame.grid(row=0, column=0, sticky="nsew")
-        parameters_frame.grid_propagate(False)  # Prevent frame from shrinking
-        parameters_frame.grid_columnconfigure(0, weight=1)
-        
-        # Add all parameter controls to parameters_frame
-        self.setup_parameter_controls(parameters_frame)
+        self.parameters_frame = ttk.Frame(root, padding="10", width=params_width)
+        self.parameters_frame.grid(row=0, column=0, sticky="nsew")
+        self.parameters_frame.grid_propagate(False)  # Prevent frame from shrinking
+        self.parameters_frame.grid_columnconfigure(0, weight=1)
         
         # Middle frame for contents (1/4 width)
-        contents_frame = ttk.Frame(root, padding="10", width=contents_width)
-        contents_frame.grid(row=0, column=1, sticky="nsew")
-        contents_frame.grid_propagate(False)  # Prevent frame from shrinking
-        contents_frame.grid_columnconfigure(0, weight=1)
-        contents_frame.grid_rowconfigure(1, weight=1)
+        self.contents_frame = ttk.Frame(root, padding="10", width=contents_width)
+        self.contents_frame.grid(row=0, column=1, sticky="nsew")
+        self.contents_frame.grid_propagate(False)  # Prevent frame from shrinking
+        self.contents_frame.grid_columnconfigure(0, weight=1)
+        self.contents_frame.grid_rowconfigure(1, weight=1)
+        
+        # Right frame for main text (1/2 width)
+        self.main_text_frame = ttk.Frame(root, padding="10", width=main_width)
+        self.main_text_frame.grid(row=0, column=2, sticky="nsew")
+        self.main_text_frame.grid_propagate(False)  # Prevent frame from shrinking
+        self.main_text_frame.grid_columnconfigure(0, weight=1)
+        self.main_text_frame.grid_rowconfigure(2, weight=1)
+        
+        # Status bar
+        self.status_var = tk.StringVar()
+        self.status_var.set("Loading...")
+        status_bar = ttk.Label(root, textvariable=self.status_var, relief=tk.SUNKEN)
+        status_bar.grid(row=1, column=0, columnspan=3, sticky="ew")
         
+        # The window shows with the empty frames first, the panels are filled in once it has been drawn
+        self.panels_built = False
+        self.panels_pending = False
+        self.root.bind("<Expose>", self.on_first_expose, add="+")
+        self.root.after(PANEL_FALLBACK_MS, self.build_panels)
+        
+    def on_first_expose(self, event):
+        """Build the panels after Tk has drawn the window, its drawing also waits for idle time"""
+        if event.widget is self.root and not self.panels_built and not self.panels_pending:
+            self.panels_pending = True
+            self.root.after_idle(self.build_panels)
+        
+    def build_panels(self):
+        """Fill in the parameter, contents and main text panels, the menus and the caches"""
+        if self.panels_built:
+            return
+        self.panels_built = True
+        with self.profiler.stage("build_panels"):
+            self.setup_parameter_controls(self.parameters_frame)
+            self.setup_contents_panel(self.contents_frame)
+            self.setup_main_text_panel(self.main_text_frame)
+            self.setup_menu()
+            self.add_tab(BookTab())
+            self.root.protocol("WM_DELETE_WINDOW", self.close_app)
+            self.open_caches()
+        self.status_var.set("Ready")
+        
+    def open_caches(self):
+        """Persistent extraction and summary caches, extraction still works without them"""
+        try:
+            self.page_cache = PageCache()
+        except Exception as e:
+            self.page_cache = None
+            print(f"Extraction cache disabled: {str(e)}")
+        try:
+            self.summary_cache = SummaryCache(self.page_cache.cache_dir if self.page_cache is not None else None)
+        except Exception as e:
+            self.summary_cache = None
+            print(f"Summary cache disabled: {str(e)}")
+        
+    def setup_contents_panel(self, contents_frame):
+        """Contents text area, chapter extraction and search in the middle frame"""
         # Label for Contents
         ttk.Label(contents_frame, text="Contents").grid(row=0, column=0, sticky="w")
         
@@ -55,29 +181,107 @@ class BookSummaryApp:
         self.contents_area.grid(row=1, column=0, sticky="nsew")
         contents_scrollbar.grid(row=1, column=1, sticky="ns")
         
-        # Right frame for main text (1/2 width)
-        main_text_frame = ttk.Frame(root, padding="10", width=main_width)
-        main_text_frame.grid(row=0, column=2, sticky="nsew")
-        main_text_frame.grid_propagate(False)  # Prevent frame from shrinking
-        main_text_frame.grid_columnconfigure(0, weight=1)
-        main_text_frame.grid_rowconfigure(1, weight=1)
+        # Click contents entries to choose chapters, then extract only their pages
+        self.contents_area.tag_configure("selected_chapter", background="#ffe0b3")
+        self.contents_area.bind("<Button-1>", self.toggle_chapter)
+        chapter_frame = ttk.Frame(contents_frame)
+        chapter_frame.grid(row=2, column=0, columnspan=2, sticky="ew", pady=(5, 0))
+        ttk.Label(chapter_frame, text="Page offset:").grid(row=0, column=0, padx=(0, 5))
+        self.page_offset_entry = ttk.Entry(chapter_frame, width=6)
+        self.page_offset_entry.grid(row=0, column=1)
+        ttk.Button(chapter_frame, text="Extract Chapters", command=self.extract_chapters).grid(
+            row=0, column=2, padx=(5, 0))
+        
+        # Search box, hits are listed as you type and clicking one shows it in the main text
+        search_frame = ttk.Frame(contents_frame)
+        search_frame.grid(row=3, column=0, columnspan=2, sticky="ew", pady=(10, 0))
+        search_frame.grid_columnconfigure(1, weight=1)
+        ttk.Label(search_frame, text="Search:").grid(row=0, column=0, padx=(0, 5))
+        self.search_entry = ttk.Entry(search_frame)
+        self.search_entry.grid(row=0, column=1, sticky="ew")
+        self.search_entry.bind("<KeyRelease>", lambda event: self.update_search())
+        self.search_list = tk.Listbox(contents_frame, height=8, font=('Arial', 10))
+        search_scrollbar = ttk.Scrollbar(contents_frame, orient=tk.VERTICAL, command=self.search_list.yview)
+        self.search_list.configure(yscrollcommand=search_scrollbar.set)
+        self.search_list.grid(row=4, column=0, sticky="ew")
+        search_scrollbar.grid(row=4, column=1, sticky="ns")
+        self.search_list.bind("<<ListboxSelect>>", lambda event: self.show_search_hit())
+        
+    def setup_main_text_panel(self, main_text_frame):
+        """Book tabs, marker switches, page jump and the main text area in the right frame"""
+        # One tab per open book, the tabs only switch the book shown in the widgets below
+        self.book_tabs = ttk.Notebook(main_text_frame)
+        self.book_tabs.grid(row=0, column=0, columnspan=2, sticky="ew")
+        self.book_tabs.bind("<<NotebookTabChanged>>", lambda event: self.select_tab())
+        self.tab_frames = {}
         
         # Label for Main Text
-        ttk.Label(main_text_frame, text="Main Text").grid(row=0, column=0, sticky="w")
+        ttk.Label(main_text_frame, text="Main Text").grid(row=1, column=0, sticky="w")
+        
+        # Visibility of the highlighted markers
+        marker_frame = ttk.Frame(main_text_frame)
+        marker_frame.grid(row=1, column=0)
+        self.marker_vars = {}
+        for i, (flag, label) in enumerate(((ENDNOTE, "Endnotes"), (HEADER, "Headers"), (PAGE_NUMBER, "Page N"))):
+            self.marker_vars[flag] = tk.BooleanVar(value=True)
+            ttk.Checkbutton(
+                marker_frame,
+                text=label,
+                variable=self.marker_vars[flag],
+                command=lambda flag=flag: self.toggle_markers(flag)
+            ).grid(row=0, column=i, padx=5)
+        
+        # Page jump box
+        jump_frame = ttk.Frame(main_text_frame)
+        jump_frame.grid(row=1, column=0, columnspan=2, sticky="e")
+        ttk.Label(jump_frame, text="Page:").grid(row=0, column=0, padx=(0, 5))
+        self.page_jump_entry = ttk.Entry(jump_frame, width=8)
+        self.page_jump_entry.grid(row=0, column=1)
+        self.page_jump_entry.bind("<Return>", lambda event: self.jump_to_page())
+        ttk.Button(jump_frame, text="Go", command=self.jump_to_page).grid(row=0, column=2, padx=(5, 0))
         
-        # Main text area
+        # Main text area, the scrollbar spans the whole book while the text area holds a window of pages
         self.text_area = tk.Text(main_text_frame, wrap=tk.WORD, font=('Arial', 12))
-        text_scrollbar = ttk.Scrollbar(main_text_frame, orient=tk.VERTICAL, command=self.text_area.yview)
-        self.text_area.configure(yscrollcommand=text_scrollbar.set)
+        text_scrollbar = ttk.Scrollbar(main_text_frame, orient=tk.VERTICAL)
+        self.viewer = PageViewer(self.text_area, text_scrollbar)
+        self.viewer.set_document(self.document)
         
-        self.text_area.grid(row=1, column=0, sticky="nsew")
-        text_scrollbar.grid(row=1, column=1, sticky="ns")
+        self.text_area.grid(row=2, column=0, sticky="nsew")
+        text_scrollbar.grid(row=2, column=1, sticky="ns")
         
-        # Status bar
-        self.status_var = tk.StringVar()
-        self.status_var.set("Ready")
-        status_bar = ttk.Label(root, textvariable=self.status_var, relief=tk.SUNKEN)
-        status_bar.grid(row=1, column=0, columnspan=3, sticky="ew")
+    def setup_menu(self):
+        """File menu with the open books, Edit menu with undo and redo, Tools menu with the profiling switches
+        and dumps and saving the search index"""
+        menubar = tk.Menu(self.root)
+        file_menu = tk.Menu(menubar, tearoff=0)
+        file_menu.add_command(label="Open PDF...", command=self.upload_pdf, accelerator="Ctrl+O")
+        file_menu.add_command(label="Open New Edition...", command=self.open_new_edition)
+        file_menu.add_command(label="Close Book", command=self.close_book, accelerator="Ctrl+W")
+        menubar.add_cascade(label="File", menu=file_menu)
+        self.root.bind("<Control-o>", lambda event: self.upload_pdf())
+        self.root.bind("<Control-w>", lambda event: self.close_book())
+        
+        self.edit_menu = tk.Menu(menubar, tearoff=0)
+        self.edit_menu.add_command(label="Undo", command=self.undo, accelerator="Ctrl+Z", state='disabled')
+        self.edit_menu.add_command(label="Redo", command=self.redo, accelerator="Ctrl+Y", state='disabled')
+        menubar.add_cascade(label="Edit", menu=self.edit_menu)
+        self.root.bind("<Control-z>", lambda event: self.undo())
+        self.root.bind("<Control-y>", lambda event: self.redo())
+        self.root.bind("<Control-Shift-Z>", lambda event: self.redo())
+        
+        tools_menu = tk.Menu(menubar, tearoff=0)
+        self.profile_var = tk.BooleanVar(value=self.profiler.enabled)
+        self.cprofile_var = tk.BooleanVar(value=self.profiler.use_cprofile)
+        tools_menu.add_checkbutton(label="Profile Timings", variable=self.profile_var, command=self.toggle_profiling)
+        tools_menu.add_checkbutton(label="Use cProfile", variable=self.cprofile_var, command=self.toggle_profiling)
+        tools_menu.add_separator()
+        tools_menu.add_command(label="Save Timing Report...", command=self.save_timing_report)
+        tools_menu.add_command(label="Save cProfile Stats...", command=self.save_profile_stats)
+        tools_menu.add_command(label="Reset Timings", command=self.profiler.reset)
+        tools_menu.add_separator()
+        tools_menu.add_command(label="Save Search Index", command=self.save_search_index)
+        menubar.add_cascade(label="Tools", menu=tools_menu)
+        self.root.config(menu=menubar)
         
     def setup_parameter_controls(self, parent):
         """Setup all parameter controls in the left frame"""
@@ -102,7 +306,7 @@ class BookSummaryApp:
         start_container.grid(row=0, column=0, padx=(0, 5))  # Reduced padding
         
         tk.Label(start_container, text="Start:", bg='#f0f0f0', font=('Arial', 10)).grid(row=0, column=0)  # Reduced text and font
-        self.start_page = tk.Entry(start_container, width=5)  # Reduced width
+        self.start_page = tk.Entry(start_container, width=10)  # Wide enough for a selection like 1-3, 45-60
         self.start_page.grid(row=0, column=1, padx=2)  # Reduced padding
         
         # End page on the right
@@ -113,6 +317,29 @@ class BookSummaryApp:
         self.end_page = tk.Entry(end_container, width=5)  # Reduced width
         self.end_page.grid(row=0, column=1, padx=2)  # Reduced padding
         
+        # Worker processes used to extract pages in parallel
+        workers_container = tk.Frame(page_row, bg='#f0f0f0')
+        workers_container.grid(row=0, column=2, padx=(5, 0))
+        
+        tk.Label(workers_container, text="Workers:", bg='#f0f0f0', font=('Arial', 10)).grid(row=0, column=0)
+        self.workers_entry = tk.Entry(workers_container, width=3)
+        self.workers_entry.insert(0, str(os.cpu_count() or 1))  # Default to one worker per CPU
+        self.workers_entry.grid(row=0, column=1, padx=2)
+        
+        # Classify markers from the page layout while extracting instead of with the buttons afterwards
+        self.layout_var = tk.BooleanVar(value=False)
+        tk.Checkbutton(
+            page_frame,
+            text="Mark from layout",
+            variable=self.layout_var,
+            bg='#f0f0f0',
+            font=('Arial', 10)
+        ).grid(row=1, column=0, sticky="w")
+        
+        # A selection in Start with End left empty picks just those pages
+        tk.Label(page_frame, text=SELECTION_HINT, bg='#f0f0f0', fg='#666666', font=('Arial', 8)).grid(
+            row=2, column=0, sticky="w")
+        
         # Add minimal spacing between frames
         tk.Frame(parent, height=10, bg='#f0f0f0').grid(row=2, column=0)  # Reduced spacing
         
@@ -128,7 +355,7 @@ class BookSummaryApp:
 
         # Left side - Start
         tk.Label(contents_left_frame, text="Start:", bg='#f0f0f0', font=('Arial', 10)).grid(row=0, column=0)
-        self.start_page_entry = tk.Entry(contents_left_frame, width=5)
+        self.start_page_entry = tk.Entry(contents_left_frame, width=10)
         self.start_page_entry.grid(row=0, column=1, padx=2)
 
         # Right side - End
@@ -136,6 +363,9 @@ class BookSummaryApp:
         self.end_page_entry = tk.Entry(contents_right_frame, width=5)
         self.end_page_entry.grid(row=0, column=1, padx=2)
 
+        tk.Label(contents_pages_frame, text=SELECTION_HINT, bg='#f0f0f0', fg='#666666', font=('Arial', 8)).grid(
+            row=1, column=0, columnspan=2, sticky="w")
+
         # Add minimal spacing
         tk.Frame(parent, height=10, bg='#f0f0f0').grid(row=4, column=0)  # Reduced spacing
 
@@ -144,7 +374,7 @@ class BookSummaryApp:
         endnotes_frame.grid(row=5, column=0, sticky="ew", padx=5)
         
         # Initialize special_chars as a StringVar with only special symbols
-        self.special_chars = tk.StringVar(value="* † ‡ § # ¶ ∥")  # Special symbols with spaces
+        self.special_chars = tk.StringVar(value=DEFAULT_SPECIAL_CHARS)  # Special symbols with spaces
         
         # Special characters input in a more compact layout
         chars_container = tk.Frame(endnotes_frame, bg='#f0f0f0')
@@ -195,6 +425,28 @@ class BookSummaryApp:
         endnotes_frame.grid_columnconfigure(0, weight=1)
         chars_container.grid_columnconfigure(1, weight=1)
         
+        # Marker rules saved per publisher
+        rules_frame = tk.LabelFrame(parent, text="Rules", bg='#f0f0f0', padx=5, pady=5)
+        rules_frame.grid(row=6, column=0, sticky="ew", padx=5, pady=(10, 0))
+        
+        tk.Label(rules_frame, text="Publisher:", bg='#f0f0f0', font=('Arial', 10)).grid(row=0, column=0, padx=2)
+        self.publisher_box = ttk.Combobox(rules_frame, width=15, values=list_publishers())
+        self.publisher_box.grid(row=0, column=1, padx=2)
+        
+        tk.Button(
+            rules_frame,
+            text="Load",
+            command=self.load_rules,
+            font=('Arial', 10)
+        ).grid(row=0, column=2, padx=2)
+        
+        tk.Button(
+            rules_frame,
+            text="Save",
+            command=self.save_rules,
+            font=('Arial', 10)
+        ).grid(row=0, column=3, padx=2)
+        
         # Headers parameter frame
         headers_frame = tk.LabelFrame(parent, text="Headers", bg='#f0f0f0', padx=10, pady=10)
         headers_frame.grid(row=7, column=0, sticky="ew", padx=20)
@@ -210,7 +462,7 @@ class BookSummaryApp:
         ).grid(row=0, column=0)
         
         self.max_header_length_entry = tk.Entry(max_header_container, width=5)
-        self.max_header_length_entry.insert(0, "50")  # Default value
+        self.max_header_length_entry.insert(0, str(DEFAULT_MAX_HEADER_LENGTH))  # Default value
         self.max_header_length_entry.grid(row=0, column=1, padx=5)
         
         # Button container for Mark and Remove Headers
@@ -265,9 +517,35 @@ class BookSummaryApp:
         )
         self.remove_page_n_button.grid(row=0, column=1, padx=5)
         
+        # Cleanup pipeline: pick the stages and run them in one pass
+        cleanup_frame = tk.LabelFrame(parent, text="Cleanup", bg='#f0f0f0', padx=10, pady=10)
+        cleanup_frame.grid(row=9, column=0, sticky="ew", padx=20, pady=(10, 0))
+        
+        self.stage_vars = {}
+        for i, stage in enumerate(STAGES):
+            self.stage_vars[stage] = tk.BooleanVar(value=True)
+            tk.Checkbutton(
+                cleanup_frame,
+                text=STAGE_LABELS[stage],
+                variable=self.stage_vars[stage],
+                bg='#f0f0f0',
+                font=('Arial', 10)
+            ).grid(row=i // 2, column=i % 2, sticky="w")
+        
+        # Clean all button
+        self.clean_all_button = tk.Button(
+            cleanup_frame,
+            text="Clean all",
+            command=self.clean_all,
+            font=('Arial', 11),
+            padx=10,
+            pady=5
+        )
+        self.clean_all_button.grid(row=3, column=0, columnspan=2, pady=(5, 0))
+        
         # Create a frame for the buttons at the bottom of left panel
         button_frame = tk.Frame(parent, bg='#f0f0f0')
-        button_frame.grid(row=9, column=0, sticky="ew", pady=20)
+        button_frame.grid(row=10, column=0, sticky="ew", pady=20)
         
         # Button container
         button_container = tk.Frame(button_frame, bg='#f0f0f0')
@@ -299,160 +577,443 @@ class BookSummaryApp:
             state='disabled'
         )
         self.refine_button.grid(row=0, column=1, padx=10)
+        
+        # Cancel button (enabled while an extraction is running)
+        self.cancel_button = tk.Button(
+            button_container,
+            text="Cancel",
+            command=self.cancel_extraction,
+            font=('Arial', 12),
+            padx=20,
+            pady=10,
+            state='disabled'
+        )
+        self.cancel_button.grid(row=0, column=2, padx=10)
+        
+        # Save As button, writes the cleaned pages to a text, Markdown or JSONL file
+        self.save_button = tk.Button(
+            button_container,
+            text="Save As",
+            command=self.save_as,
+            font=('Arial', 12),
+            padx=20,
+            pady=10
+        )
+        self.save_button.grid(row=1, column=0, pady=(10, 0))
+        
+        # Summarize button, picks the key sentences of each chapter of the cleaned pages
+        self.summarize_button = tk.Button(
+            button_container,
+            text="Summarize",
+            command=self.summarize,
+            font=('Arial', 12),
+            padx=20,
+            pady=10
+        )
+        self.summarize_button.grid(row=1, column=1, pady=(10, 0))
 
     def validate_page_range(self, total_pages):
+        """Selected main text page numbers, None after showing the error"""
         try:
-            start = int(self.start_page.get() or '1')
-            end = int(self.end_page.get() or str(total_pages))
-            
-            # Adjust for 1-based index
-            start = max(1, min(start, total_pages))
-            end = max(1, min(end, total_pages))
-            
-            if start >= end:
-                messagebox.showerror("Error", "Start page must be less than end page")
-                return None, None
-                
-            return start, end
-            
-        except ValueError:
-            messagebox.showerror("Error", "Please enter valid page numbers")
-            return None, None
+            return book_engine.resolve_page_selection(self.start_page.get(), self.end_page.get(), total_pages)
+        except book_engine.PageRangeError as e:
+            messagebox.showerror("Error", str(e))
+            return None
 
     def validate_contents_range(self, total_pages):
-        # If both fields are empty, return None
-        if not self.start_page_entry.get() and not self.end_page_entry.get():
-            return None, None
-            
-        # If only one field is filled, show error
-        if bool(self.start_page_entry.get()) != bool(self.end_page_entry.get()):
-            messagebox.showerror("Error", "Please fill both contents page fields or leave both empty")
-            return None, None
-            
+        """Selected contents page numbers as a tuple, empty when there are none or after showing the error"""
         try:
-            start = int(self.start_page_entry.get())
-            end = int(self.end_page_entry.get())
-            
-            # Adjust for 1-based index and validate range
-            if start < 1 or end > total_pages or start > end:
-                messagebox.showerror("Error", 
-                    f"Please enter valid contents page numbers between 1 and {total_pages}")
-                return None, None
-                
-            return start, end
-            
+            return tuple(book_engine.resolve_contents_pages(
+                self.start_page_entry.get(), self.end_page_entry.get(), total_pages))
+        except book_engine.PageRangeError as e:
+            messagebox.showerror("Error", str(e))
+            return ()
+
+    def get_worker_count(self):
+        """Number of extraction workers, falls back to serial extraction on bad input"""
+        try:
+            return max(1, int(self.workers_entry.get()))
         except ValueError:
-            messagebox.showerror("Error", "Please enter valid contents page numbers")
-            return None, None
+            return 1
+
+    def set_text(self, text):
+        """Replace the contents of the main text area and drop the document behind it"""
+        self.document = BookDocument()
+        self.history.clear(self.document)
+        self.viewer.set_document(self.document)
+        self.text_area.insert(tk.END, text)
+
+    def render_pages(self, page_numbers):
+        """Re-render the given pages, only the ones inside the viewer window touch the text area"""
+        with self.profiler.stage("render"):
+            self.viewer.render_pages(page_numbers)
+        self.update_search()
 
-    def process_pdf(self, file_path):
+    def insert_pages(self, pages):
+        """Add pages to the document in page order and let the viewer show them if they are in view"""
+        for page in pages:
+            self.document.insert_page(page)
+        self.viewer.pages_inserted([page.number for page in pages])
+        self.update_search()
+
+    def remove_pages(self, page_numbers):
+        """Remove whole pages from the document and the viewer"""
+        self.document.remove_pages(page_numbers)
+        self.viewer.reload()
+        self.update_search()
+
+    def toggle_markers(self, flag):
+        """Show or hide one kind of marker in the main text"""
+        self.viewer.set_marker_visible(flag, self.marker_vars[flag].get())
+
+    def jump_to_page(self):
+        """Scroll the main text to the page typed in the jump box"""
         try:
-            self.status_var.set("Processing PDF...")
-            self.root.update()
+            number = int(self.page_jump_entry.get())
+        except ValueError:
+            self.status_var.set("Please enter a page number")
+            return
+        if not self.document.pages:
+            return
+        self.status_var.set(f"Showing page {self.viewer.jump_to(number)}")
+
+    def update_search(self):
+        """List the hits of the search box from the document's search index"""
+        query = self.search_entry.get()
+        self.search_list.delete(0, tk.END)
+        self.search_hits = []
+        if not query.strip():
+            return
+        with self.profiler.stage("search"):
+            self.search_hits = self.document.search.search(query)
+            lines = {}
+            for number, line in self.search_hits:
+                if number not in lines:
+                    lines[number] = [text for text, _ in self.document.get_page(number).display_lines(markup=False)]
+                self.search_list.insert(tk.END, f"p. {number}: {lines[number][line].strip()[:80]}")
+
+    def show_search_hit(self):
+        """Scroll the main text to the hit selected in the search list"""
+        selection = self.search_list.curselection()
+        if not selection:
+            return
+        number, line = self.search_hits[selection[0]]
+        self.viewer.show_hit(number, line)
+        self.status_var.set(f"Hit {selection[0] + 1} of {len(self.search_hits)}, page {number}")
+
+    def process_pdf(self, file_path, incremental=False, page_numbers=None):
+        """Validate the page ranges and start extracting the PDF in the background
+
+        With incremental set and the same PDF loaded, pages outside the new
+        range are dropped, pages already extracted are kept with their
+        markers, and only the missing pages are extracted. page_numbers
+        replaces the Start-End range with the given 1-based pages.
+        """
+        try:
+            # Stop an extraction that is still running and drop its pending pages
+            if self.extraction_queue is not None:
+                self.cancel_event.set()
+                self.extraction_queue = None
+                self.cancel_button.config(state='disabled')
+            self.edition_report = None
             
-            # Clear text area
-            self.text_area.delete(1.0, tk.END)
+            self.status_var.set("Processing PDF...")
             
-            # Open PDF with PyMuPDF
-            doc = fitz.open(file_path)
-            total_pages = doc.page_count
+            incremental = incremental and file_path == self.loaded_file
+            if not incremental:
+                # Clear text area and the document behind it
+                self.set_text("")
+                self.loaded_file = None
             
-            if total_pages == 0:
-                raise Exception("No pages found in PDF")
+            # Validate the ranges against the PDF, kept open for the extraction
+            with self.profiler.stage("fitz.open"):
+                total_pages = self.workspace.documents.page_count(file_path)
             
             # Validate page ranges
-            contents_start, contents_end = self.validate_contents_range(total_pages)
-            start_page, end_page = self.validate_page_range(total_pages)
+            contents_range = self.validate_contents_range(total_pages)
+            if page_numbers is not None:
+                wanted = set(number for number in page_numbers if 1 <= number <= total_pages)
+            else:
+                wanted = self.validate_page_range(total_pages)
+                if wanted is None:
+                    return
+                wanted = set(wanted)
             
-            if start_page is None:
-                return
+            # Contents are re-analyzed only when their range changed
+            if not incremental or contents_range != self.loaded_contents_range:
+                extract_contents = True
+            else:
+                extract_contents = False
             
-            # Process contents pages if specified
-            if contents_start is not None and contents_end is not None:
-                for page_num in range(contents_start - 1, contents_end):
-                    try:
-                        page = doc[page_num]
-                        page_text = page.get_text(
-                            "text",
-                            flags=fitz.TEXT_DEHYPHENATE | fitz.TEXT_PRESERVE_WHITESPACE
-                        )
-                        
-                        if not page_text.strip():
-                            self.text_area.insert(tk.END, f"=== Page {page_num + 1} ===\n\n")
-                            continue
-                        
-                        lines = page_text.splitlines()
-                        processed_lines = []
-                        
-                        for line in lines:
-                            leading_space = len(line) - len(line.lstrip())
-                            indent = " " * leading_space
-                            line = line.strip()
-                            if not line:
-                                processed_lines.append("")
-                                continue
-                            processed_lines.append(f"{indent}{line}")
-                        
-                        self.text_area.insert(tk.END, f"=== Page {page_num + 1} ===\n\n")
-                        self.text_area.insert(tk.END, '\n'.join(processed_lines) + "\n")
-                        
-                    except Exception as e:
-                        self.text_area.insert(tk.END, f"=== Page {page_num + 1} ===\n\n[Error: {str(e)}]\n")
-                
-                # After processing contents pages, analyze them and update text area
-                current_text = self.text_area.get(1.0, tk.END)
-                analyzed_lines = self.analyze_contents(current_text)
-                if analyzed_lines is not None:
-                    # Clear both text areas
-                    self.text_area.delete(1.0, tk.END)
-                    self.contents_area.delete(1.0, tk.END)
-                    
-                    # Insert contents into contents area
-                    self.contents_area.insert(tk.END, '\n'.join(analyzed_lines))
-                    self.contents_area.insert(tk.END, "\n\n=== END OF CONTENTS ===\n\n")
+            if incremental:
+                self.remove_pages([page.number for page in self.document.pages if page.number not in wanted])
+            page_nums = [number - 1 for number in sorted(wanted) if number not in self.document.page_index]
+            
+            self.loaded_file = file_path
+            self.loaded_contents_range = contents_range
+            self.start_extraction(file_path, page_nums, contents_range if extract_contents else None)
             
-            # Process main text pages
-            for page_num in range(start_page - 1, end_page):
+        except Exception as e:
+            self.show_processing_error(e)
+
+    def show_processing_error(self, error):
+        """Show an extraction error in the status bar and the text area"""
+        error_msg = f"Error: {str(error)}\nTry a different PDF file or check if it's password protected."
+        self.status_var.set(error_msg)
+        self.set_text(error_msg)
+        self.loaded_file = None
+        print(f"Detailed error: {str(error)}")
+
+    def start_extraction(self, file_path, page_nums, contents_range):
+        """Start the background worker and begin draining its queue"""
+        self.extraction_queue = queue.Queue()
+        self.cancel_event = threading.Event()
+        self.extraction_file = file_path
+        self.extraction_total = len(page_nums)
+        self.extraction_reused = len(self.document.pages)
+        self.extraction_done = 0
+        self.extraction_started = time.perf_counter()
+        self.cancel_button.config(state='normal')
+        if self.page_cache is not None:
+            self.page_cache.reset_stats()
+        # Steps recorded against the pages before this extraction can't be replayed on the new ones
+        self.history.clear()
+        self.update_history_menu()
+        layout_rules = self.current_rules().compile() if self.layout_var.get() else None
+        
+        worker = threading.Thread(
+            target=self.run_extraction,
+            args=(file_path, page_nums, contents_range, self.get_worker_count(),
+                  self.page_cache, self.extraction_queue, self.cancel_event, layout_rules),
+            daemon=True
+        )
+        worker.start()
+        self.schedule_drain()
+
+    def schedule_drain(self):
+        """Drain the shown book's extraction queue after EXTRACTION_POLL_MS"""
+        self.drain_after = self.root.after(EXTRACTION_POLL_MS, self.drain_extraction_queue, self.extraction_queue)
+
+    def run_extraction(self, file_path, page_nums, contents_range, workers, cache, out_queue, cancel_event,
+                       layout_rules=None):
+        """Worker thread: extract pages and post them to out_queue, never touches Tk
+
+        contents_range holds the contents page numbers, None when the
+        contents shown are still current.
+        With layout_rules the pages come with their markers flagged from
+        the page layout. The PDF comes from the workspace's open documents
+        and the pages are extracted in its shared pool.
+        """
+        profiler = self.profiler
+        pool = self.workspace.pool.get(workers) if workers > 1 else None
+        try:
+            with profiler.thread_profile():
+                with profiler.stage("fitz.open"):
+                    doc = self.workspace.documents.acquire(file_path)
                 try:
-                    page = doc[page_num]
-                    page_text = page.get_text(
-                        "text",
-                        flags=fitz.TEXT_DEHYPHENATE | fitz.TEXT_PRESERVE_WHITESPACE
-                    )
+                    if contents_range is not None:
+                        if not contents_range:
+                            contents = book_engine.BookExtraction("")  # No contents pages entered
+                        else:
+                            # An embedded outline saves extracting and parsing the contents pages
+                            with profiler.stage("get_toc"):
+                                contents = book_engine.outline_contents(doc)
+                        if contents is None:
+                            with profiler.stage("contents get_text"):
+                                contents_text = book_engine.extract_contents_text(
+                                    doc, contents_range, workers, cache)
+                            with profiler.stage("analyze_contents"):
+                                contents = book_engine.analyze_contents_text(contents_text)
+                            if contents.contents_table:
+                                with profiler.stage("page_offset"):
+                                    contents.page_offset = book_engine.find_page_offset(
+                                        doc, contents_range[-1] + 1, cache=cache)
+                        out_queue.put(("contents", contents))
                     
-                    if not page_text.strip():
-                        # Add a header for the empty page
-                        self.text_area.insert(tk.END, f"=== Page {page_num + 1} ===\n\n")
-                        self.text_area.insert(tk.END, "\n")  # Add an empty line after the header
-                        continue  # Continue to the next page
-                    
-                    lines = page_text.splitlines()
-                    processed_lines = []
-                    
-                    for line in lines:
-                        leading_space = len(line) - len(line.lstrip())
-                        indent = " " * leading_space
-                        line = line.strip()  # This line trims leading and trailing whitespace
-                        if not line:
-                            processed_lines.append("")
-                            continue
-                        processed_lines.append(f"{indent}{line}")
-                    
-                    self.text_area.insert(tk.END, f"\n=== Page {page_num + 1} ===\n\n")
-                    self.text_area.insert(tk.END, '\n'.join(processed_lines) + "\n")
-                    
-                except Exception as e:
-                    self.text_area.insert(tk.END, f"\n=== Page {page_num + 1} ===\n\n[Error: {str(e)}]\n")
+                    pages = profiler.timed_iter(
+                        "get_text",
+                        book_engine.iter_page_texts(
+                            doc, page_nums, workers, cancel_event, cache, layout=layout_rules is not None,
+                            pool=pool),
+                        lambda result: result[0] + 1
+                    )
+                    for page_num, page_text, error in pages:
+                        with profiler.stage("build_page"):
+                            if layout_rules is not None:
+                                page = Page.from_layout(page_num, page_text, error, layout_rules)
+                            else:
+                                page = Page.from_extraction(page_num, page_text, error)
+                        profiler.count("pages")
+                        profiler.count("lines", len(page.lines))
+                        out_queue.put(("page", page))
+                finally:
+                    self.workspace.documents.release(doc)
             
-            self.status_var.set(f"Completed processing {file_path}")
-            doc.close()
+            out_queue.put(("cancelled",) if cancel_event.is_set() else ("done",))
             
+        except BrokenProcessPool as e:
+            # A worker died, later extractions start a new pool
+            self.workspace.pool.discard(pool)
+            out_queue.put(("error", e))
         except Exception as e:
-            error_msg = f"Error: {str(e)}\nTry a different PDF file or check if it's password protected."
-            self.status_var.set(error_msg)
-            self.text_area.delete(1.0, tk.END)
-            self.text_area.insert(tk.END, error_msg)
-            print(f"Detailed error: {str(e)}")
+            out_queue.put(("error", e))
+
+    def drain_extraction_queue(self, out_queue):
+        """Insert finished pages in batches and reschedule until the worker is done"""
+        # A newer extraction replaced this one
+        if out_queue is not self.extraction_queue:
+            return
+        
+        pages = []
+        finished = None
+        try:
+            while len(pages) < MAX_PAGES_PER_DRAIN:
+                message = out_queue.get_nowait()
+                if message[0] == "page":
+                    pages.append(message[1])
+                elif message[0] == "contents":
+                    self.show_contents(message[1])
+                else:
+                    finished = message
+                    break
+        except queue.Empty:
+            pass
+        
+        if pages:
+            with self.profiler.stage("insert"):
+                self.insert_pages(pages)
+            self.extraction_done += len(pages)
+        
+        if finished is None:
+            self.update_extraction_status()
+            self.schedule_drain()
+            return
+        
+        self.finish_extraction(finished)
+
+    def show_contents(self, contents):
+        """Show the analyzed contents, or the raw contents pages if analysis failed"""
+        self.document.set_contents(contents)
+        self.contents_table = contents.contents_table
+        self.selected_chapters = set()
+        self.chapter_lines = {}
+        if contents.contents_lines is not None:
+            self.contents_area.delete(1.0, tk.END)
+            self.contents_area.insert(tk.END, '\n'.join(contents.contents_lines))
+            self.contents_area.insert(tk.END, "\n\n=== END OF CONTENTS ===\n\n")
+            
+            # Text area line of every contents entry, entries come from the lines in order
+            entry = 0
+            for line_number, line in enumerate(self.document.contents_lines, 1):
+                if entry == len(self.contents_table):
+                    break
+                table_entry = self.contents_table[entry]
+                if line.text.strip() == f"{table_entry['text']} {table_entry['page']}":
+                    self.chapter_lines[line_number] = entry
+                    entry += 1
+        
+        self.page_offset_entry.delete(0, tk.END)
+        if contents.page_offset is not None:
+            self.page_offset_entry.insert(0, str(contents.page_offset))
+        
+        # Replace the raw contents pages shown in front of the first page
+        with self.profiler.stage("render"):
+            self.viewer.reload()
+
+    def toggle_chapter(self, event):
+        """Select or deselect the contents entry under the mouse"""
+        line_number = int(self.contents_area.index(f"@{event.x},{event.y}").split(".")[0])
+        entry = self.chapter_lines.get(line_number)
+        if entry is None:
+            return
+        if entry in self.selected_chapters:
+            self.selected_chapters.discard(entry)
+            self.contents_area.tag_remove("selected_chapter", f"{line_number}.0", f"{line_number + 1}.0")
+        else:
+            self.selected_chapters.add(entry)
+            self.contents_area.tag_add("selected_chapter", f"{line_number}.0", f"{line_number + 1}.0")
+        self.status_var.set(f"{len(self.selected_chapters)} chapters selected")
+
+    def extract_chapters(self):
+        """Extract and show only the pages of the selected chapters"""
+        if self.current_pdf is None or not self.contents_table:
+            self.status_var.set("Please load a PDF with a contents table first")
+            return
+        if not self.selected_chapters:
+            self.status_var.set("Please click the chapters to extract in the contents")
+            return
+        try:
+            page_offset = int(self.page_offset_entry.get())
+        except ValueError:
+            self.status_var.set("Please enter the page offset: PDF page minus printed page number")
+            return
+        
+        try:
+            total_pages = self.workspace.documents.page_count(self.current_pdf)
+        except Exception as e:
+            self.show_processing_error(e)
+            return
+        
+        ranges = book_engine.chapter_page_ranges(self.contents_table, page_offset, total_pages)
+        page_numbers = set()
+        for entry in self.selected_chapters:
+            if ranges[entry] is not None:
+                page_numbers.update(range(ranges[entry][0], ranges[entry][1] + 1))
+        if not page_numbers:
+            self.status_var.set("The selected chapters are outside the PDF, check the page offset")
+            return
+        self.process_pdf(self.current_pdf, incremental=True, page_numbers=page_numbers)
+
+    def cache_status(self):
+        """Cache hit/miss counts for the status bar, empty without a cache"""
+        return f", {self.page_cache.stats()}" if self.page_cache is not None else ""
+
+    def update_extraction_status(self):
+        """Show progress, throughput and ETA in the status bar"""
+        elapsed = time.perf_counter() - self.extraction_started
+        rate = self.extraction_done / elapsed if elapsed > 0 else 0.0
+        if self.cancel_event.is_set():
+            self.status_var.set(f"Cancelling... {self.extraction_done}/{self.extraction_total} pages")
+        elif rate > 0:
+            eta = (self.extraction_total - self.extraction_done) / rate
+            self.status_var.set(
+                f"Extracting {self.extraction_done}/{self.extraction_total} pages "
+                f"({rate:.1f} pages/sec, ETA {eta:.0f}s{self.cache_status()})"
+            )
+        else:
+            self.status_var.set(f"Extracting 0/{self.extraction_total} pages")
+
+    def finish_extraction(self, message):
+        """Report how the extraction ended and reset the background state"""
+        self.extraction_queue = None
+        self.cancel_button.config(state='disabled')
+        elapsed = time.perf_counter() - self.extraction_started
+        edition_report, self.edition_report = self.edition_report, None
+        
+        if message[0] == "done" and edition_report is not None:
+            self.status_var.set(
+                f"{edition_report}, extracted {self.extraction_done} pages ({elapsed:.1f}s{self.cache_status()})")
+        elif message[0] == "done" and self.extraction_reused:
+            self.status_var.set(
+                f"Refined {self.extraction_file}: kept {self.extraction_reused} pages, "
+                f"extracted {self.extraction_done} ({elapsed:.1f}s{self.cache_status()})")
+        elif message[0] == "done":
+            self.status_var.set(
+                f"Completed processing {self.extraction_file} ({elapsed:.1f}s{self.cache_status()})")
+        elif message[0] == "cancelled":
+            self.status_var.set(
+                f"Cancelled after {self.extraction_done} of {self.extraction_total} pages")
+        else:
+            self.show_processing_error(message[1])
+            return
+        self.show_profile()
+
+    def cancel_extraction(self):
+        """Ask the running extraction to stop, the worker reports back through the queue"""
+        if self.extraction_queue is None:
+            return
+        self.cancel_event.set()
+        self.update_extraction_status()
 
     def upload_pdf(self):
         file_path = filedialog.askopenfilename(
@@ -462,6 +1023,14 @@ class BookSummaryApp:
         
         if not file_path:
             return
+        
+        # A book already open is extracted again in its own tab, others get a new tab unless this one is empty
+        tab = self.workspace.find(file_path)
+        if tab is None:
+            tab = self.workspace.active if self.current_pdf is None else self.add_tab(BookTab())
+            tab.file_path = file_path
+            self.book_tabs.tab(self.tab_frames[tab], text=tab.title())
+        self.show_tab(tab)
             
         # Store the file path for refining
         self.current_pdf = file_path
@@ -472,236 +1041,255 @@ class BookSummaryApp:
         # Enable the refine button
         self.refine_button.config(state='normal')
 
+    def open_new_edition(self):
+        """Replace the book shown with a new edition of it
+
+        Pages whose fingerprint matches a page of the old edition keep its
+        text and markers, only the changed pages are extracted, and the
+        status bar names them when the extraction is done.
+        """
+        if not self.document.pages or self.loaded_file is None:
+            self.status_var.set("No edition to compare with, upload a PDF first")
+            return
+        if self.extraction_queue is not None:
+            self.status_var.set("Wait for the extraction to finish or cancel it first")
+            return
+        file_path = filedialog.askopenfilename(
+            title="Select the new edition",
+            filetypes=[("PDF files", "*.pdf")]
+        )
+        if not file_path:
+            return
+        tab = self.workspace.find(file_path)
+        if tab is not None and tab is not self.workspace.active:
+            self.status_var.set(f"{file_path} is already open in another tab")
+            return
+        
+        try:
+            self.status_var.set("Comparing editions...")
+            with self.workspace.documents.document(file_path) as doc:
+                wanted = self.validate_page_range(doc.page_count)
+                if wanted is None:
+                    return
+                new_fingerprints = book_engine.page_fingerprints(doc, [number - 1 for number in wanted])
+            old_fingerprints = self.edition_fingerprints(
+                self.loaded_file, [page.number - 1 for page in self.document.pages], file_path)
+        except Exception as e:
+            self.status_var.set(f"Error comparing editions: {str(e)}")
+            print(f"Error comparing editions: {str(e)}")
+            return
+        changes = book_engine.compare_editions(
+            {page_num + 1: fingerprint for page_num, fingerprint in old_fingerprints.items()},
+            {page_num + 1: fingerprint for page_num, fingerprint in new_fingerprints.items()})
+        
+        # Unchanged pages move to their new numbers with their lines and markers
+        pages = []
+        for number, old_number in changes.matched.items():
+            old_page = self.document.get_page(old_number)
+            pages.append(Page(number, [Line(line.text, line.flags) for line in old_page.lines], old_page.leading))
+        self.set_text("")
+        self.insert_pages(pages)
+        
+        tab = self.workspace.active
+        tab.file_path = file_path
+        self.book_tabs.tab(self.tab_frames[tab], text=tab.title())
+        self.current_pdf = file_path
+        self.loaded_file = file_path
+        self.loaded_contents_range = None  # The contents pages are analyzed again
+        self.process_pdf(file_path, incremental=True)
+        if self.extraction_queue is not None:
+            self.edition_report = f"New edition {file_path}: {changes.describe()}"
+
+    def edition_fingerprints(self, file_path, page_nums, new_file_path):
+        """Fingerprints of the 0-based pages of the edition loaded from file_path
+
+        They come from the page cache, which keeps them from when the
+        pages were extracted even if the file was overwritten since.
+        Pages it lacks are fingerprinted from the file, unless the new
+        edition was saved over it.
+        """
+        fingerprints = {}
+        if self.page_cache is not None:
+            fingerprints = self.page_cache.stored_fingerprints(file_path)
+        missing = [page_num for page_num in page_nums if page_num not in fingerprints]
+        if missing and os.path.abspath(file_path) != os.path.abspath(new_file_path) and os.path.exists(file_path):
+            with self.workspace.documents.document(file_path) as doc:
+                fingerprints.update(book_engine.page_fingerprints(doc, missing))
+        return {page_num: fingerprints[page_num] for page_num in page_nums if page_num in fingerprints}
+
+    def add_tab(self, tab):
+        """Add a tab for the book and show it"""
+        self.workspace.add(tab)
+        frame = ttk.Frame(self.book_tabs, height=0)
+        self.tab_frames[tab] = frame
+        self.book_tabs.add(frame, text=tab.title())
+        self.show_tab(tab)
+        return tab
+
+    def select_tab(self):
+        """Follow a click on a book tab"""
+        selected = self.book_tabs.select()
+        for tab, frame in self.tab_frames.items():
+            if str(frame) == str(selected):
+                self.show_tab(tab)
+                return
+
+    def show_tab(self, tab):
+        """Show another open book, its pages, contents, entries and extraction pick up where they were left"""
+        workspace = self.workspace
+        if tab is workspace.active:
+            return
+        if workspace.active is not None:
+            self.save_tab_state(workspace.active)
+        workspace.activate(tab)
+        self.book_tabs.select(self.tab_frames[tab])
+        self.load_tab_state(tab)
+        
+        for background in workspace.tabs_to_unload():
+            # Dropped pages are extracted again, mostly from the page cache, when the tab is shown
+            background.unloaded_pages = [page.number for page in background.state["document"].pages]
+            background.state = self.new_tab_state(background)
+        if tab.unloaded_pages is not None:
+            page_numbers, tab.unloaded_pages = tab.unloaded_pages, None
+            self.process_pdf(self.current_pdf, page_numbers=page_numbers)
+
+    def new_tab_state(self, tab):
+        """State of a book with nothing extracted yet, keeping the entries of the tab"""
+        document = BookDocument()
+        state = {name: None for name in TAB_ATTRIBUTES}
+        state.update(
+            current_pdf=tab.file_path,
+            document=document,
+            history=DocumentHistory(document),
+            contents_table=[],
+            selected_chapters=set(),
+            chapter_lines={},
+            search_hits=[],
+            entries=tab.state.get("entries", {}),
+            contents_text="",
+            top_page=None,
+        )
+        return state
+
+    def save_tab_state(self, tab):
+        if self.drain_after is not None:
+            self.root.after_cancel(self.drain_after)
+            self.drain_after = None
+        tab.state = {name: getattr(self, name) for name in TAB_ATTRIBUTES}
+        tab.state["entries"] = {name: getattr(self, name).get() for name in TAB_ENTRIES}
+        tab.state["contents_text"] = self.contents_area.get("1.0", "end-1c")
+        tab.state["top_page"] = self.viewer.top_page()
+
+    def load_tab_state(self, tab):
+        state = tab.state or self.new_tab_state(tab)
+        for name in TAB_ATTRIBUTES:
+            setattr(self, name, state[name])
+        for name in TAB_ENTRIES:
+            getattr(self, name).delete(0, tk.END)
+            getattr(self, name).insert(0, state["entries"].get(name, ""))
+        
+        self.contents_area.delete(1.0, tk.END)
+        self.contents_area.insert(tk.END, state["contents_text"])
+        for line_number, entry in self.chapter_lines.items():
+            if entry in self.selected_chapters:
+                self.contents_area.tag_add("selected_chapter", f"{line_number}.0", f"{line_number + 1}.0")
+        
+        self.viewer.set_document(self.document)
+        if state["top_page"] is not None:
+            self.viewer.jump_to(state["top_page"])
+        else:
+            self.viewer.reload()
+        self.update_search()
+        self.update_history_menu()
+        self.refine_button.config(state='normal' if self.current_pdf is not None else 'disabled')
+        if self.extraction_queue is not None:
+            self.cancel_button.config(state='normal')
+            self.update_extraction_status()
+            self.schedule_drain()
+        else:
+            self.cancel_button.config(state='disabled')
+            self.status_var.set(f"Showing {tab.title()}, {len(self.document.pages)} pages")
+
+    def close_book(self):
+        """Close the book shown, its extraction is cancelled and the last book left turns into an empty tab"""
+        tab = self.workspace.active
+        if self.extraction_queue is not None:
+            self.cancel_event.set()
+            self.extraction_queue = None
+        if len(self.workspace.tabs) == 1:
+            tab.file_path = None
+            tab.state = self.new_tab_state(tab)
+            self.workspace.active = None
+            self.book_tabs.tab(self.tab_frames[tab], text=tab.title())
+            self.show_tab(tab)
+            return
+        position = self.workspace.tabs.index(tab)
+        self.workspace.remove(tab)
+        self.workspace.active = None
+        frame = self.tab_frames.pop(tab)
+        self.show_tab(self.workspace.tabs[min(position, len(self.workspace.tabs) - 1)])
+        self.book_tabs.forget(frame)
+        frame.destroy()
+
+    def close_app(self):
+        if self.extraction_queue is not None:
+            self.cancel_event.set()
+        for tab in self.workspace.tabs:
+            if tab.state.get("cancel_event") is not None:
+                tab.state["cancel_event"].set()
+        self.workspace.close()
+        self.root.destroy()
+
     def refine_pdf(self):
-        if hasattr(self, 'current_pdf'):
-            self.process_pdf(self.current_pdf)
+        if self.current_pdf is not None:
+            self.process_pdf(self.current_pdf, incremental=True)
         else:
             self.status_var.set("No PDF loaded to refine")
 
     def mark_endnotes(self):
-        """Process the current text and mark endnotes"""
-        # Get current text
-        current_text = self.text_area.get(1.0, tk.END)
-        if not current_text.strip():
-            return
-            
-        # Split into lines
-        lines = current_text.splitlines()
-        processed_lines = []
-        
-        # Track page sections
-        current_page_lines = []
-        in_page = False
-        
-        # Process line by line
-        for line in lines:
-            # Check for page markers
-            if line.startswith("=== Page"):
-                # Process previous page if exists
-                if current_page_lines:
-                    processed_lines.extend(self.process_page_endnotes(current_page_lines))
-                    current_page_lines = []
-                processed_lines.append(line)
-                in_page = True
-                continue
-            
-            # Collect lines for current page
-            if in_page:
-                current_page_lines.append(line)
-            else:
-                processed_lines.append(line)
-        
-        # Process last page
-        if current_page_lines:
-            processed_lines.extend(self.process_page_endnotes(current_page_lines))
-        
-        # Update text area
-        self.text_area.delete(1.0, tk.END)
-        self.text_area.insert(tk.END, '\n'.join(processed_lines))
-
-    def process_page_endnotes(self, page_lines):
-        """Process a single page's lines for endnotes"""
-        processed_lines = []
-        # Get special characters from input, split by spaces
-        special_chars = [char.strip() for char in self.special_chars.get().split()]
-        
-        # Find middle of page
-        mid_point = len(page_lines) // 2
-        in_endnote = False
-        endnote_buffer = []
-        
-        # Process each line
-        for i, line in enumerate(page_lines):
-            # Skip empty lines
-            if not line.strip():
-                # If we were in an endnote, add the collected endnote
-                if in_endnote and endnote_buffer:
-                    processed_lines.append(f"<E>{''.join(endnote_buffer)}</E>")
-                    endnote_buffer = []
-                    in_endnote = False
-                processed_lines.append(line)
-                continue
+        """Mark endnotes in the document and re-render the pages that changed"""
+        try:
+            if not self.document.pages:
+                return
             
-            # Check for endnotes in second half of page
-            if i >= mid_point:
-                # Check if line starts with special character
-                stripped_line = line.lstrip()
-                if any(stripped_line.startswith(char) for char in special_chars):
-                    # If we were already in an endnote, add the previous one
-                    if in_endnote and endnote_buffer:
-                        processed_lines.append(f"<E>{''.join(endnote_buffer)}</E>")
-                    # Start new endnote
-                    in_endnote = True
-                    endnote_buffer = [line]
-                    continue
-                elif in_endnote:
-                    endnote_buffer.append(f" {line.lstrip()}")
-                    continue
+            rules = self.current_rules()
+            with self.profiler.stage("mark_endnotes"):
+                changed = self.apply_operation("Mark Endnotes", lambda: self.document.mark_endnotes(rules))
+            self.render_pages(changed)
+            self.status_var.set("Endnotes marked")
+            self.show_profile()
             
-            # Regular line processing
-            if not in_endnote:
-                processed_lines.append(line)
-        
-        # Handle any remaining endnote at end of page
-        if in_endnote and endnote_buffer:
-            processed_lines.append(f"<E>{''.join(endnote_buffer)}</E>")
-        
-        return processed_lines
+        except Exception as e:
+            self.status_var.set(f"Error marking endnotes: {str(e)}")
+            print(f"Error marking endnotes: {str(e)}")
 
     def remove_endnotes(self):
         """Remove all endnote-marked text from the text area"""
         try:
-            # Get current text
-            current_text = self.text_area.get(1.0, tk.END)
-            if not current_text.strip():
+            if not self.document.pages:
                 return
-            
-            # Split into lines
-            lines = current_text.splitlines()
-            processed_lines = []
-            
-            # Skip endnote lines and preserve other text
-            i = 0
-            while i < len(lines):
-                line = lines[i]
-                if "<E>" in line:
-                    # Skip until we find the end of the endnote
-                    while i < len(lines) and "</E>" not in lines[i]:
-                        i += 1
-                    i += 1  # Skip the line with </E>
-                else:
-                    processed_lines.append(line)
-                    i += 1
-            
-            # Update text area
-            self.text_area.delete(1.0, tk.END)
-            self.text_area.insert(tk.END, '\n'.join(processed_lines))
-            
+            with self.profiler.stage("remove_endnotes"):
+                changed = self.apply_operation("Remove Endnotes", self.document.remove_endnotes)
+            self.render_pages(changed)
             self.status_var.set("Endnotes removed")
+            self.show_profile()
             
         except Exception as e:
             self.status_var.set(f"Error removing endnotes: {str(e)}")
             print(f"Error removing endnotes: {str(e)}")
 
-    def process_page_headers(self, page_lines, previous_page_empty, max_header_length):
-        """Process a single page's lines for headers"""
-        processed_lines = []
-        found_first_content = False
-        
-        for i, line in enumerate(page_lines):
-            stripped_line = line.strip()
-            
-            # Preserve empty lines in the output
-            processed_lines.append(line)  # Add the line regardless of whether it's empty or not
-            
-            if not stripped_line:
-                continue  # Skip further processing for empty lines
-            
-            # Check for potential header in first non-empty line
-            if not found_first_content:
-                found_first_content = True
-                
-                # Conditions for header:
-                # 1. Not the first page (previous page has content)
-                # 2. Line is shorter than user-defined max header length
-                # 3. Not already marked as endnote
-                # 4. Not just a page number
-                if (not previous_page_empty and
-                    len(stripped_line) < max_header_length and  # Use user-defined value
-                    not stripped_line.startswith("<E>") and
-                    not stripped_line.replace(" ", "").isnumeric()  # Skip standalone numbers
-                    ):
-                    
-                    # Preserve original indentation
-                    leading_space = len(line) - len(line.lstrip())
-                    indent = " " * leading_space
-                    processed_lines[-1] = f"{indent}<H>{stripped_line}</H>"  # Replace the last entry with the header
-        
-        return processed_lines
-
     def mark_headers(self):
-        """Process the current text and mark headers"""
+        """Mark headers in the document and re-render the pages that changed"""
         try:
-            # Get current text
-            current_text = self.text_area.get(1.0, tk.END)
-            if not current_text.strip():
+            if not self.document.pages:
                 return
             
-            # Get user-defined max header length
-            max_header_length = int(self.max_header_length_entry.get())
-            
-            # Split into lines
-            lines = current_text.splitlines()
-            processed_lines = []
-            
-            # Track pages and their content
-            current_page_lines = []
-            previous_page_empty = True
-            in_page = False
-            
-            # Second pass: process headers
-            for line in lines:
-                # Check for page markers
-                if line.startswith("=== Page"):
-                    # Process previous page if exists
-                    if current_page_lines:
-                        processed_lines.extend(
-                            self.process_page_headers(
-                                current_page_lines,
-                                previous_page_empty,
-                                max_header_length
-                            )
-                        )
-                        # Update previous_page_empty based on current_page_lines
-                        non_empty_count = len([l for l in current_page_lines if l.strip()])
-                        previous_page_empty = non_empty_count <= 2  # Set to False if more than 2 non-empty lines
-                        current_page_lines = []
-                    
-                    processed_lines.append(line)
-                    in_page = True
-                    continue
-                
-                # Collect lines for current page
-                if in_page:
-                    current_page_lines.append(line)
-                else:
-                    processed_lines.append(line)
-            
-            # Process last page
-            if current_page_lines:
-                processed_lines.extend(
-                    self.process_page_headers(
-                        current_page_lines,
-                        previous_page_empty,
-                        max_header_length
-                    )
-                )
-            
-            # Update text area
-            self.text_area.delete(1.0, tk.END)
-            self.text_area.insert(tk.END, '\n'.join(processed_lines))
-            
+            rules = self.current_rules()
+            with self.profiler.stage("mark_headers"):
+                changed = self.apply_operation("Mark Headers", lambda: self.document.mark_headers(rules))
+            self.render_pages(changed)
             self.status_var.set("Headers marked")
+            self.show_profile()
             
         except Exception as e:
             self.status_var.set(f"Error marking headers: {str(e)}")
@@ -710,170 +1298,286 @@ class BookSummaryApp:
     def remove_headers(self):
         """Remove all header-marked text from the text area"""
         try:
-            # Get current text
-            current_text = self.text_area.get(1.0, tk.END)
-            if not current_text.strip():
+            if not self.document.pages:
                 return
-            
-            # Split into lines
-            lines = current_text.splitlines()
-            processed_lines = []
-            
-            # Remove lines that contain <H> tags
-            for line in lines:
-                if "<H>" not in line:  # Check if the line does not contain a header tag
-                    processed_lines.append(line)
-            
-            # Update text area with lines that are not headers
-            self.text_area.delete(1.0, tk.END)
-            self.text_area.insert(tk.END, '\n'.join(processed_lines))
-            
+            with self.profiler.stage("remove_headers"):
+                changed = self.apply_operation("Remove Headers", self.document.remove_headers)
+            self.render_pages(changed)
             self.status_var.set("Headers removed")
+            self.show_profile()
             
         except Exception as e:
             self.status_var.set(f"Error removing headers: {str(e)}")
             print(f"Error removing headers: {str(e)}")
 
     def mark_page_numbers(self):
-        """Identify lines with only digits or special characters and mark them as <N>"""
+        """Identify lines with only digits or special characters and mark them as page numbers"""
         try:
-            # Get current text
-            current_text = self.text_area.get(1.0, tk.END)
-            if not current_text.strip():
+            if not self.document.pages:
                 return
-            
-            # Split into lines
-            lines = current_text.splitlines()
-            processed_lines = []
-            
-            for line in lines:
-                stripped_line = line.strip()
-                # Check if the line contains only digits or special characters
-                if re.fullmatch(r'[\d\W]+', stripped_line):  # Matches digits and non-word characters
-                    processed_lines.append(f"<N>{stripped_line}</N>")  # Mark as page number
-                else:
-                    processed_lines.append(line)  # Keep the line as is
-            
-            # Update text area with marked page numbers
-            self.text_area.delete(1.0, tk.END)
-            self.text_area.insert(tk.END, '\n'.join(processed_lines))
-            
+            rules = self.current_rules()
+            with self.profiler.stage("mark_page_numbers"):
+                changed = self.apply_operation("Mark Page N", lambda: self.document.mark_page_numbers(rules))
+            self.render_pages(changed)
             self.status_var.set("Page numbers marked")
+            self.show_profile()
             
         except Exception as e:
             self.status_var.set(f"Error marking page numbers: {str(e)}")
             print(f"Error marking page numbers: {str(e)}")
 
     def remove_page_numbers(self):
-        """Remove lines marked as <N> from the text area"""
+        """Remove lines marked as page numbers from the text area"""
         try:
-            # Get current text
-            current_text = self.text_area.get(1.0, tk.END)
-            if not current_text.strip():
+            if not self.document.pages:
                 return
-            
-            # Split into lines
-            lines = current_text.splitlines()
-            processed_lines = []
-            
-            for line in lines:
-                # Check if the line contains <N>
-                if "<N>" not in line:
-                    processed_lines.append(line)  # Keep the line as is
-            
-            # Update text area without the marked page numbers
-            self.text_area.delete(1.0, tk.END)
-            self.text_area.insert(tk.END, '\n'.join(processed_lines))
-            
+            with self.profiler.stage("remove_page_numbers"):
+                changed = self.apply_operation("Remove Page N", self.document.remove_page_numbers)
+            self.render_pages(changed)
             self.status_var.set("Page numbers removed")
+            self.show_profile()
             
         except Exception as e:
             self.status_var.set(f"Error removing page numbers: {str(e)}")
             print(f"Error removing page numbers: {str(e)}")
 
-    def analyze_contents(self, text_content):
-        """Analyze the text content for table of contents"""
+    def apply_operation(self, label, operation):
+        """Run a document operation with an undo step, returns the numbers of the changed pages"""
+        changed = self.history.record(label, operation)
+        self.update_history_menu()
+        return changed
+
+    def undo(self):
+        """Undo the last mark or remove operation"""
+        result = self.history.undo()
+        if result is None:
+            self.status_var.set("Nothing to undo")
+            return
+        label, changed = result
+        self.render_pages(changed)
+        self.update_history_menu()
+        self.status_var.set(f"Undid {label}")
+
+    def redo(self):
+        """Redo the last undone operation"""
+        result = self.history.redo()
+        if result is None:
+            self.status_var.set("Nothing to redo")
+            return
+        label, changed = result
+        self.render_pages(changed)
+        self.update_history_menu()
+        self.status_var.set(f"Redid {label}")
+
+    def update_history_menu(self):
+        """Name the next undo and redo steps in the Edit menu, disabled when there are none"""
+        undo_label, redo_label = self.history.labels()
+        self.edit_menu.entryconfigure(
+            0, label=f"Undo {undo_label}" if undo_label else "Undo", state='normal' if undo_label else 'disabled')
+        self.edit_menu.entryconfigure(
+            1, label=f"Redo {redo_label}" if redo_label else "Redo", state='normal' if redo_label else 'disabled')
+
+    def save_as(self):
+        """Write the document as it is now to a file, one page at a time"""
+        if not self.document.pages:
+            self.status_var.set("Nothing to save, upload a PDF first")
+            return
+        
+        file_path = filedialog.asksaveasfilename(
+            title="Save cleaned text",
+            defaultextension=".txt",
+            filetypes=[("Text", "*.txt"), ("Markdown", "*.md"), ("JSON Lines", "*.jsonl")]
+        )
+        if not file_path:
+            return
+        
         try:
-            # Clear previous contents table
-            self.contents_table = []
+            count = export_document(self.document, file_path)
+            self.status_var.set(f"Saved {count} pages to {file_path}")
             
-            # Split into lines
-            lines = text_content.splitlines()
-            tagged_line_counter = 0
-            processed_lines = []
+        except Exception as e:
+            self.status_var.set(f"Error saving text: {str(e)}")
+            print(f"Error saving text: {str(e)}")
+
+    def save_search_index(self):
+        """Save the search index next to the extraction cache, or wherever the user picks without one"""
+        if not self.document.pages or self.loaded_file is None:
+            self.status_var.set("Nothing to index, upload a PDF first")
+            return
+        try:
+            if self.page_cache is not None:
+                file_path = self.page_cache.search_index_path(self.page_cache.file_hash(self.loaded_file))
+            else:
+                file_path = filedialog.asksaveasfilename(
+                    title="Save search index",
+                    defaultextension=".json",
+                    filetypes=[("JSON", "*.json")]
+                )
+                if not file_path:
+                    return
+            self.document.search.save(file_path)
+            self.status_var.set(f"Saved search index to {file_path}")
             
-            # Process all lines
-            for i in range(len(lines)):
-                line = lines[i]
-                
-                # Skip page marker lines and empty lines
-                if line.startswith("=== Page") or not line.strip():
-                    continue
-                
-                # Check if line ends with a number
-                if re.search(r'\d+$', line.strip()):
-                    merged_line = line
-                    
-                    # If we've already tagged some lines, try to merge with previous untagged lines
-                    if tagged_line_counter > 0:
-                        # Start from the most recent line and work backwards
-                        j = len(processed_lines) - 1
-                        merge_content = []
-                        
-                        # Keep going backwards until we hit a tagged line or the start
-                        while j >= 0:
-                            prev_line = processed_lines[j]
-                            # Stop if we hit a tagged line
-                            if "<C>" in prev_line:
-                                break
-                            merge_content.insert(0, prev_line)
-                            j -= 1
-                        
-                        # Remove the merged lines from processed_lines
-                        processed_lines = processed_lines[:j + 1]
-                        
-                        # If we found lines to merge, combine them with the current line
-                        if merge_content:
-                            merged_line = " ".join(merge_content + [line.strip()])
-                    
-                    # Tag the line (whether merged or not) and increment counter
-                    processed_lines.append(f"<C>{merged_line.strip()}")
-                    tagged_line_counter += 1
-                else:
-                    # If not a numbered line, add as-is
-                    processed_lines.append(line)
+        except Exception as e:
+            self.status_var.set(f"Error saving search index: {str(e)}")
+            print(f"Error saving search index: {str(e)}")
+
+    def summarize(self):
+        """Summarize each chapter of the cleaned pages in the background"""
+        if not self.document.pages:
+            self.status_var.set("Nothing to summarize, upload a PDF first")
+            return
+        if self.summary_queue is not None:
+            return
+        try:
+            page_offset = int(self.page_offset_entry.get())
+        except ValueError:
+            page_offset = None  # The whole book is summarized as one chapter
+        
+        chapters = book_chapters(self.document.pages, self.contents_table, page_offset, self.document.pages[-1].number)
+        self.summary_queue = queue.Queue()
+        self.summarize_button.config(state='disabled')
+        self.status_var.set(f"Summarizing {len(chapters)} chapters...")
+        worker = threading.Thread(
+            target=self.run_summaries,
+            args=(chapters, self.get_worker_count(), self.summary_cache, self.summary_queue),
+            daemon=True
+        )
+        worker.start()
+        self.root.after(EXTRACTION_POLL_MS, self.check_summaries, self.summary_queue)
+
+    def run_summaries(self, chapters, workers, cache, out_queue):
+        """Worker thread: summarize the chapters and post the result, never touches Tk"""
+        try:
+            started = time.perf_counter()
+            pool = self.workspace.pool.get(workers) if workers > 1 else None
+            with self.profiler.stage("summarize"):
+                summaries, computed = summarize_chapters(chapters, workers=workers, cache=cache, pool=pool)
+            out_queue.put(("done", chapters, summaries, computed, time.perf_counter() - started))
+        except Exception as e:
+            out_queue.put(("error", e))
+
+    def check_summaries(self, out_queue):
+        """Show the summaries once the worker is done"""
+        try:
+            message = out_queue.get_nowait()
+        except queue.Empty:
+            self.root.after(EXTRACTION_POLL_MS, self.check_summaries, out_queue)
+            return
+        self.summary_queue = None
+        self.summarize_button.config(state='normal')
+        if message[0] == "error":
+            self.status_var.set(f"Error summarizing: {str(message[1])}")
+            print(f"Error summarizing: {str(message[1])}")
+            return
+        
+        _, chapters, summaries, computed, elapsed = message
+        window = tk.Toplevel(self.root)
+        window.title("Summary")
+        summary_area = scrolledtext.ScrolledText(window, wrap=tk.WORD, font=('Arial', 12))
+        summary_area.pack(fill=tk.BOTH, expand=True)
+        summary_area.insert(tk.END, format_summaries(chapters, summaries))
+        self.status_var.set(
+            f"Summarized {len(chapters)} chapters, {computed} recomputed, "
+            f"{len(chapters) - computed} from the cache ({elapsed:.1f}s)")
+        self.show_profile()
+
+    def show_profile(self):
+        """Add the costliest stages and the counters to the status bar while profiling"""
+        if not self.profiler.enabled:
+            return
+        self.profiler.set_counter("markers", sum(len(spans) for spans in self.document.markers.spans.values()))
+        self.status_var.set(f"{self.status_var.get()} | {self.profiler.summary()}")
+
+    def toggle_profiling(self):
+        """Follow the Tools menu switches"""
+        self.profiler.set_enabled(self.profile_var.get(), self.cprofile_var.get())
+        self.status_var.set("Profiling on" if self.profiler.enabled else "Profiling off")
+
+    def save_timing_report(self):
+        file_path = filedialog.asksaveasfilename(
+            title="Save timing report",
+            defaultextension=".txt",
+            filetypes=[("Text", "*.txt")]
+        )
+        if not file_path:
+            return
+        try:
+            self.profiler.dump_report(file_path)
+            self.status_var.set(f"Saved timing report to {file_path}")
             
-            # Clean up consecutive dots/spaces before numbers in processed lines
-            cleaned_lines = []
-            for line in processed_lines:
-                if "<C>" in line:
-                    # Extract the number at the end and remove <C> tags for processing
-                    line_without_tags = line.replace("<C>", "").replace("</C>", "")
-                    match = re.search(r'(.*?)[.…\s]+(\d+)\s*$', line_without_tags)
-                    if match:
-                        text_part = match.group(1).strip()
-                        number_part = match.group(2)
-                        cleaned_line = f"<C>{text_part} {number_part}"
-                        cleaned_lines.append(cleaned_line)
-                        
-                        # Add to contents table
-                        self.contents_table.append({
-                            'text': text_part,
-                            'page': int(number_part)
-                        })
-                    else:
-                        cleaned_lines.append(line)
-                else:
-                    cleaned_lines.append(line)
+        except Exception as e:
+            self.status_var.set(f"Error saving timing report: {str(e)}")
+            print(f"Error saving timing report: {str(e)}")
+
+    def save_profile_stats(self):
+        file_path = filedialog.asksaveasfilename(
+            title="Save cProfile stats",
+            defaultextension=".pstats",
+            filetypes=[("pstats", "*.pstats"), ("All files", "*")]
+        )
+        if not file_path:
+            return
+        try:
+            self.profiler.dump_stats(file_path)
+            self.status_var.set(f"Saved cProfile stats to {file_path}, open them with python -m pstats")
             
-            # Remove <C> tags from the beginning of lines
-            final_lines = [line.replace("<C>", "") if line.startswith("<C>") else line for line in cleaned_lines]
+        except Exception as e:
+            self.status_var.set(f"Error saving cProfile stats: {str(e)}")
+            print(f"Error saving cProfile stats: {str(e)}")
+
+    def current_rules(self):
+        """Marker rules from the parameter entries plus the extra patterns of the loaded publisher
+
+        Compiled rules are cached by value, so they are only rebuilt when an entry changed.
+        """
+        # Get user-defined max header length
+        max_header_length = int(self.max_header_length_entry.get())
+        return MarkerRules.from_entries(self.special_chars.get(), max_header_length, base=self.rules)
+
+    def load_rules(self):
+        """Load the rules saved for the selected publisher into the entries"""
+        try:
+            self.rules = load_publisher_rules(self.publisher_box.get())
+            self.special_chars.set(self.rules.special_chars())
+            self.max_header_length_entry.delete(0, tk.END)
+            self.max_header_length_entry.insert(0, str(self.rules.max_header_length))
+            self.status_var.set(f"Loaded rules for {self.publisher_box.get()}")
             
-            return final_lines
+        except Exception as e:
+            self.status_var.set(f"Error loading rules: {str(e)}")
+            print(f"Error loading rules: {str(e)}")
+
+    def save_rules(self):
+        """Save the current rules under the selected publisher"""
+        try:
+            rules = self.current_rules()
+            path = save_publisher_rules(self.publisher_box.get(), rules)
+            self.rules = rules
+            self.publisher_box.configure(values=list_publishers())
+            self.status_var.set(f"Saved rules to {path}")
             
         except Exception as e:
-            print(f"Error analyzing contents: {str(e)}")
-            return None
+            self.status_var.set(f"Error saving rules: {str(e)}")
+            print(f"Error saving rules: {str(e)}")
+
+    def clean_all(self):
+        """Run the selected cleanup stages over every page in one pass"""
+        try:
+            if not self.document.pages:
+                return
+            
+            stages = [stage for stage in STAGES if self.stage_vars[stage].get()]
+            pipeline = CleanupPipeline(stages, self.current_rules())
+            with self.profiler.stage("clean_all"):
+                changed = self.apply_operation("Clean All", lambda: pipeline.run(self.document))
+            self.render_pages(changed)
+            self.status_var.set(f"Cleaned {len(changed)} pages")
+            self.show_profile()
+            
+        except Exception as e:
+            self.status_var.set(f"Error cleaning text: {str(e)}")
+            print(f"Error cleaning text: {str(e)}")
 
 def main():
     root = tk.Tk()
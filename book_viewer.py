@@ -0,0 +1,229 @@
+"""Windowed view of a BookDocument: only the pages near the viewport live in the Tk text widget"""
+import bisect
+import tkinter as tk
+
+from book_document import ENDNOTE, HEADER, PAGE_NUMBER
+
+# Number of pages rendered into the text widget at a time
+WINDOW_PAGES = 24
+
+# Move the window when the view gets this close to either end of it
+EDGE_FRACTION = 0.15
+
+# Text tag and highlight color of each marker, markers are shown as tags instead of <E>, <H> and <N>
+MARKER_TAGS = {
+    ENDNOTE: ("endnote", "#dbe8ff"),
+    HEADER: ("header", "#dff5d8"),
+    PAGE_NUMBER: ("page_number", "#fff2c2"),
+}
+
+
+class PageViewer:
+    """Renders a sliding window of pages and drives a scrollbar that spans the whole book
+
+    The text widget only ever holds WINDOW_PAGES pages, so its memory use
+    and the cost of inserts, tags and deletes stay flat as books grow.
+    Scrolling near either end of the window re-centers it on the page at
+    the top of the view; the scrollbar maps positions to pages.
+    """
+
+    def __init__(self, text, scrollbar):
+        self.text = text
+        self.scrollbar = scrollbar
+        self.document = None
+        self.window = []  # Page numbers currently rendered, in order
+        self.view = (0.0, 1.0)  # Last view fractions reported by the text widget
+        self.recenter_pending = False
+
+        for tag, color in MARKER_TAGS.values():
+            self.text.tag_configure(tag, background=color)
+        self.text.tag_configure("search_hit", background="#ffd27f")
+
+        self.scrollbar.configure(command=self.on_scrollbar)
+        self.text.configure(yscrollcommand=self.on_text_scroll)
+
+    def set_document(self, document):
+        """Show a new document from its first page"""
+        self.document = document
+        self.clear()
+
+    def clear(self):
+        self.text.delete(1.0, tk.END)
+        for number in self.window:
+            self.text.mark_unset(f"page_{number}")
+        self.window = []
+        self.scrollbar.set(0.0, 1.0)
+
+    def render_window(self, first_position, top_number=None):
+        """Render WINDOW_PAGES pages starting around first_position and keep top_number at the top"""
+        pages = self.document.pages
+        first = max(0, min(first_position, len(pages) - WINDOW_PAGES))
+        window_pages = pages[first:first + WINDOW_PAGES]
+
+        self.clear()
+        if first == 0 and self.document.preamble:
+            self.text.insert(tk.END, self.document.preamble)
+
+        line, column = map(int, self.text.index("end-1c").split("."))
+        blocks = []
+        starts = []
+        for page in window_pages:
+            block = page.render(markup=False)
+            blocks.append(block)
+            starts.append((page.number, f"{line}.{column}"))
+            # Every page block ends with a newline, so the next one starts a line
+            line += block.count("\n")
+            column = 0
+        self.text.insert(tk.END, ''.join(blocks))
+
+        # Each page starts at a mark so it can be re-rendered on its own
+        for number, index in starts:
+            self.text.mark_set(f"page_{number}", index)
+        self.window = [page.number for page in window_pages]
+
+        # Tag the marker spans of the window, found in the span index by page range
+        if self.window:
+            lines = {number: int(index.split(".")[0]) + self.document.get_page(number).header_lines()
+                     for number, index in starts}
+            for flag, (tag, _) in MARKER_TAGS.items():
+                for number, line in self.document.markers.in_pages(flag, self.window[0], self.window[-1]):
+                    self.tag_line(tag, lines[number] + line)
+
+        if top_number in self.window:
+            self.text.yview(f"page_{top_number}")
+        self.update_scrollbar()
+
+    def position_of(self, page_number):
+        """Position of the page, or of the first page after it when it is not in the document"""
+        position = self.document.page_index.get(page_number)
+        if position is None:
+            position = bisect.bisect_left([page.number for page in self.document.pages], page_number)
+        return min(position, len(self.document.pages) - 1)
+
+    def jump_to(self, page_number, line=None):
+        """Show the given page at the top of the view, optionally scrolled to one of its lines
+
+        Returns the number of the page shown, the next one when the page is not in the document.
+        """
+        if not self.document.pages:
+            return None
+        position = self.position_of(page_number)
+        number = self.document.pages[position].number
+        if number not in self.window[1:-1]:
+            self.render_window(position - WINDOW_PAGES // 2, top_number=number)
+        if line is not None:
+            # Skip the leading text, the sentinel and the empty line after it
+            index = f"page_{number} + {self.document.get_page(number).header_lines() + line} lines"
+            self.text.yview(index)
+            self.text.see(index)
+        else:
+            self.text.yview(f"page_{number}")
+        return number
+
+    def show_hit(self, page_number, line):
+        """Jump to one displayed line of a page and highlight it, returns the number of the page shown"""
+        number = self.jump_to(page_number, line)
+        self.text.tag_remove("search_hit", "1.0", tk.END)
+        if number == page_number:
+            index = f"page_{number} + {self.document.get_page(number).header_lines() + line} lines"
+            self.text.tag_add("search_hit", f"{index} linestart", f"{index} lineend")
+        return number
+
+    def top_page(self):
+        """Number of the page at the top of the view, None when no page is rendered"""
+        if not self.window:
+            return None
+        top = self.text.index("@0,0")
+        for number in reversed(self.window):
+            if self.text.compare(f"page_{number}", "<=", top):
+                return number
+        return self.window[0]
+
+    def recenter(self):
+        """Re-render the window around the page at the top of the view"""
+        self.recenter_pending = False
+        number = self.top_page()
+        if number is None:
+            return
+        self.render_window(self.position_of(number) - WINDOW_PAGES // 2, top_number=number)
+
+    def reload(self):
+        """Re-render the window after the document changed, keeping the top page in view"""
+        number = self.top_page()
+        if number is None or not self.document.pages:
+            self.render_window(0)
+            return
+        self.render_window(self.position_of(number) - WINDOW_PAGES // 2, top_number=number)
+
+    def pages_inserted(self, page_numbers):
+        """Render newly inserted pages only when they belong in the window"""
+        if len(self.window) < WINDOW_PAGES or any(number <= self.window[-1] for number in page_numbers):
+            self.reload()
+        else:
+            self.update_scrollbar()
+
+    def render_pages(self, page_numbers):
+        """Replace the given pages in the text widget, pages outside the window are skipped"""
+        window = set(self.window)
+        for number in page_numbers:
+            if number not in window:
+                continue
+            position = self.window.index(number)
+            index = self.text.index(f"page_{number}")
+            end = f"page_{self.window[position + 1]}" if position + 1 < len(self.window) else "end-1c"
+            page = self.document.get_page(number)
+            self.text.delete(index, end)
+            self.text.insert(index, page.render(markup=False))
+            # Marks move right with inserted text, put this page's mark back at its start
+            self.text.mark_set(f"page_{number}", index)
+
+            first_line = int(index.split(".")[0]) + page.header_lines()
+            for line, flags in page.spans():
+                for flag, (tag, _) in MARKER_TAGS.items():
+                    if flags & flag:
+                        self.tag_line(tag, first_line + line)
+
+    def tag_line(self, tag, line):
+        # Include the newline so a hidden span takes its line with it
+        self.text.tag_add(tag, f"{line}.0", f"{line + 1}.0")
+
+    def set_marker_visible(self, flag, visible):
+        """Show or hide the spans of one marker kind, hidden spans stay in the document"""
+        self.text.tag_configure(MARKER_TAGS[flag][0], elide=not visible)
+
+    def update_scrollbar(self):
+        """Map the view inside the window to a position in the whole book"""
+        total = len(self.document.pages) if self.document is not None else 0
+        if not self.window or not total:
+            self.scrollbar.set(0.0, 1.0)
+            return
+        first = self.document.page_index[self.window[0]]
+        count = len(self.window)
+        low, high = self.view
+        self.scrollbar.set((first + low * count) / total, (first + high * count) / total)
+
+    def on_text_scroll(self, low, high):
+        """yscrollcommand of the text widget"""
+        self.view = (float(low), float(high))
+        self.update_scrollbar()
+        if not self.window or self.recenter_pending:
+            return
+
+        pages = self.document.pages
+        near_start = self.view[0] < EDGE_FRACTION and self.window[0] != pages[0].number
+        near_end = self.view[1] > 1 - EDGE_FRACTION and self.window[-1] != pages[-1].number
+        if near_start or near_end:
+            # Don't re-render from inside Tk's redisplay
+            self.recenter_pending = True
+            self.text.after_idle(self.recenter)
+
+    def on_scrollbar(self, *args):
+        """command of the synthetic scrollbar: moveto jumps to a page, scroll moves the text"""
+        if not self.document or not self.document.pages:
+            return
+        if args[0] == "moveto":
+            fraction = min(max(float(args[1]), 0.0), 1.0)
+            position = min(int(fraction * len(self.document.pages)), len(self.document.pages) - 1)
+            self.jump_to(self.document.pages[position].number)
+        elif args[0] == "scroll":
+            self.text.yview_scroll(int(args[1]), args[2])
@@ -0,0 +1,309 @@
+"""Watch-folder daemon: PDFs dropped into a folder are queued in SQLite and cleaned in the background"""
+import argparse
+import json
+import os
+import signal
+import sqlite3
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from book_batch import process_book
+from book_export import EXPORT_FORMATS, cleanup_settings
+from page_cache import default_cache_dir
+
+# Settings file of a watched folder, its keys are the book_batch options
+WATCH_CONFIG = "book_watch.json"
+
+CONFIG_KEYS = (
+    "start", "end", "contents_start", "contents_end", "pages", "contents_pages", "rules", "special_chars", "max_header_length",
+    "stages", "layout", "format", "page_workers", "output_dir",
+)
+
+# Cleaned books go to this subfolder of the watched folder unless the config names another
+DEFAULT_OUTPUT_DIR = "cleaned"
+
+# Seconds between scans, a file is queued once it is unchanged over one scan so half-written scans wait
+WATCH_POLL_SECONDS = 5.0
+
+# Jobs listed by --status
+STATUS_JOBS = 20
+
+
+def file_stamp(file_path):
+    stat = os.stat(file_path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def scan_folder(folder):
+    """(path, stamp) of the PDFs directly inside the folder"""
+    found = []
+    for path in sorted(Path(folder).iterdir()):
+        if path.suffix.lower() != ".pdf":
+            continue
+        try:
+            found.append((str(path), file_stamp(path)))
+        except OSError:
+            pass  # Moved away since the listing
+    return found
+
+
+def folder_options(folder):
+    """Output directory and process_book options of a watched folder, from its WATCH_CONFIG if it has one
+
+    Raises ValueError for a config that can't be used, so the folder's
+    jobs fail with the reason instead of running with the wrong settings.
+    """
+    config_path = Path(folder) / WATCH_CONFIG
+    config = {}
+    if config_path.exists():
+        try:
+            with open(config_path, encoding="utf-8") as f:
+                config = json.load(f)
+        except (OSError, ValueError) as e:
+            raise ValueError(f"Can't read {config_path}: {str(e)}")
+        if not isinstance(config, dict):
+            raise ValueError(f"{config_path} must hold a JSON object")
+    unknown = sorted(set(config) - set(CONFIG_KEYS))
+    if unknown:
+        raise ValueError(f"Unknown settings in {config_path}: {', '.join(unknown)}")
+    fmt = config.get("format", "txt")
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown format {fmt!r} in {config_path}, use one of: {', '.join(EXPORT_FORMATS)}")
+
+    rules, stages = cleanup_settings(
+        config.get("rules"), config.get("special_chars"), config.get("max_header_length"), config.get("stages", "all"))
+
+    output_dir = Path(folder) / config.get("output_dir", DEFAULT_OUTPUT_DIR)
+    options = dict(
+        start=config.get("start"),
+        end=config.get("end"),
+        contents_start=config.get("contents_start"),
+        contents_end=config.get("contents_end"),
+        pages=config.get("pages"),
+        contents_pages=config.get("contents_pages"),
+        rules=rules,
+        stages=stages,
+        page_workers=config.get("page_workers", 1),
+        fmt=fmt,
+        layout=bool(config.get("layout", False)),
+    )
+    return output_dir, options
+
+
+def ignore_interrupts():
+    """Worker initializer: Ctrl+C stops the daemon, which then stops the workers"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def run_job(file_path, output_dir, **options):
+    """Worker: clean one book, returns (output path, error, seconds) so failures are timed too"""
+    started = time.perf_counter()
+    try:
+        output_path = process_book(file_path, output_dir, **options)
+        return output_path, None, time.perf_counter() - started
+    except Exception as e:
+        return None, str(e), time.perf_counter() - started
+
+
+class JobStore:
+    """SQLite queue of the books found in the watched folders
+
+    A job is one version of a file, so a file replaced with a new scan is
+    queued again while a restart never queues the same version twice.
+    Jobs a stopped daemon left running are queued again on start.
+    """
+
+    def __init__(self, path=None):
+        self.path = Path(path) if path is not None else default_cache_dir() / "jobs.sqlite"
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.connection = sqlite3.connect(str(self.path), timeout=30)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY,
+                folder TEXT NOT NULL,
+                path TEXT NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                size INTEGER NOT NULL,
+                status TEXT NOT NULL,
+                queued_at REAL NOT NULL,
+                started_at REAL,
+                finished_at REAL,
+                seconds REAL,
+                output TEXT,
+                error TEXT,
+                UNIQUE (path, mtime_ns, size)
+            );
+            CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, id);
+        """)
+        self.connection.commit()
+
+    def enqueue(self, folder, file_path, stamp):
+        """Queue a version of a file, returns False when it was seen before"""
+        cursor = self.connection.execute(
+            "INSERT OR IGNORE INTO jobs (folder, path, mtime_ns, size, status, queued_at) "
+            "VALUES (?, ?, ?, ?, 'queued', ?)",
+            (str(folder), str(file_path), stamp[0], stamp[1], time.time())
+        )
+        self.connection.commit()
+        return cursor.rowcount == 1
+
+    def requeue_running(self):
+        """Queue the jobs a stopped daemon left running again, returns how many"""
+        cursor = self.connection.execute(
+            "UPDATE jobs SET status = 'queued', started_at = NULL WHERE status = 'running'")
+        self.connection.commit()
+        return cursor.rowcount
+
+    def start_jobs(self, limit):
+        """Mark up to limit queued jobs as running, oldest first, returns their (id, folder, path)"""
+        if limit <= 0:
+            return []
+        jobs = self.connection.execute(
+            "SELECT id, folder, path FROM jobs WHERE status = 'queued' ORDER BY id LIMIT ?", (limit,)
+        ).fetchall()
+        self.connection.executemany(
+            "UPDATE jobs SET status = 'running', started_at = ? WHERE id = ?",
+            [(time.time(), job[0]) for job in jobs]
+        )
+        self.connection.commit()
+        return jobs
+
+    def finish(self, job_id, output, error, seconds):
+        self.connection.execute(
+            "UPDATE jobs SET status = ?, finished_at = ?, seconds = ?, output = ?, error = ? WHERE id = ?",
+            ("failed" if error is not None else "done", time.time(), seconds, output, error, job_id)
+        )
+        self.connection.commit()
+
+    def counts(self):
+        """Number of jobs per status"""
+        return dict(self.connection.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+
+    def recent(self, limit=STATUS_JOBS):
+        """(path, status, seconds, output, error) of the latest jobs, newest first"""
+        return self.connection.execute(
+            "SELECT path, status, seconds, output, error FROM jobs ORDER BY id DESC LIMIT ?", (limit,)
+        ).fetchall()
+
+    def close(self):
+        self.connection.close()
+
+
+def watch(folders, store, jobs=1, poll_seconds=WATCH_POLL_SECONDS, cache_dir=None, cache_size_mb=None, once=False):
+    """Queue the PDFs showing up in the folders and clean them, at most jobs at a time
+
+    Runs until interrupted. With once set, the PDFs already there are
+    queued right away and it returns when the queue is empty. Returns the
+    number of failed jobs.
+    """
+    requeued = store.requeue_running()
+    if requeued:
+        print(f"Queued {requeued} interrupted jobs again")
+    previous = {}
+    running = {}  # Future -> (job id, path)
+    failed = 0
+    pool = ProcessPoolExecutor(max_workers=jobs, initializer=ignore_interrupts)
+    try:
+        while True:
+            current = {}
+            for folder in folders:
+                for path, stamp in scan_folder(folder):
+                    current[path] = stamp
+                    # Wait for the file to stop changing, a scanner may still be writing it
+                    if (once or previous.get(path) == stamp) and store.enqueue(folder, path, stamp):
+                        print(f"Queued {path}")
+            previous = current
+
+            for job_id, folder, path in store.start_jobs(jobs - len(running)):
+                try:
+                    output_dir, options = folder_options(folder)
+                except Exception as e:
+                    store.finish(job_id, None, str(e), 0.0)
+                    failed += 1
+                    print(f"Error processing {path}: {str(e)}", file=sys.stderr)
+                    continue
+                future = pool.submit(run_job, path, output_dir, cache_dir=cache_dir, cache_size_mb=cache_size_mb,
+                                     **options)
+                running[future] = (job_id, path)
+
+            if not running:
+                if once:
+                    return failed
+                time.sleep(poll_seconds)
+                continue
+
+            done, _ = wait(running, timeout=poll_seconds, return_when=FIRST_COMPLETED)
+            for future in done:
+                job_id, path = running.pop(future)
+                try:
+                    output_path, error, seconds = future.result()
+                except BrokenProcessPool as e:
+                    output_path, error, seconds = None, f"Worker process died: {str(e)}", 0.0
+                store.finish(job_id, output_path, error, seconds)
+                if error is not None:
+                    failed += 1
+                    print(f"Error processing {path} ({seconds:.1f}s): {error}", file=sys.stderr)
+                else:
+                    print(f"Processed {path} -> {output_path} ({seconds:.1f}s)")
+            if any(isinstance(future.exception(), BrokenProcessPool) for future in done):
+                # The other jobs of a broken pool fail too, start over with a fresh one
+                pool.shutdown(wait=False, cancel_futures=True)
+                pool = ProcessPoolExecutor(max_workers=jobs, initializer=ignore_interrupts)
+    finally:
+        # Jobs still running are queued again on the next start
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def print_status(store):
+    counts = store.counts()
+    print(", ".join(f"{counts.get(status, 0)} {status}" for status in ("queued", "running", "done", "failed")))
+    for path, status, seconds, output, error in store.recent():
+        timing = f" ({seconds:.1f}s)" if seconds is not None else ""
+        detail = f": {error}" if error else (f" -> {output}" if output else "")
+        print(f"{status:<8}{path}{timing}{detail}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description=f"Watch folders for PDFs and clean them as they arrive, each folder's {WATCH_CONFIG} "
+                    f"sets its page ranges, marker rules and output")
+    parser.add_argument("folders", nargs="*", help="Folders to watch")
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="Books cleaned at the same time")
+    parser.add_argument("--poll", type=float, default=WATCH_POLL_SECONDS, help="Seconds between folder scans")
+    parser.add_argument("--db", help="Job queue database, defaults to jobs.sqlite in the cache directory")
+    parser.add_argument("--once", action="store_true", help="Clean the PDFs already there and exit")
+    parser.add_argument("--status", action="store_true", help="Show the queue and the latest jobs and exit")
+    parser.add_argument("--cache-dir", help="Directory of the extraction cache, no caching when omitted")
+    parser.add_argument("--cache-size-mb", type=float, help="Size cap of the extraction cache")
+    args = parser.parse_args(argv)
+
+    if not args.status:
+        if not args.folders:
+            parser.error("Please name at least one folder to watch")
+        missing = [folder for folder in args.folders if not os.path.isdir(folder)]
+        if missing:
+            parser.error(f"Not a folder: {', '.join(missing)}")
+        if args.jobs < 1:
+            parser.error("--jobs must be at least 1")
+
+    store = JobStore(args.db)
+    try:
+        if args.status:
+            print_status(store)
+            return 0
+        print(f"Watching {', '.join(args.folders)}, {args.jobs} jobs at a time")
+        failed = watch([os.path.abspath(folder) for folder in args.folders], store, args.jobs, args.poll,
+                       args.cache_dir, args.cache_size_mb, args.once)
+    except KeyboardInterrupt:
+        print("Stopped, unfinished jobs run again on the next start")
+        return 0
+    finally:
+        store.close()
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,214 @@
+"""Books open side by side: an LRU of open PDFs, one extraction pool for all of them and the state of each book"""
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+
+import book_engine
+
+# Open fitz documents kept around, every one holds a file handle and its page tree
+MAX_OPEN_DOCUMENTS = 8
+
+# Books whose extracted pages stay in memory while in the background, the others are extracted again
+# (from the page cache) when their tab comes back
+MAX_LOADED_BOOKS = 4
+
+
+def file_stamp(file_path):
+    """Modification time and size, a document opened before the file changed is opened again"""
+    stat = os.stat(file_path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+class OpenDocument:
+    __slots__ = ("doc", "stamp", "leased")
+
+    def __init__(self, doc, stamp):
+        self.doc = doc
+        self.stamp = stamp
+        self.leased = True
+
+
+class OpenDocuments:
+    """LRU of open fitz documents keyed by file path
+
+    A fitz document must not be used from two threads at once, so
+    acquire() lends a document to one caller until release(). While it is
+    lent out, acquiring the same file opens a private document that is
+    closed on release. Once more than max_documents are open, the least
+    recently used documents nobody holds are closed.
+    """
+
+    def __init__(self, max_documents=MAX_OPEN_DOCUMENTS):
+        self.max_documents = max_documents
+        self.lock = threading.Lock()
+        self.documents = OrderedDict()  # Absolute path -> OpenDocument, least recently used first
+        self.opened = 0  # fitz.open calls, to check the LRU is doing its job
+
+    def acquire(self, file_path):
+        """Open document of the file, hand it back with release()"""
+        key = os.path.abspath(file_path)
+        stamp = file_stamp(key)
+        with self.lock:
+            entry = self.documents.get(key)
+            if entry is not None and not entry.leased:
+                if entry.stamp == stamp:
+                    entry.leased = True
+                    self.documents.move_to_end(key)
+                    return entry.doc
+                del self.documents[key]
+                entry.doc.close()
+                entry = None
+            self.opened += 1
+        doc = book_engine.open_pdf(file_path)
+        with self.lock:
+            if entry is None and key not in self.documents:
+                self.documents[key] = OpenDocument(doc, stamp)
+                self._close_unused()
+        return doc
+
+    def release(self, doc):
+        with self.lock:
+            for entry in self.documents.values():
+                if entry.doc is doc:
+                    entry.leased = False
+                    self._close_unused()
+                    return
+        # A private document, or one dropped from the LRU while lent out
+        doc.close()
+
+    @contextmanager
+    def document(self, file_path):
+        doc = self.acquire(file_path)
+        try:
+            yield doc
+        finally:
+            self.release(doc)
+
+    def page_count(self, file_path):
+        with self.document(file_path) as doc:
+            return doc.page_count
+
+    def _close_unused(self):
+        for key in list(self.documents):
+            if len(self.documents) <= self.max_documents:
+                break
+            if not self.documents[key].leased:
+                self.documents.pop(key).doc.close()
+
+    def close_all(self):
+        """Close the documents nobody holds and forget the others, they are closed on release"""
+        with self.lock:
+            documents = list(self.documents.values())
+            self.documents.clear()
+        for entry in documents:
+            if not entry.leased:
+                entry.doc.close()
+
+
+class SharedPool:
+    """One process pool the extractions of every open book submit their chunks to
+
+    The pool is started on first use with the worker count asked for. A
+    new count starts a new pool; the old one is left to the extractions
+    still using it and shuts down once they drop it.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pool = None
+        self.workers = 0
+
+    def get(self, workers):
+        with self.lock:
+            if self.pool is None or workers != self.workers:
+                self.pool = ProcessPoolExecutor(max_workers=workers)
+                self.workers = workers
+            return self.pool
+
+    def discard(self, pool):
+        """Drop a pool that broke, the next get() starts a new one"""
+        with self.lock:
+            if self.pool is pool:
+                self.pool = None
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def shutdown(self):
+        with self.lock:
+            pool, self.pool = self.pool, None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+
+class BookTab:
+    """One open book: its file and, while its tab is in the background, the app state that belongs to it"""
+
+    def __init__(self, file_path=None):
+        self.file_path = file_path
+        self.state = {}
+        self.unloaded_pages = None  # Page numbers to extract again when the pages were dropped from memory
+
+    def title(self):
+        return os.path.basename(self.file_path) if self.file_path else "No book"
+
+
+class Workspace:
+    """The open books in tab order, the one shown, and the resources they share"""
+
+    def __init__(self, max_documents=MAX_OPEN_DOCUMENTS, max_loaded_books=MAX_LOADED_BOOKS):
+        self.tabs = []
+        self.active = None
+        self.recent = []  # Tabs from least to most recently shown
+        self.max_loaded_books = max_loaded_books
+        self.documents = OpenDocuments(max_documents)
+        self.pool = SharedPool()
+
+    def add(self, tab):
+        self.tabs.append(tab)
+        return tab
+
+    def remove(self, tab):
+        self.tabs.remove(tab)
+        if tab in self.recent:
+            self.recent.remove(tab)
+
+    def find(self, file_path):
+        """Tab of the file, None when it is not open"""
+        key = os.path.abspath(file_path)
+        for tab in self.tabs:
+            if tab.file_path is not None and os.path.abspath(tab.file_path) == key:
+                return tab
+        return None
+
+    def activate(self, tab):
+        self.active = tab
+        if tab in self.recent:
+            self.recent.remove(tab)
+        self.recent.append(tab)
+
+    def tabs_to_unload(self):
+        """Background tabs whose pages can be dropped, least recently shown first
+
+        Only books past max_loaded_books are dropped, and never one that is
+        still extracting or has operations to undo, since those pages can't
+        simply be extracted again.
+        """
+        loaded = [tab for tab in self.recent if tab.unloaded_pages is None and tab.state.get("document") is not None
+                  and tab.state["document"].pages]
+        if self.active is not None and self.active not in loaded:
+            loaded.append(self.active)
+        excess = len(loaded) - self.max_loaded_books
+        tabs = []
+        for tab in loaded:
+            if excess <= 0:
+                break
+            if tab is self.active or tab.state.get("extraction_queue") is not None or tab.state["history"].can_undo():
+                continue
+            tabs.append(tab)
+            excess -= 1
+        return tabs
+
+    def close(self):
+        self.pool.shutdown()
+        self.documents.close_all()
@@ -0,0 +1,94 @@
+"""Single-pass cleanup of extracted pages with a configurable set of stages"""
+from book_document import ENDNOTE, HEADER, PAGE_NUMBER
+from marker_rules import DEFAULT_RULES
+
+# Stages in the order of the buttons of the app, selected stages always run in this order
+STAGES = (
+    "mark_endnotes",
+    "remove_endnotes",
+    "mark_headers",
+    "remove_headers",
+    "mark_page_numbers",
+    "remove_page_numbers",
+)
+
+STAGE_LABELS = {
+    "mark_endnotes": "Mark Endnotes",
+    "remove_endnotes": "Remove Endnotes",
+    "mark_headers": "Mark Headers",
+    "remove_headers": "Remove Headers",
+    "mark_page_numbers": "Mark Page N",
+    "remove_page_numbers": "Remove Page N",
+}
+
+
+class CleanupPipeline:
+    """Runs the selected stages over each page in one pass
+
+    The result is the same as pressing the matching buttons one after the
+    other: every stage only looks at its own page, except header marking,
+    which needs to know whether the previous page counted as empty at the
+    time its header was marked. That state is carried from page to page,
+    and starts over after a gap in a page selection like "1-3, 45-60".
+    """
+
+    def __init__(self, stages=STAGES, rules=DEFAULT_RULES):
+        unknown = set(stages) - set(STAGES)
+        if unknown:
+            raise ValueError(f"Unknown cleanup stages: {', '.join(sorted(unknown))}")
+        self.stages = [stage for stage in STAGES if stage in stages]
+        self.rules = rules.compile()
+
+    def process(self, pages, recorder=None):
+        """Run the stages over pages as they come, yields (page, changed) pairs
+
+        A recorder is called with the number and the state from before of
+        each page the stages changed, see BookDocument.recorder.
+        """
+        previous_page_empty = True
+        previous_number = None
+        for page in pages:
+            if previous_number is not None and page.number != previous_number + 1:
+                previous_page_empty = True  # The page before wasn't selected, start over like a range does
+            previous_number = page.number
+            before = page.state() if recorder is not None else None
+            changed = False
+            for stage in self.stages:
+                if stage == "mark_endnotes":
+                    changed |= page.mark_endnotes(self.rules)
+                elif stage == "remove_endnotes":
+                    changed |= page.remove_flagged(ENDNOTE)
+                elif stage == "mark_headers":
+                    changed |= page.mark_header(previous_page_empty, self.rules)
+                    if page.lines:
+                        previous_page_empty = page.counts_as_empty()
+                elif stage == "remove_headers":
+                    changed |= page.remove_flagged(HEADER)
+                elif stage == "mark_page_numbers":
+                    changed |= page.mark_page_numbers(self.rules)
+                elif stage == "remove_page_numbers":
+                    changed |= page.remove_flagged(PAGE_NUMBER)
+            if changed and recorder is not None:
+                recorder(page.number, before)
+            yield page, changed
+
+    def run(self, document):
+        """Clean every page of a BookDocument, returns the numbers of changed pages"""
+        # Header and page number marks alone leave the displayed lines as they were
+        lines_changed = any(stage not in ("mark_headers", "mark_page_numbers") for stage in self.stages)
+        return document.pages_changed(
+            [page.number for page, changed in self.process(document.pages, document.recorder) if changed],
+            lines_changed)
+
+
+def layout_stages(stages):
+    """The stages still needed for pages built with Page.from_layout, whose markers are already flagged"""
+    return [stage for stage in stages if not stage.startswith("mark_")]
+
+
+def parse_stages(text):
+    """Parse a comma separated stage list, "all" selects every stage"""
+    names = [name.strip() for name in text.split(",") if name.strip()]
+    if not names or names == ["all"]:
+        return list(STAGES)
+    return names
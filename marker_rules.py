@@ -0,0 +1,163 @@
+"""Declarative marker detection rules, compiled once into combined regexes"""
+import json
+import os
+import re
+from functools import lru_cache
+from pathlib import Path
+
+# Defaults matching the parameter panel of the app
+DEFAULT_SPECIAL_CHARS = "* † ‡ § # ¶ ∥"
+DEFAULT_MAX_HEADER_LENGTH = 50
+DEFAULT_PAGE_NUMBER_PATTERN = r'[\d\W]+'  # Digits and non-word characters only
+
+# Where publisher rules are saved unless BOOK_SUMMARY_RULES_DIR says otherwise
+DEFAULT_RULES_DIR = Path.home() / ".config" / "book_summary" / "rules"
+
+
+class MarkerRules:
+    """Rules for the endnote, header and page number detectors
+
+    endnote_prefixes are the Starting Chars of the Endnotes panel, and
+    endnote_patterns are extra regexes an endnote line can start with.
+    Header lines are shorter than max_header_length and don't match any of
+    header_exclude_patterns. Page number lines fully match
+    page_number_pattern once stripped.
+    """
+
+    def __init__(self, endnote_prefixes=None, endnote_patterns=(), max_header_length=DEFAULT_MAX_HEADER_LENGTH,
+                 header_exclude_patterns=(), page_number_pattern=DEFAULT_PAGE_NUMBER_PATTERN):
+        if endnote_prefixes is None:
+            endnote_prefixes = DEFAULT_SPECIAL_CHARS.split()
+        self.endnote_prefixes = list(endnote_prefixes)
+        self.endnote_patterns = list(endnote_patterns)
+        self.max_header_length = int(max_header_length)
+        self.header_exclude_patterns = list(header_exclude_patterns)
+        self.page_number_pattern = page_number_pattern
+
+    @classmethod
+    def from_entries(cls, special_chars, max_header_length, base=None):
+        """Rules from the parameter entries, keeping the extra patterns of base"""
+        base = base if base is not None else cls()
+        return cls(
+            [char.strip() for char in special_chars.split()],
+            base.endnote_patterns,
+            max_header_length,
+            base.header_exclude_patterns,
+            base.page_number_pattern,
+        )
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(
+            data.get("endnote_prefixes"),
+            data.get("endnote_patterns", ()),
+            data.get("max_header_length", DEFAULT_MAX_HEADER_LENGTH),
+            data.get("header_exclude_patterns", ()),
+            data.get("page_number_pattern", DEFAULT_PAGE_NUMBER_PATTERN),
+        )
+
+    def to_dict(self):
+        return {
+            "endnote_prefixes": self.endnote_prefixes,
+            "endnote_patterns": self.endnote_patterns,
+            "max_header_length": self.max_header_length,
+            "header_exclude_patterns": self.header_exclude_patterns,
+            "page_number_pattern": self.page_number_pattern,
+        }
+
+    def special_chars(self):
+        """The endnote prefixes as shown in the Starting Chars entry"""
+        return " ".join(self.endnote_prefixes)
+
+    def key(self):
+        return (
+            tuple(self.endnote_prefixes),
+            tuple(self.endnote_patterns),
+            self.max_header_length,
+            tuple(self.header_exclude_patterns),
+            self.page_number_pattern,
+        )
+
+    def compile(self):
+        """Compiled form of these rules, shared by every set of rules with the same values"""
+        return _compile(self.key())
+
+
+class CompiledRules:
+    """The regexes built from a MarkerRules, one match call per line and detector"""
+    __slots__ = ("endnote_start", "max_header_length", "header_exclude", "page_number")
+
+    def __init__(self, endnote_prefixes, endnote_patterns, max_header_length, header_exclude_patterns,
+                 page_number_pattern):
+        # One alternation for all endnote starts, longest prefixes first
+        alternatives = [re.escape(prefix) for prefix in sorted(endnote_prefixes, key=len, reverse=True) if prefix]
+        alternatives += [f"(?:{pattern})" for pattern in endnote_patterns]
+        self.endnote_start = re.compile(r"\s*(?:" + "|".join(alternatives) + ")") if alternatives else None
+
+        self.max_header_length = max_header_length
+        self.header_exclude = (
+            re.compile("|".join(f"(?:{pattern})" for pattern in header_exclude_patterns))
+            if header_exclude_patterns else None
+        )
+        self.page_number = re.compile(page_number_pattern)
+
+    def is_endnote_start(self, line):
+        """Check if the line starts with one of the endnote characters or patterns"""
+        return self.endnote_start is not None and self.endnote_start.match(line) is not None
+
+    def is_header_candidate(self, stripped_line):
+        """Check the length, standalone number and exclusion conditions of a header line"""
+        return (
+            len(stripped_line) < self.max_header_length and
+            not stripped_line.replace(" ", "").isnumeric() and  # Skip standalone numbers
+            (self.header_exclude is None or self.header_exclude.match(stripped_line) is None)
+        )
+
+    def is_page_number(self, line):
+        """Check if the stripped line fully matches the page number pattern"""
+        return self.page_number.fullmatch(line.strip()) is not None
+
+
+@lru_cache(maxsize=32)
+def _compile(key):
+    return CompiledRules(*key)
+
+
+DEFAULT_RULES = MarkerRules()
+
+
+def rules_dir():
+    return Path(os.environ.get("BOOK_SUMMARY_RULES_DIR") or DEFAULT_RULES_DIR)
+
+
+def _rules_path(publisher):
+    # Keep publisher names usable as file names
+    name = re.sub(r'[^\w\- ]+', '_', publisher).strip()
+    if not name:
+        raise ValueError("Please enter a publisher name")
+    return rules_dir() / f"{name}.json"
+
+
+def list_publishers():
+    """Names of the publishers with saved rules"""
+    directory = rules_dir()
+    if not directory.is_dir():
+        return []
+    return sorted(path.stem for path in directory.glob("*.json"))
+
+
+def save_publisher_rules(publisher, rules):
+    """Save rules under a publisher name, checking that they compile first"""
+    rules.compile()
+    path = _rules_path(publisher)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(rules.to_dict(), ensure_ascii=False, indent=2), encoding="utf-8")
+    return path
+
+
+def load_publisher_rules(publisher):
+    """Load the rules saved under a publisher name"""
+    path = _rules_path(publisher)
+    if not path.is_file():
+        raise ValueError(f"No rules saved for publisher '{publisher}'")
+    return MarkerRules.from_dict(json.loads(path.read_text(encoding="utf-8")))
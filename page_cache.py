@@ -0,0 +1,286 @@
+"""Persistent cache of extracted page text, keyed by PDF content hash, and of per-page fingerprints"""
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+# Where the cache lives unless BOOK_SUMMARY_CACHE_DIR says otherwise
+DEFAULT_CACHE_DIR = Path.home() / ".cache" / "book_summary"
+
+# Size cap of the cached page text, BOOK_SUMMARY_CACHE_MB overrides it
+DEFAULT_MAX_MB = 512
+
+# Writes are committed in batches of this many pages
+COMMIT_EVERY = 64
+
+# Eviction frees space down to this share of the size cap, so a full cache isn't evicted from on every flush
+EVICT_TO = 0.9
+
+
+def default_cache_dir():
+    return Path(os.environ.get("BOOK_SUMMARY_CACHE_DIR") or DEFAULT_CACHE_DIR)
+
+
+def default_max_bytes():
+    try:
+        return int(float(os.environ.get("BOOK_SUMMARY_CACHE_MB", DEFAULT_MAX_MB)) * 1024 * 1024)
+    except ValueError:
+        return DEFAULT_MAX_MB * 1024 * 1024
+
+
+def hash_file(file_path, block_size=1024 * 1024):
+    """SHA-256 of the file content"""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class PageCache:
+    """SQLite store of per-page text with a size cap and least-recently-used eviction
+
+    Page fingerprints are kept next to the text, so a new edition of a
+    book can take the text of its unchanged pages from the old one.
+    Safe to share between the Tk thread and the extraction thread, and
+    between batch worker processes pointing at the same directory.
+    """
+
+    def __init__(self, cache_dir=None, max_bytes=None):
+        self.cache_dir = Path(cache_dir) if cache_dir is not None else default_cache_dir()
+        self.max_bytes = max_bytes if max_bytes is not None else default_max_bytes()
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.path = self.cache_dir / "pages.sqlite"
+
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(str(self.path), timeout=30, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS pages (
+                file_hash TEXT NOT NULL,
+                page_num INTEGER NOT NULL,
+                flags INTEGER NOT NULL,
+                text TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (file_hash, page_num, flags)
+            );
+            CREATE INDEX IF NOT EXISTS pages_last_used ON pages (last_used);
+            CREATE TABLE IF NOT EXISTS fingerprints (
+                file_hash TEXT NOT NULL,
+                page_num INTEGER NOT NULL,
+                fingerprint TEXT NOT NULL,
+                PRIMARY KEY (file_hash, page_num)
+            );
+            CREATE INDEX IF NOT EXISTS fingerprints_fingerprint ON fingerprints (fingerprint);
+            CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime REAL NOT NULL,
+                file_hash TEXT NOT NULL
+            );
+        """)
+        self.connection.commit()
+
+        # Bytes of cached text, kept current by the writes and evictions below instead of summed on every flush
+        self.total_bytes = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM pages").fetchone()[0]
+        self.pending_writes = 0
+        self.hits = 0
+        self.misses = 0
+        self.reused = 0  # Misses whose text came from an earlier edition
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+        self.reused = 0
+
+    def file_hash(self, file_path):
+        """Content hash of a file, re-hashed only when its size or mtime changed"""
+        file_path = os.path.abspath(file_path)
+        stat = os.stat(file_path)
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT size, mtime, file_hash FROM files WHERE path = ?", (file_path,)
+            ).fetchone()
+        if row is not None and row[0] == stat.st_size and row[1] == stat.st_mtime:
+            return row[2]
+
+        digest = hash_file(file_path)
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO files (path, size, mtime, file_hash) VALUES (?, ?, ?, ?)",
+                (file_path, stat.st_size, stat.st_mtime, digest)
+            )
+            self.connection.commit()
+        return digest
+
+    def search_index_path(self, file_hash):
+        """Where the search index of a PDF is saved, next to the cached page text"""
+        return self.cache_dir / "search" / f"{file_hash}.json"
+
+    def cached_pages(self, file_hash, page_nums, flags):
+        """The given 0-based pages that are in the cache, as a set, without reading their text"""
+        page_nums = list(page_nums)
+        found = set()
+        with self.lock:
+            for i in range(0, len(page_nums), 500):
+                batch = page_nums[i:i + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self.connection.execute(
+                    f"SELECT page_num FROM pages WHERE file_hash = ? AND flags = ? "
+                    f"AND page_num IN ({placeholders})",
+                    [file_hash, flags] + batch
+                ).fetchall()
+                found.update(row[0] for row in rows)
+        return found
+
+    def get_many(self, file_hash, page_nums, flags):
+        """Cached text for the given 0-based pages, as a dict of page_num -> text"""
+        page_nums = list(page_nums)
+        found = {}
+        with self.lock:
+            # Stay well below SQLite's limit on query parameters
+            for i in range(0, len(page_nums), 500):
+                batch = page_nums[i:i + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self.connection.execute(
+                    f"SELECT page_num, text FROM pages WHERE file_hash = ? AND flags = ? "
+                    f"AND page_num IN ({placeholders})",
+                    [file_hash, flags] + batch
+                ).fetchall()
+                found.update(rows)
+
+            # Touch the hits so they are evicted last
+            if found:
+                now = time.time()
+                self.connection.executemany(
+                    "UPDATE pages SET last_used = ? WHERE file_hash = ? AND page_num = ? AND flags = ?",
+                    [(now, file_hash, page_num, flags) for page_num in found]
+                )
+                self.connection.commit()
+
+        self.hits += len(found)
+        self.misses += len(page_nums) - len(found)
+        return found
+
+    def put(self, file_hash, page_num, flags, text):
+        """Store the text of a 0-based page"""
+        with self.lock:
+            self._store(file_hash, page_num, flags, text)
+            self.pending_writes += 1
+            if self.pending_writes < COMMIT_EVERY:
+                return
+        self.flush()
+
+    def put_fingerprints(self, file_hash, fingerprints):
+        """Store the fingerprints of 0-based pages, a dict of page_num -> fingerprint"""
+        if not fingerprints:
+            return
+        with self.lock:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO fingerprints (file_hash, page_num, fingerprint) VALUES (?, ?, ?)",
+                [(file_hash, page_num, fingerprint) for page_num, fingerprint in fingerprints.items()]
+            )
+            self.pending_writes += len(fingerprints)
+            if self.pending_writes < COMMIT_EVERY:
+                return
+        self.flush()
+
+    def stored_fingerprints(self, file_path):
+        """Fingerprints of the file's pages as it was when last hashed, as a dict of 0-based page_num -> fingerprint
+
+        The file is not hashed again, so this still finds the pages of an
+        edition the file has since been overwritten with a newer one.
+        """
+        with self.lock:
+            return dict(self.connection.execute(
+                "SELECT f.page_num, f.fingerprint FROM files JOIN fingerprints f USING (file_hash) "
+                "WHERE files.path = ?",
+                (os.path.abspath(file_path),)
+            ).fetchall())
+
+    def edition_matches(self, file_hash, fingerprints, flags):
+        """How many of the fingerprinted pages each other cached file has, as a dict of file hash -> pages"""
+        matches = {}
+        with self.lock:
+            for fingerprint in fingerprints.values():
+                for (source,) in self.connection.execute(
+                    "SELECT DISTINCT f.file_hash FROM fingerprints f JOIN pages p USING (file_hash, page_num) "
+                    "WHERE f.fingerprint = ? AND p.flags = ? AND f.file_hash != ?",
+                    (fingerprint, flags, file_hash)
+                ):
+                    matches[source] = matches.get(source, 0) + 1
+        return matches
+
+    def reuse_pages(self, file_hash, fingerprints, flags, source):
+        """Copy the text of the pages the earlier edition source has with the same fingerprint
+
+        source is the file hash of that edition, see edition_matches.
+        Returns the 0-based pages copied.
+        """
+        reused = set()
+        with self.lock:
+            for page_num, fingerprint in fingerprints.items():
+                row = self.connection.execute(
+                    "SELECT p.text FROM fingerprints f JOIN pages p USING (file_hash, page_num) "
+                    "WHERE f.fingerprint = ? AND p.flags = ? AND f.file_hash = ? LIMIT 1",
+                    (fingerprint, flags, source)
+                ).fetchone()
+                if row is None:
+                    continue
+                self._store(file_hash, page_num, flags, row[0])
+                reused.add(page_num)
+            self.connection.commit()
+        self.reused += len(reused)
+        return reused
+
+    def _store(self, file_hash, page_num, flags, text):
+        """Write a page's text and count its bytes, the caller holds the lock"""
+        size = len(text.encode("utf-8"))
+        old = self.connection.execute(
+            "SELECT size FROM pages WHERE file_hash = ? AND page_num = ? AND flags = ?", (file_hash, page_num, flags)
+        ).fetchone()
+        self.connection.execute(
+            "INSERT OR REPLACE INTO pages (file_hash, page_num, flags, text, size, last_used) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (file_hash, page_num, flags, text, size, time.time())
+        )
+        self.total_bytes += size - (old[0] if old is not None else 0)
+
+    def flush(self):
+        """Commit pending pages and evict the least recently used ones over the size cap"""
+        with self.lock:
+            self.connection.commit()
+            self.pending_writes = 0
+            if self.total_bytes <= self.max_bytes:
+                return
+
+            # Other processes sharing the cache write and evict too, count again before evicting
+            total = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM pages").fetchone()[0]
+            evict = []
+            if total > self.max_bytes:
+                for rowid, size in self.connection.execute("SELECT rowid, size FROM pages ORDER BY last_used"):
+                    if total <= self.max_bytes * EVICT_TO:
+                        break
+                    evict.append((rowid,))
+                    total -= size
+            self.total_bytes = total
+            if not evict:
+                return
+            self.connection.executemany("DELETE FROM pages WHERE rowid = ?", evict)
+            # Fingerprints are only needed while their file has pages to share
+            self.connection.execute(
+                "DELETE FROM fingerprints WHERE file_hash NOT IN (SELECT DISTINCT file_hash FROM pages)")
+            self.connection.commit()
+
+    def stats(self):
+        """Hit/miss summary for the status bar"""
+        reused = f", {self.reused} from an earlier edition" if self.reused else ""
+        return f"cache {self.hits} hits / {self.misses} misses{reused}"
+
+    def close(self):
+        self.flush()
+        with self.lock:
+            self.connection.close()
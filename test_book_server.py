@@ -0,0 +1,132 @@
+"""In-process tests of book_server: a BookServer on port 0 driven over HTTP"""
+import asyncio
+import http.client
+import json
+import os
+import tempfile
+import threading
+import unittest
+import fitz
+from book_server import BookServer
+
+
+def make_pdf(file_path, pages=3):
+    doc = fitz.open()
+    for number in range(1, pages + 1):
+        page = doc.new_page()
+        page.insert_text((72, 72), f"Chapter {number}")
+        page.insert_text((72, 100), f"Text of page {number} in the test book.")
+    doc.save(file_path)
+    doc.close()
+
+
+class BookServerTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.folder = tempfile.TemporaryDirectory()
+        cls.outside = tempfile.TemporaryDirectory()
+        cls.pdf_path = os.path.join(cls.folder.name, "book.pdf")
+        cls.outside_path = os.path.join(cls.outside.name, "book.pdf")
+        make_pdf(cls.pdf_path)
+        make_pdf(cls.outside_path)
+
+        cls.server = BookServer(workers=1, max_requests=2, timeout=60, allowed_dirs=[cls.folder.name])
+        cls.loop = asyncio.new_event_loop()
+        cls.thread = threading.Thread(target=cls.loop.run_forever, daemon=True)
+        cls.thread.start()
+        cls.listener = asyncio.run_coroutine_threadsafe(cls.server.start("127.0.0.1", 0), cls.loop).result(10)
+        cls.port = cls.listener.sockets[0].getsockname()[1]
+
+    @classmethod
+    def tearDownClass(cls):
+        asyncio.run_coroutine_threadsafe(cls.stop_listener(), cls.loop).result(10)
+        cls.loop.call_soon_threadsafe(cls.loop.stop)
+        cls.thread.join(10)
+        cls.loop.close()
+        cls.server.close()
+        cls.folder.cleanup()
+        cls.outside.cleanup()
+
+    @classmethod
+    async def stop_listener(cls):
+        """Stop listening and let the connections still closing finish"""
+        cls.listener.close()
+        await cls.listener.wait_closed()
+        current = asyncio.current_task()
+        await asyncio.gather(*[task for task in asyncio.all_tasks() if task is not current])
+
+    def request(self, method, target, body=None, headers=None):
+        """Status and body text of one request"""
+        connection = http.client.HTTPConnection("127.0.0.1", self.port, timeout=60)
+        try:
+            connection.request(method, target, body=body, headers=headers or {})
+            response = connection.getresponse()
+            return response.status, response.read().decode("utf-8")
+        finally:
+            connection.close()
+
+    def extract_path(self, file_path, query=""):
+        body = json.dumps({"path": file_path})
+        return self.request("POST", "/extract" + query, body, {"Content-Type": "application/json"})
+
+    def test_health(self):
+        status, body = self.request("GET", "/health")
+        self.assertEqual(status, 200)
+        health = json.loads(body)
+        self.assertEqual(health["status"], "ok")
+        self.assertEqual(health["max_requests"], 2)
+
+    def test_upload(self):
+        with open(self.pdf_path, "rb") as f:
+            data = f.read()
+        status, body = self.request("POST", "/extract", data, {"Content-Type": "application/pdf"})
+        self.assertEqual(status, 200)
+        records = [json.loads(line) for line in body.splitlines()]
+        pages = [record for record in records if record.get("type") == "page"]
+        self.assertEqual([page["page"] for page in pages], [1, 2, 3])
+        self.assertIn("Text of page 2", pages[1]["text"])
+        self.assertFalse([record for record in records if record.get("type") == "error"])
+
+    def test_allowed_path(self):
+        status, body = self.extract_path(self.pdf_path, "?format=txt")
+        self.assertEqual(status, 200)
+        self.assertIn("Text of page 3", body)
+
+    def test_path_outside_allowed_dirs(self):
+        status, body = self.extract_path(self.outside_path)
+        self.assertEqual(status, 403)
+        self.assertIn("error", json.loads(body))
+
+    def test_bad_parameter(self):
+        status, _ = self.extract_path(self.pdf_path, "?start=first")
+        self.assertEqual(status, 400)
+        status, _ = self.extract_path(self.pdf_path, "?format=docx")
+        self.assertEqual(status, 400)
+        status, _ = self.extract_path(self.pdf_path, "?start=9")
+        self.assertEqual(status, 400)
+
+    def test_busy(self):
+        # No room for any request, so the earlier ones still finishing don't matter
+        self.server.max_requests = 0
+        try:
+            status, body = self.extract_path(self.pdf_path)
+        finally:
+            self.server.max_requests = 2
+        self.assertEqual(status, 503)
+        self.assertIn("Busy", json.loads(body)["error"])
+
+    def test_broken_pool(self):
+        broken = self.server.pool
+        # A worker exiting breaks the pool the way a crash in MuPDF would
+        with self.assertRaises(Exception):
+            broken.submit(os._exit, 1).result(30)
+        status, _ = self.extract_path(self.pdf_path)
+        self.assertEqual(status, 503)
+        self.assertIsNot(self.server.pool, broken)
+        status, _ = self.extract_path(self.pdf_path)
+        self.assertEqual(status, 200)
+
+
+if __name__ == "__main__":
+    unittest.main()